@@ -1,6 +1,7 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from utils.supabase_client import supabase
+from utils.auth import token_cache, jwt_verifier, token_expiry
 from pydantic import BaseModel
 import logging
 
@@ -13,32 +14,57 @@ class User(BaseModel):
     email: str | None = None
     workspace_id: str | None = None  # To be populated from metadata or context
 
+def _credentials_error(detail: str = "Could not validate credentials") -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def _verify_remote(token: str) -> dict:
+    """
+    Verify token with the Supabase Auth server (one network round trip).
+    """
+    user_response = supabase.auth.get_user(token)
+
+    if not user_response or not user_response.user:
+        raise _credentials_error("Invalid authentication credentials")
+
+    return {"sub": user_response.user.id, "email": user_response.user.email}
+
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
     """
-    Verify JWT token using Supabase Auth and return user.
+    Verify JWT token and return user.
+    Checks the token cache first, then verifies locally against the project's
+    JWT secret/JWKS, and falls back to Supabase Auth if local verification
+    is not configured or fails for a reason other than expiry.
     """
     token = credentials.credentials
-    
+
+    claims = token_cache.get(token)
+    if claims is not None:
+        return User(id=claims["sub"], email=claims.get("email"))
+
     try:
-        # Verify token with Supabase
-        user_response = supabase.auth.get_user(token)
-        
-        if not user_response or not user_response.user:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-            
-        return User(
-            id=user_response.user.id, 
-            email=user_response.user.email
-        )
-        
+        claims = None
+        if jwt_verifier.available:
+            import jwt
+            try:
+                claims = jwt_verifier.verify(token)
+            except jwt.ExpiredSignatureError:
+                raise _credentials_error("Token has expired")
+            except Exception as e:
+                logger.warning(f"Local JWT verification failed, falling back to Supabase Auth: {e}")
+
+        if claims is None:
+            jwt_verifier.remote_fallbacks += 1
+            claims = _verify_remote(token)
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Auth error: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        raise _credentials_error()
+
+    token_cache.put(token, claims, token_exp=claims.get("exp") or token_expiry(token))
+    return User(id=claims["sub"], email=claims.get("email"))
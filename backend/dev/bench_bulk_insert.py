@@ -0,0 +1,72 @@
+"""
+Bulk Insert Benchmark
+Stores one synthetic paper's chunks through the local stand-in store
+(dev.local_vector_store) the old way (serial batches of 50 rows with
+embeddings as JSON float lists) and with SupabaseVectorStore.add_document
+(payload-sized concurrent batches, pgvector literals). Reports requests,
+bytes sent and wall time, plus the largest cosine-score change caused by
+rounding vectors to VECTOR_TEXT_DIGITS decimals.
+
+Usage:
+    cd backend
+    python -m dev.bench_bulk_insert [--chunks 400] [--rtt-ms 40] [--mbps 50]
+"""
+import time
+import random
+import argparse
+import numpy as np
+from dev.local_vector_store import LocalSupabase
+from utils.vector_store import SupabaseVectorStore
+from utils.bulk_insert import vector_literals
+
+WORDS = "the model attention layer data training we propose results table figure section method".split()
+
+
+def make_paper(n: int):
+    rng = random.Random(0)
+    chunks = [{"text": " ".join(rng.choices(WORDS, k=150)), "type": "body"} for _ in range(n)]
+    vectors = np.random.default_rng(0).standard_normal((n, 384)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return chunks, vectors
+
+
+def store_serial(client: LocalSupabase, chunks: list, vectors: np.ndarray):
+    # add_document before bulk inserts
+    rows = [
+        {"file_id": "f", "chunk_index": i, "chunk_text": c["text"], "embedding": e, "metadata": {"type": "body"}}
+        for i, (c, e) in enumerate(zip(chunks, vectors.tolist()))
+    ]
+    for i in range(0, len(rows), 50):
+        client.table("rag_chunks").insert(rows[i:i + 50]).execute()
+
+
+def store_bulk(client: LocalSupabase, chunks: list, vectors: np.ndarray):
+    SupabaseVectorStore(client=client).add_document(
+        user_id="u", workspace_id="w", filename="bench.pdf", file_url="", chunks=chunks, embeddings=vectors
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=400)
+    parser.add_argument("--rtt-ms", type=float, default=40.0)
+    parser.add_argument("--mbps", type=float, default=50.0)
+    args = parser.parse_args()
+    chunks, vectors = make_paper(args.chunks)
+
+    print(f"{'mode':<8} {'requests':>9} {'MB sent':>8} {'seconds':>8}")
+    for name, fn in (("serial", store_serial), ("bulk", store_bulk)):
+        client = LocalSupabase(rtt_ms=args.rtt_ms, mbps=args.mbps)
+        started = time.perf_counter()
+        fn(client, chunks, vectors)
+        seconds = time.perf_counter() - started
+        print(f"{name:<8} {client.requests:>9} {client.bytes_sent / 1e6:>8.2f} {seconds:>8.2f}")
+
+    parsed = np.array([[float(x) for x in s[1:-1].split(",")] for s in vector_literals(vectors)], dtype=np.float32)
+    queries = vectors[:50]
+    drift = np.abs(queries @ parsed.T - queries @ vectors.T).max()
+    print(f"max cosine change from rounding: {drift:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Chunker Benchmark
+Time of chunk_text and extract_abstract on synthetic ~1MB texts, including
+adversarial shapes (no abstract terminator, one huge line, whitespace only).
+Fails (exit 1) if any case exceeds --max-ms-per-mb, so it can be used as a
+regression check.
+
+Usage:
+    cd backend
+    python -m dev.bench_chunker [--mb 1] [--max-ms-per-mb 500]
+"""
+import sys
+import time
+import random
+import argparse
+from utils.chunker import chunk_text, extract_abstract
+from utils.pdf_loader import extract_abstract as loader_extract_abstract
+
+WORDS = "the model attention layer data training we propose results table figure section method".split()
+
+
+def paper_like(n: int, rng: random.Random) -> str:
+    parts = ["A Synthetic Paper\n\nAbstract\n", " ".join(rng.choices(WORDS, k=150)), "\n\n1 Introduction\n"]
+    size = sum(map(len, parts))
+    while size < n:
+        line = " ".join(rng.choices(WORDS, k=rng.randint(3, 20)))
+        if rng.random() < 0.01:
+            line = "All rights reserved."
+        parts.append(line + ("\n\n" if rng.random() < 0.1 else "\n"))
+        size += len(parts[-1])
+    parts.append("\nReferences\n[1] A. Author. A paper. 2020.\n")
+    return "".join(parts)
+
+
+def cases(n: int) -> dict:
+    rng = random.Random(0)
+    return {
+        "paper-like": paper_like(n, rng),
+        "abstract words, no terminator": ("abstract " * (n // 9 + 1))[:n],
+        "abstract header, no terminator": "Abstract\n" + ("word " * (n // 5 + 1))[:n],
+        "one long line": ("word " * (n // 5 + 1))[:n],
+        "whitespace lines": (" \t\n" * (n // 3 + 1))[:n],
+        "every line boilerplate": ("all rights reserved\n" * (n // 20 + 1))[:n],
+        "form feeds / CRLF": ("some text here\r\n\x0c" * (n // 17 + 1))[:n],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=float, default=1.0)
+    parser.add_argument("--max-ms-per-mb", type=float, default=500.0)
+    args = parser.parse_args()
+    n = int(args.mb * 1_000_000)
+
+    worst = 0.0
+    print(f"{'case':<32} {'chunk ms':>9} {'abstract ms':>12} {'loader abstract ms':>19} {'chunks':>7}")
+    for name, text in cases(n).items():
+        timings = []
+        for fn in (chunk_text, extract_abstract, loader_extract_abstract):
+            start = time.perf_counter()
+            out = fn(text)
+            timings.append((time.perf_counter() - start) * 1000)
+            if fn is chunk_text:
+                chunks = len(out)
+        worst = max(worst, max(timings) / args.mb)
+        print(f"{name:<32} {timings[0]:>9.1f} {timings[1]:>12.2f} {timings[2]:>19.2f} {chunks:>7}")
+
+    print(f"worst case: {worst:.1f} ms/MB (limit {args.max_ms_per_mb:.0f})")
+    if worst > args.max_ms_per_mb:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Streaming Ingest Benchmark
+Runs chunk -> embed -> store over synthetic pages three ways: one stage
+after another over the whole paper (as INGEST_MODE=batch does), as the
+bare streaming pipeline, and through the real utils.ingest._ingest_streaming
+(job progress, cache copies, SupabaseVectorStore writes to an in-process
+sink). Embedding and inserts are simulated with sleeps (--embed-ms /
+--insert-ms per batch), so the numbers show overlap and peak Python memory
+(tracemalloc), not model speed. Papers of 1x and 4x --pages are run to
+show how peak memory grows with length; "ingest" stays flat once a paper
+is past INGEST_STREAM_KEEP_CHARS / INGEST_STREAM_KEEP_CHUNKS and is no
+longer copied for the caches.
+
+Usage:
+    cd backend
+    python -m dev.bench_ingest_pipeline [--pages 40] [--page-ms 10] [--embed-ms 30] [--insert-ms 20]
+"""
+import time
+import random
+import argparse
+import tracemalloc
+import numpy as np
+from utils.chunker import prepare_chunks, iter_chunks
+from utils.pipeline import run_pipeline, batched
+from utils import ingest
+from utils.jobs import Job, INGEST_STAGES
+from utils.vector_store import SupabaseVectorStore
+from dev.local_vector_store import LocalSupabase
+
+WORDS = "the model attention layer data training we propose results table figure section method".split()
+BATCH = 64
+DIM = 384
+
+
+def make_pages(count: int) -> list:
+    rng = random.Random(0)
+    return [
+        "\n".join(" ".join(rng.choices(WORDS, k=rng.randint(8, 16))) + "." for _ in range(60))
+        for _ in range(count)
+    ]
+
+
+def slow_pages(pages: list, page_delay: float):
+    for page in pages:
+        time.sleep(page_delay)
+        yield page
+
+
+def fake_embed(texts: list, delay: float) -> np.ndarray:
+    time.sleep(delay)
+    return np.ones((len(texts), DIM), dtype=np.float32)
+
+
+def fake_insert(rows: list, delay: float):
+    time.sleep(delay)
+
+
+def run_batch(pages: list, args) -> int:
+    chunks = prepare_chunks("\n\n".join(slow_pages(pages, args.page_ms / 1000)), None, mode="chars")
+    embeddings = np.concatenate([fake_embed([c["text"] for c in b], args.embed_ms / 1000) for b in batched(chunks, BATCH)])
+    rows = [{"chunk_text": c["text"], "embedding": e} for c, e in zip(chunks, embeddings.tolist())]
+    for batch in batched(rows, BATCH):
+        fake_insert(batch, args.insert_ms / 1000)
+    return len(rows)
+
+
+def run_stream(pages: list, args) -> int:
+    stored = [0]
+
+    def chunk(pages):
+        return iter_chunks(pages, None, mode="chars")
+
+    def embed(chunks):
+        for batch in batched(chunks, BATCH):
+            yield batch, fake_embed([c["text"] for c in batch], args.embed_ms / 1000)
+
+    def store(batches):
+        for batch, vectors in batches:
+            fake_insert([{"chunk_text": c["text"], "embedding": e} for c, e in zip(batch, vectors.tolist())], args.insert_ms / 1000)
+            stored[0] += len(batch)
+            yield len(batch)
+
+    run_pipeline(("extract", slow_pages(pages, args.page_ms / 1000)), [("chunk", chunk), ("embed", embed), ("store", store)])
+    return stored[0]
+
+
+class _SinkSupabase(LocalSupabase):
+    """
+    LocalSupabase that forgets rag_chunks rows once sent, so only the
+    ingest's own memory is measured.
+    """
+
+    def table(self, name: str):
+        if name == "rag_chunks":
+            with self.lock:
+                self.tables["rag_chunks"] = []
+        return super().table(name)
+
+
+class _FakeEmbedder:
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def encode(self, texts: list) -> np.ndarray:
+        return fake_embed(texts, self.delay)
+
+
+def run_ingest(pages: list, args) -> int:
+    saved = ingest.embedder, ingest.vector_store, ingest.iter_pages
+    ingest.embedder = _FakeEmbedder(args.embed_ms / 1000)
+    ingest.vector_store = SupabaseVectorStore(client=_SinkSupabase(rtt_ms=args.insert_ms, mbps=10000))
+    ingest.iter_pages = lambda content: slow_pages(pages, args.page_ms / 1000)
+    try:
+        fields = {"user_id": "u", "workspace_id": "w", "filename": "bench.pdf", "file_url": ""}
+        _, count = ingest._ingest_streaming(Job("ingest", "u", INGEST_STAGES), None, {}, None, b"%PDF", fields)
+        return count
+    finally:
+        ingest.embedder, ingest.vector_store, ingest.iter_pages = saved
+
+
+def measure(fn, pages: list, args) -> tuple:
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = fn(pages, args)
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--page-ms", type=float, default=10.0)
+    parser.add_argument("--embed-ms", type=float, default=30.0)
+    parser.add_argument("--insert-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    print(f"{'pages':>6} {'mode':<7} {'chunks':>7} {'seconds':>8} {'peak MB':>8}")
+    for pages_count in (args.pages, args.pages * 4):
+        pages = make_pages(pages_count)
+        for name, fn in (("batch", run_batch), ("stream", run_stream), ("ingest", run_ingest)):
+            count, seconds, peak = measure(fn, pages, args)
+            print(f"{pages_count:>6} {name:<7} {count:>7} {seconds:>8.2f} {peak / 1e6:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Quantization Benchmark
+recall@k, memory and latency of the local index representations on a synthetic
+corpus: exact float32, float16, int8 scan only, and int8 scan + exact rerank of
+a shortlist of rerank_factor * k candidates.
+
+The corpus is clustered (like chunks of a few dozen papers) rather than
+uniform noise, which would make every method look equally good or bad.
+
+Usage:
+    cd backend
+    python -m dev.bench_quantization [--chunks 100000] [--queries 200] [--k 5]
+"""
+import argparse
+import time
+import numpy as np
+from utils.rag import normalize_rows, top_k_rows
+from utils.quantization import quantize_int8, int8_scores
+
+DIM = 384
+
+
+def synthetic_corpus(rng, n: int, clusters: int = 50) -> np.ndarray:
+    centers = rng.standard_normal((clusters, DIM)).astype(np.float32)
+    labels = rng.integers(0, clusters, n)
+    return normalize_rows(centers[labels] + 0.6 * rng.standard_normal((n, DIM)).astype(np.float32))
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rerank", default="1,2,4,8")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    corpus = synthetic_corpus(rng, args.chunks)
+    # Queries near (but not on) corpus points, like questions about a chunk
+    queries = normalize_rows(corpus[rng.integers(0, args.chunks, args.queries)] + 0.4 * rng.standard_normal((args.queries, DIM)).astype(np.float32))
+    k = args.k
+
+    def timed(fn):
+        start = time.perf_counter()
+        out = fn()
+        return out, (time.perf_counter() - start) * 1000 / args.queries
+
+    truth, exact_ms = timed(lambda: top_k_rows(queries @ corpus.T, k)[0])
+    rows = [("float32 exact", corpus.nbytes, 1.0, exact_ms)]
+
+    half = corpus.astype(np.float16)
+    found, ms = timed(lambda: top_k_rows(queries @ half.astype(np.float32).T, k)[0])
+    rows.append(("float16", half.nbytes, recall(found, truth), ms))
+
+    codes, scales = quantize_int8(corpus)
+    int8_bytes = codes.nbytes + scales.nbytes
+    found, ms = timed(lambda: top_k_rows(int8_scores(queries, codes, scales), k)[0])
+    rows.append(("int8 scan", int8_bytes, recall(found, truth), ms))
+
+    for factor in (int(f) for f in args.rerank.split(",")):
+        def int8_rerank():
+            shortlist = top_k_rows(int8_scores(queries, codes, scales), k * factor)[0]
+            exact = np.einsum("qd,qsd->qs", queries, corpus[shortlist])
+            order = top_k_rows(exact, k)[0]
+            return np.take_along_axis(shortlist, order, axis=1)
+        found, ms = timed(int8_rerank)
+        # Rerank vectors stay on disk (memmap); only the scanned codes need to be resident
+        rows.append((f"int8 + rerank x{factor}", int8_bytes, recall(found, truth), ms))
+
+    print(f"{args.chunks} chunks, {args.queries} queries, recall@{k}")
+    print(f"{'representation':<20} {'scanned MB':>10} {'recall':>8} {'ms/query':>9}")
+    for name, nbytes, r, ms in rows:
+        print(f"{name:<20} {nbytes / 1e6:>10.1f} {r:>8.3f} {ms:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Retrieval Benchmark
+Latency of InMemoryRAG search vs. chunk count on random 384-dim embeddings,
+for single queries and for batched multi-query search.
+
+Usage:
+    cd backend
+    python -m dev.bench_retrieval [--sizes 1000,10000,100000] [--queries 200] [--batch 32]
+"""
+import argparse
+import time
+import numpy as np
+from utils.rag import InMemoryRAG
+
+DIM = 384
+
+
+def _naive_search(embeddings: np.ndarray, query: np.ndarray, top_k: int):
+    # Previous implementation: norms recomputed per query + full argsort
+    norms = np.linalg.norm(embeddings, axis=1)
+    similarities = np.dot(embeddings, query) / (norms * np.linalg.norm(query))
+    return np.argsort(similarities)[::-1][:top_k]
+
+
+def _ms_per_query(fn, n_queries: int) -> float:
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000 / n_queries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,50000,100000")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((args.queries, DIM)).astype(np.float32)
+
+    print(f"{'chunks':>8} {'naive f64 ms':>13} {'search ms':>10} {'batch ms/q':>11}")
+    for n in (int(s) for s in args.sizes.split(",")):
+        vectors = rng.standard_normal((n, DIM)).astype(np.float32)
+        index = InMemoryRAG()
+        index.index_chunks([{"id": i, "chunk_text": "", "embedding": v} for i, v in enumerate(vectors)])
+        naive_matrix = vectors.astype(np.float64)
+
+        naive = _ms_per_query(lambda: [_naive_search(naive_matrix, q, args.top_k) for q in queries], len(queries))
+        single = _ms_per_query(lambda: [index.search(q, top_k=args.top_k) for q in queries], len(queries))
+        batched = _ms_per_query(
+            lambda: [index.search_batch(queries[i:i + args.batch], top_k=args.top_k) for i in range(0, len(queries), args.batch)],
+            len(queries),
+        )
+        print(f"{n:>8} {naive:>13.3f} {single:>10.3f} {batched:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Fake Gemini API Server
+Local stand-in for generativelanguage.googleapis.com that answers with canned
+text and returns 429 for a configurable share of requests.
+
+Usage:
+    cd backend
+    FAKE_LLM_429_RATE=0.3 python -m uvicorn dev.fake_llm_server:app --port 8090
+    LLM_BASE_URL=http://localhost:8090 GEMINI_API_KEY=fake python -m uvicorn main:app --port 8000
+"""
+import os
+import json
+import random
+import asyncio
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+RATE_429 = float(os.environ.get("FAKE_LLM_429_RATE", "0.2"))
+LATENCY = float(os.environ.get("FAKE_LLM_LATENCY", "0.5"))
+ANSWER = "This is a fake answer from the local LLM server."
+
+app = FastAPI()
+counts = {"requests": 0, "rate_limited": 0}
+
+
+def _candidate(text: str, finished: bool = True) -> dict:
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finished:
+        candidate["finishReason"] = "STOP"
+    return {"candidates": [candidate]}
+
+
+def _rate_limited() -> JSONResponse | None:
+    counts["requests"] += 1
+    if random.random() < RATE_429:
+        counts["rate_limited"] += 1
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"code": 429, "message": "Resource has been exhausted (fake)", "status": "RESOURCE_EXHAUSTED"}},
+        )
+    return None
+
+
+@app.post("/{version}/models/{model_action}")
+async def models(version: str, model_action: str, request: Request):
+    model, _, action = model_action.partition(":")
+    rejected = _rate_limited()
+    if rejected is not None:
+        return rejected
+
+    if action == "streamGenerateContent":
+        async def events():
+            words = ANSWER.split(" ")
+            for i, word in enumerate(words):
+                await asyncio.sleep(LATENCY / len(words))
+                text = word if i == 0 else " " + word
+                yield f"data: {json.dumps(_candidate(text, finished=i == len(words) - 1))}\r\n\r\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    await asyncio.sleep(LATENCY)
+    return _candidate(ANSWER)
+
+
+@app.get("/stats")
+def stats():
+    return counts
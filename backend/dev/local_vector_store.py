@@ -0,0 +1,185 @@
+"""
+Local Vector Store Stand-in
+In-process replacement for the Supabase client's table(...) insert / upsert /
+select / update / delete calls (with eq / in_ / order / limit / range) used by
+SupabaseVectorStore, with a simple network model: every request costs
+LOCAL_STORE_RTT_MS plus its JSON body size over LOCAL_STORE_MBPS, and
+bodies above LOCAL_STORE_MAX_BYTES are rejected with a 413, like PostgREST
+behind a proxy. Requests sleep, so concurrent writers
+overlap as they would over HTTP. The unique indexes of sql/resumable_ingest.sql
+are enforced: a conflicting insert fails with code 23505, an upsert with
+ignore_duplicates skips the conflicting rows.
+
+Usage:
+    from dev.local_vector_store import LocalSupabase
+    store = SupabaseVectorStore(client=LocalSupabase())
+"""
+import os
+import json
+import time
+import uuid
+import threading
+from datetime import datetime, timezone
+
+RTT_MS = float(os.environ.get("LOCAL_STORE_RTT_MS", "40"))
+MBPS = float(os.environ.get("LOCAL_STORE_MBPS", "50"))
+MAX_BYTES = int(os.environ.get("LOCAL_STORE_MAX_BYTES", str(4 * 1024 * 1024)))
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+class UniqueViolation(Exception):
+    code = "23505"
+
+
+def _partial_ingest_key(row: dict):
+    metadata = row.get("metadata") or {}
+    if metadata.get("ingest_state") != "partial" or metadata.get("ingest_key") is None:
+        return None
+    return row.get("user_id"), row.get("workspace_id"), metadata["ingest_key"]
+
+
+# table -> (index name, row -> key, or None where the index does not apply)
+UNIQUE_KEYS = {
+    "rag_chunks": [("rag_chunks_file_chunk_idx", lambda row: (row.get("file_id"), row.get("chunk_index")))],
+    "rag_files": [("rag_files_partial_ingest_key_idx", _partial_ingest_key)],
+}
+
+
+def _field(row: dict, column: str):
+    # "metadata->>key" reads a key of a JSON column, as in PostgREST filters
+    if "->>" in column:
+        column, key = column.split("->>", 1)
+        value = (row.get(column) or {}).get(key)
+        return None if value is None else str(value)
+    return row.get(column)
+
+
+class _Response:
+    def __init__(self, data: list):
+        self.data = data
+
+
+class _Query:
+    def __init__(self, store: "LocalSupabase", table: str):
+        self.store = store
+        self.table = table
+        self.action = "select"
+        self.payload = None
+        self.filters = []
+        self.sort = None
+        self.window = None
+        self.ignore_duplicates = False
+
+    def select(self, *columns):
+        self.action = "select"
+        return self
+
+    def insert(self, rows):
+        self.action, self.payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict: str = "", ignore_duplicates: bool = False):
+        # Only the ON CONFLICT DO NOTHING form is used
+        self.action, self.payload = "insert", rows
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, values: dict):
+        self.action, self.payload = "update", values
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    def eq(self, column: str, value):
+        self.filters.append(lambda row: _field(row, column) == value)
+        return self
+
+    def in_(self, column: str, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        self.sort = (column, desc)
+        return self
+
+    def limit(self, count: int):
+        self.window = (0, count)
+        return self
+
+    def range(self, start: int, end: int):
+        self.window = (start, end + 1)
+        return self
+
+    def execute(self) -> _Response:
+        body = json.dumps(self.payload) if self.payload is not None else ""
+        self.store.request(len(body))
+        with self.store.lock:
+            rows = self.store.tables.setdefault(self.table, [])
+            if self.action == "insert":
+                new = [dict(row, id=row.get("id") or str(uuid.uuid4()), created_at=row.get("created_at") or datetime.now(timezone.utc).isoformat()) for row in (self.payload if isinstance(self.payload, list) else [self.payload])]
+                new = self._check_unique(rows, new)
+                rows.extend(new)
+                return _Response(new)
+            matched = [row for row in rows if all(f(row) for f in self.filters)]
+            if self.action == "update":
+                for row in matched:
+                    row.update(self.payload)
+            elif self.action == "delete":
+                self.store.tables[self.table] = [row for row in rows if row not in matched]
+                if self.table == "rag_files":
+                    # ON DELETE CASCADE
+                    ids = {row["id"] for row in matched}
+                    self.store.tables["rag_chunks"] = [c for c in self.store.tables.get("rag_chunks", []) if c["file_id"] not in ids]
+            if self.sort:
+                matched.sort(key=lambda row: row.get(self.sort[0]), reverse=self.sort[1])
+            if self.window:
+                matched = matched[self.window[0]:self.window[1]]
+            return _Response([dict(row) for row in matched])
+
+    def _check_unique(self, rows: list, new: list) -> list:
+        # Caller holds the store lock. The statement fails as a whole, as in Postgres
+        for name, key in UNIQUE_KEYS.get(self.table, []):
+            taken = {k for k in map(key, rows) if k is not None}
+            kept = []
+            for row in new:
+                k = key(row)
+                if k is not None and k in taken:
+                    if self.ignore_duplicates:
+                        continue
+                    raise UniqueViolation(f"duplicate key value violates unique constraint \"{name}\"")
+                taken.add(k)
+                kept.append(row)
+            new = kept
+        return new
+
+
+class LocalSupabase:
+    """
+    Minimal Supabase client stand-in; counts requests and bytes sent.
+    """
+
+    def __init__(self, rtt_ms: float = RTT_MS, mbps: float = MBPS, max_bytes: int = MAX_BYTES):
+        self.rtt = rtt_ms / 1000.0
+        self.bytes_per_second = mbps * 1e6 / 8
+        self.max_bytes = max_bytes
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    def request(self, size: int):
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += size
+        time.sleep(self.rtt + size / self.bytes_per_second)
+        if size > self.max_bytes:
+            raise PayloadTooLarge(f"413 Payload Too Large ({size} bytes)")
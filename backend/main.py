@@ -23,6 +23,17 @@ app.include_router(chat.router)
 app.include_router(rag.router)
 from routers import workspaces
 app.include_router(workspaces.router)
+from routers import jobs
+app.include_router(jobs.router)
+from routers import metrics
+app.include_router(metrics.router)
+
+@app.on_event("shutdown")
+async def shutdown():
+    from utils.embeddings import query_cache
+    from utils.arxiv_client import arxiv_client
+    query_cache.save()
+    await arxiv_client.close()
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Depends, HTTPException
+from dependencies import get_current_user, User
+from utils.jobs import job_manager
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+@router.get("/{job_id}")
+def get_job(job_id: str, user: User = Depends(get_current_user)):
+    """
+    Poll status and per-stage progress of a background job.
+    """
+    job = job_manager.get(job_id)
+    if job is None or job.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
@@ -0,0 +1,55 @@
+from fastapi import APIRouter
+from utils.auth import token_cache, jwt_verifier
+from utils.jobs import job_manager
+from utils.embeddings import query_embedder, query_cache
+from utils.dedup import content_store
+from utils.pdf_loader import extraction_stats
+from utils.chunker import chunking_stats
+from utils.pipeline import pipeline_stats
+from utils.bulk_insert import bulk_insert_stats
+from utils.paper_cache import paper_cache
+from utils.arxiv_client import arxiv_client
+from utils.metrics import chat_ttfb_ms, chat_ttft_ms
+from utils.gemini_client import gemini
+from utils.answer_cache import answer_cache
+from utils.summary_cache import summary_cache
+from utils.local_index import workspace_indexes
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+@router.get("/")
+def get_metrics():
+    """
+    In-process cache and performance counters.
+    """
+    return {
+        "auth": {
+            "token_cache": token_cache.stats(),
+            **jwt_verifier.stats(),
+        },
+        "jobs": job_manager.stats(),
+        "query_embedder": query_embedder.stats(),
+        "query_cache": query_cache.stats(),
+        "ingest_dedup": content_store.stats(),
+        "pdf_extraction": extraction_stats.snapshot(),
+        "chunking": chunking_stats.snapshot(),
+        "ingest_pipeline": pipeline_stats.snapshot(),
+        "bulk_insert": bulk_insert_stats.snapshot(),
+        "paper_cache": paper_cache.stats(),
+        "arxiv_search": arxiv_client.stats(),
+        "llm": gemini.stats(),
+        "answer_cache": answer_cache.stats(),
+        "summary_cache": summary_cache.stats(),
+        "local_index": workspace_indexes.stats(),
+        "chat_stream": {
+            "ttfb_ms": chat_ttfb_ms.snapshot(),
+            "ttft_ms": chat_ttft_ms.snapshot(),
+        },
+    }
+
+@router.get("/paper-cache")
+def get_paper_cache_stats():
+    """
+    Hit ratio and bytes in use of the on-disk arXiv paper cache.
+    """
+    return paper_cache.stats()
@@ -1,80 +1,78 @@
+import os
+import json
+import math
+import asyncio
 import logging
-import urllib.request
-import urllib.parse
-import xml.etree.ElementTree as ET
-import uuid
-from fastapi import APIRouter
-from pydantic import BaseModel
-from utils.summarize import summarize_paper
+from typing import List
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from utils.summarize import asummarize_paper
+from utils.gemini_client import LLMOverloaded
+from utils.arxiv_client import arxiv_client
 
 logger = logging.getLogger("uvicorn")
 
+SUMMARIZE_BATCH_CONCURRENCY = int(os.environ.get("SUMMARIZE_BATCH_CONCURRENCY", "4"))
+
 class SummarizePayload(BaseModel):
     title: str
     abstract: str
 
+class BatchSummarizePayload(BaseModel):
+    papers: List[SummarizePayload] = Field(..., max_length=50)
+
 router = APIRouter(prefix="/papers", tags=["Papers"])
 
 @router.post("/summarize")
-def summarize(payload: SummarizePayload):
-    summary = summarize_paper(payload.title, payload.abstract)
+async def summarize(payload: SummarizePayload):
+    try:
+        summary = await asummarize_paper(payload.title, payload.abstract)
+    except LLMOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
     return {"summary": summary}
 
-@router.get("/search")
-def search_papers(query: str):
-    print(f"DEBUG: Handling search request for: {query}")
-    base_url = "http://export.arxiv.org/api/query"
-    params = {
-        "search_query": f"all:{query}",
-        "start": 0,
-        "max_results": 12,
-    }
-    query_string = urllib.parse.urlencode(params)
-    full_url = f"{base_url}?{query_string}"
+@router.post("/summarize/batch")
+async def summarize_batch(payload: BatchSummarizePayload):
+    """
+    Summarize every paper of a search result page, at most
+    SUMMARIZE_BATCH_CONCURRENCY LLM calls at a time. Results keep input
+    order; papers shed by the LLM limiter get an "error" instead.
+    """
+    semaphore = asyncio.Semaphore(SUMMARIZE_BATCH_CONCURRENCY)
 
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-    }
+    async def one(paper: SummarizePayload) -> dict:
+        async with semaphore:
+            try:
+                summary = await asummarize_paper(paper.title, paper.abstract)
+                return {"title": paper.title, "summary": summary}
+            except LLMOverloaded as e:
+                return {"title": paper.title, "summary": None, "error": str(e)}
 
-    try:
-        req = urllib.request.Request(full_url, headers=headers)
-        with urllib.request.urlopen(req, timeout=30.0) as response:
-            if response.status != 200:
-                logger.error(f"Error fetching from arXiv: {response.status}")
-                return {"papers": []}
-            
-            response_text = response.read().decode('utf-8')
-            logger.info(f"arXiv response status: {response.status}")
-            
-    except Exception as e:
-        logger.error(f"Error fetching from arXiv: {e}")
-        return {"papers": []}
+    return {"summaries": await asyncio.gather(*(one(p) for p in payload.papers))}
 
-    try:
-        root = ET.fromstring(response_text)
-    except ET.ParseError as e:
-        logger.error(f"XML Parse Error: {e}")
-        return {"papers": []}
-
-    ns = {"atom": "http://www.w3.org/2005/Atom"}
-
-    papers = []
+@router.get("/search")
+async def search_papers(
+    query: str,
+    start: int = Query(0, ge=0),
+    max_results: int = Query(12, ge=1, le=100),
+):
+    print(f"DEBUG: Handling search request for: {query}")
+    papers = await arxiv_client.search(query, start=start, max_results=max_results)
+    return {"papers": papers}
 
-    for entry in root.findall("atom:entry", ns):
-        papers.append({
-            "id": str(uuid.uuid4()),
-            "title": entry.find("atom:title", ns).text.strip(),
-            "authors": [
-                a.find("atom:name", ns).text
-                for a in entry.findall("atom:author", ns)
-            ],
-            "abstract": entry.find("atom:summary", ns).text.strip(),
-            "date": entry.find("atom:published", ns).text[:4],
-            "source": "arXiv",
-            "citations": None,
-            "tags": [],
-            "imported": False,
-            "link": entry.find("atom:id", ns).text,
-        })
+@router.get("/search/stream")
+async def search_papers_stream(
+    query: str,
+    start: int = Query(0, ge=0),
+    max_results: int = Query(100, ge=1, le=2000),
+):
+    """
+    Same search as /search, streamed as NDJSON (one paper per line)
+    while arXiv is still sending the feed. Intended for bulk harvesting.
+    """
+    async def lines():
+        async for paper in arxiv_client.stream(query, start=start, max_results=max_results):
+            yield json.dumps(paper) + "\n"
 
-    return {"papers": papers}
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -1,21 +1,29 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 from dependencies import get_current_user, User
-from utils.pdf_loader import load_paper_from_bytes
-from utils.chunker import prepare_chunks
-from utils.vector_store import SupabaseVectorStore
+from utils.local_index import make_vector_store
 from utils.rag import InMemoryRAG # We will modify this class or create a new one to use VectorStore
+from utils.jobs import job_manager
+from utils.ingest import ingest_paper
+from utils.metrics import chat_ttfb_ms, chat_ttft_ms
+from utils.gemini_client import agenerate_response, generate_response_stream, LLMOverloaded, ERROR_MESSAGE
+from utils.answer_cache import answer_cache
+import math
+import json
+import time
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/rag", tags=["RAG"])
-vector_store = SupabaseVectorStore()
+vector_store = make_vector_store()
 
 # We need to adapt the RAG logic to use vector store
 # Let's import the embedder from utils.embeddings
-from utils.embeddings import embedder 
+from utils.embeddings import query_cache
 from utils.supabase_client import supabase
 
 # DEBUG: Check chunks in database (NO AUTH for testing)
@@ -111,134 +119,207 @@ async def test_rpc(workspace_id: str):
         import traceback
         return {"error": str(e), "traceback": traceback.format_exc()}
 
+# Fixed boosting prefix prepended to every chat question before embedding
+RETRIEVAL_PREFIX = "Main contribution, key idea, novelty, and core method of the paper. Question: "
+
 class ChatRequest(BaseModel):
     workspace_id: str
     question: str
 
 class UploadResponse(BaseModel):
-    document_id: str
+    job_id: str
+    status: str
     message: str
 
-@router.post("/upload", response_model=UploadResponse)
+@router.post("/upload", response_model=UploadResponse, status_code=202)
 def upload_document(
     workspace_id: str,
     file: UploadFile = File(...),
     user: User = Depends(get_current_user)
 ):
     """
-    Upload PDF -> Extract -> Chunk -> Embed -> Store in Supabase
+    Upload PDF and queue Extract -> Chunk -> Embed -> Store as a background job.
+    Poll /jobs/{job_id} for progress.
     """
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
     
     try:
         content = file.file.read()
-        full_text, abstract = load_paper_from_bytes(content)
-        
-        chunks = prepare_chunks(full_text, abstract)
-        
-        # Generate embeddings locally
-        texts = [chunk["text"] for chunk in chunks]
-        embeddings = embedder.encode(texts).tolist()
-        
-        # Store in Supabase
-        doc_id = vector_store.add_document(
+        job = job_manager.submit(
+            "upload",
+            user.id,
+            ingest_paper,
             user_id=user.id,
             workspace_id=workspace_id,
             filename=file.filename,
             file_url=f"uploaded/{file.filename}", # Placeholder URL
-            chunks=chunks,
-            embeddings=embeddings
+            content=content
         )
-        
-        return UploadResponse(document_id=doc_id, message="Document processed and indexed")
+        return UploadResponse(job_id=job.id, status=job.status, message="Document queued for processing")
         
     except Exception as e:
         logger.error(f"Upload failed: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _retrieve_chunks(request: ChatRequest, user: User) -> list:
+    # 1. Embed Question with Boosting (Matches utils/rag.py logic)
+    query_embedding = query_cache.encode(request.question, prefix=RETRIEVAL_PREFIX).tolist()
+    print("DEBUG: Embedding complete")
+    
+    # 2. Retrieve Similar Chunks (Scoped to User)
+    similar_chunks = vector_store.similarity_search(
+        user_id=user.id,
+        query_embedding=query_embedding,
+        top_k=5,
+        workspace_id=request.workspace_id,
+        match_threshold=0.1  # Lowered for better vague query handling
+    )
+    print(f"DEBUG: Retrieved {len(similar_chunks)} chunks")
+    return similar_chunks
+
+def _build_prompts(question: str, similar_chunks: list) -> tuple[str, str]:
+    # 3. Context Construction (Prioritize Abstract)
+    # Parse metadata to find abstract
+    context_parts = []
+    abstract_chunk = None
+    
+    # Check for abstract in retrieved chunks
+    for chunk in similar_chunks:
+        meta = chunk.get("metadata", {})
+        if meta.get("type") == "abstract":
+            abstract_chunk = chunk
+            break
+    
+    # If abstract found and prioritized
+    if abstract_chunk:
+        context_parts.append(f"=== ABSTRACT (MOST IMPORTANT) ===\n{abstract_chunk['chunk_text']}\n")
+        
+    # Add other chunks
+    for i, chunk in enumerate(similar_chunks, 1):
+        meta = chunk.get("metadata", {})
+        if meta.get("type") != "abstract": # Avoid duplicate abstract
+            chunk_type = meta.get("type", "body")
+            context_parts.append(f"[Section {i} - {chunk_type}]:\n{chunk['chunk_text']}\n")
+
+    context_text = "\n".join(context_parts)
+    
+    # 4. Strict System Prompt
+    system_prompt = (
+        "You are a research assistant. "
+        "Answer questions using ONLY the provided paper content. "
+        "You may synthesize information across sections to infer: "
+        "the problem being addressed, the main contribution, and the intended application domain. "
+        "If something is truly not present or cannot be reasonably inferred, "
+        "say you do not know. Do not hallucinate."
+    )
+    
+    user_prompt = f"Paper Content:\n{context_text}\n\nQuestion: {question}\n\nAnswer based ONLY on the content above:"
+    return system_prompt, user_prompt
+
+def _sources(similar_chunks: list) -> list[str]:
+    return [c['chunk_text'][:200] + "..." for c in similar_chunks[:3]]
+
 @router.post("/chat")
-def chat(
+async def chat(
     request: ChatRequest,
     user: User = Depends(get_current_user)
 ):
     """
-    Chat with documents in a workspace using RAG
+    Chat with documents in a workspace using RAG.
+    Embedding and retrieval run on worker threads; the LLM call is awaited,
+    so waiting for rate budget holds no thread.
     """
     try:
         print(f"DEBUG: Processing chat request for workspace {request.workspace_id}")
         
-        # 1. Embed Question with Boosting (Matches utils/rag.py logic)
-        retrieval_query = (
-            "Main contribution, key idea, novelty, and core method of the paper. "
-            f"Question: {request.question}"
-        )
-        query_embedding = embedder.encode(retrieval_query).tolist()
-        print("DEBUG: Embedding complete")
-        
-        # 2. Retrieve Similar Chunks (Scoped to User)
-        similar_chunks = vector_store.similarity_search(
-            user_id=user.id,
-            query_embedding=query_embedding,
-            top_k=5,
-            workspace_id=request.workspace_id,
-            match_threshold=0.1  # Lowered for better vague query handling
-        )
-        print(f"DEBUG: Retrieved {len(similar_chunks)} chunks")
+        # 0. Semantic answer cache (same user, same workspace contents)
+        version = answer_cache.version(request.workspace_id)
+        question_embedding = await asyncio.to_thread(query_cache.encode, request.question)
+        cached = answer_cache.lookup(user.id, request.workspace_id, question_embedding)
+        if cached is not None:
+            print("DEBUG: Answer cache hit")
+            return cached
         
+        similar_chunks = await asyncio.to_thread(_retrieve_chunks, request, user)
         if not similar_chunks:
              return {"answer": "No relevant documents found in this workspace.", "sources": []}
         
-        # 3. Context Construction (Prioritize Abstract)
-        # Parse metadata to find abstract
-        context_parts = []
-        abstract_chunk = None
-        
-        # Check for abstract in retrieved chunks
-        for chunk in similar_chunks:
-            meta = chunk.get("metadata", {})
-            if meta.get("type") == "abstract":
-                abstract_chunk = chunk
-                break
-        
-        # If abstract found and prioritized
-        if abstract_chunk:
-            context_parts.append(f"=== ABSTRACT (MOST IMPORTANT) ===\n{abstract_chunk['chunk_text']}\n")
-            
-        # Add other chunks
-        for i, chunk in enumerate(similar_chunks, 1):
-            meta = chunk.get("metadata", {})
-            if meta.get("type") != "abstract": # Avoid duplicate abstract
-                chunk_type = meta.get("type", "body")
-                context_parts.append(f"[Section {i} - {chunk_type}]:\n{chunk['chunk_text']}\n")
-
-        context_text = "\n".join(context_parts)
-        
-        # 4. Generate Answer (Strict System Prompt)
-        from utils.gemini_client import generate_response
-        
-        system_prompt = (
-            "You are a research assistant. "
-            "Answer questions using ONLY the provided paper content. "
-            "You may synthesize information across sections to infer: "
-            "the problem being addressed, the main contribution, and the intended application domain. "
-            "If something is truly not present or cannot be reasonably inferred, "
-            "say you do not know. Do not hallucinate."
-        )
+        system_prompt, user_prompt = _build_prompts(request.question, similar_chunks)
         
-        user_prompt = f"Paper Content:\n{context_text}\n\nQuestion: {request.question}\n\nAnswer based ONLY on the content above:"
-        
-        response_text = generate_response(system_prompt, user_prompt)
+        # 5. Generate Answer
+        response_text = await agenerate_response(system_prompt, user_prompt)
         
         print("DEBUG: Gemini response received")
         
-        return {
+        result = {
             "answer": response_text,
-            "sources": [c['chunk_text'][:200] + "..." for c in similar_chunks[:3]]
+            "sources": _sources(similar_chunks)
         }
+        if response_text != ERROR_MESSAGE:
+            answer_cache.put(user.id, request.workspace_id, question_embedding, result, version)
+        return result
 
+    except LLMOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
     except Exception as e:
         import traceback
         traceback.print_exc()
         logger.error(f"Chat error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/chat/stream")
+def chat_stream(
+    request: ChatRequest,
+    user: User = Depends(get_current_user)
+):
+    """
+    Streaming variant of /chat, as NDJSON events:
+    {"type": "sources"} first, then {"type": "token"} as the LLM produces
+    text, then {"type": "done"} with time-to-first-byte/token in ms.
+    """
+    started = time.perf_counter()
+    try:
+        print(f"DEBUG: Processing streaming chat request for workspace {request.workspace_id}")
+        version = answer_cache.version(request.workspace_id)
+        question_embedding = query_cache.encode(request.question)
+        cached = answer_cache.lookup(user.id, request.workspace_id, question_embedding)
+        similar_chunks = _retrieve_chunks(request, user) if cached is None else []
+    except Exception as e:
+        logger.error(f"Chat error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    def events():
+        def elapsed_ms():
+            return round((time.perf_counter() - started) * 1000.0, 1)
+
+        sources = cached["sources"] if cached is not None else _sources(similar_chunks)
+        yield json.dumps({"type": "sources", "sources": sources}) + "\n"
+        ttfb_ms = elapsed_ms()
+        chat_ttfb_ms.observe(ttfb_ms)
+
+        ttft_ms = None
+        if cached is not None:
+            ttft_ms = elapsed_ms()
+            yield json.dumps({"type": "token", "text": cached["answer"]}) + "\n"
+        elif not similar_chunks:
+            yield json.dumps({"type": "token", "text": "No relevant documents found in this workspace."}) + "\n"
+        else:
+            system_prompt, user_prompt = _build_prompts(request.question, similar_chunks)
+            pieces = []
+            outcome = {}
+            for text in generate_response_stream(system_prompt, user_prompt, outcome):
+                if ttft_ms is None:
+                    ttft_ms = elapsed_ms()
+                    chat_ttft_ms.observe(ttft_ms)
+                pieces.append(text)
+                yield json.dumps({"type": "token", "text": text}) + "\n"
+            answer = "".join(pieces)
+            # Not shed, not cut short by an error: only a full answer is reusable
+            if answer and outcome["completed"]:
+                answer_cache.put(user.id, request.workspace_id, question_embedding, {"answer": answer, "sources": sources}, version)
+
+        print(f"DEBUG: Streamed chat, ttfb={ttfb_ms}ms ttft={ttft_ms}ms total={elapsed_ms()}ms")
+        yield json.dumps({"type": "done", "ttfb_ms": ttfb_ms, "ttft_ms": ttft_ms, "total_ms": elapsed_ms()}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
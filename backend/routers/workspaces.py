@@ -3,10 +3,11 @@ from pydantic import BaseModel
 from typing import List, Optional, Any
 from dependencies import get_current_user, User
 from utils.supabase_client import supabase
-from utils.pdf_loader import load_paper
-from utils.chunker import prepare_chunks
-from utils.embeddings import embedder
-from utils.vector_store import SupabaseVectorStore
+from utils.vector_store import SupabaseVectorStore, is_partial
+from utils.jobs import job_manager
+from utils.ingest import ingest_paper
+from utils.answer_cache import answer_cache
+from utils.local_index import workspace_indexes
 import logging
 
 logger = logging.getLogger(__name__)
@@ -97,9 +98,11 @@ def get_all_user_papers(user: User = Depends(get_current_user)):
         papers_res = supabase.table("rag_files").select("*").eq("user_id", user.id).order("created_at", desc=True).execute()
         print(f"DEBUG: Found {len(papers_res.data)} papers for user")
         
-        # 3. Enrich papers
+        # 3. Enrich papers (documents still being stored, or left by a failed add, are not listed)
         results = []
         for p in papers_res.data:
+            if is_partial(p):
+                continue
             p['workspace_name'] = workspace_map.get(p['workspace_id'], 'Unknown Workspace')
             results.append(p)
             
@@ -122,12 +125,12 @@ def get_workspace_papers(workspace_id: str, user: User = Depends(get_current_use
 
         # Fetch papers
         papers_res = supabase.table("rag_files").select("*").eq("workspace_id", workspace_id).order("created_at", desc=True).execute()
-        return papers_res.data
+        return [p for p in papers_res.data if not is_partial(p)]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/{workspace_id}/papers")
+@router.post("/{workspace_id}/papers", status_code=202)
 def add_paper_to_workspace(
     workspace_id: str, 
     paper: PaperPayload, 
@@ -135,7 +138,8 @@ def add_paper_to_workspace(
 ):
     """
     Add a paper from search results (arXiv URL expected).
-    Downloads PDF, extracts text, embeds, and stores in RAG system.
+    Queues a background job that downloads the PDF, extracts text, embeds,
+    and stores it in the RAG system. Poll /jobs/{job_id} for progress.
     """
     try:
         print(f"DEBUG [add_paper]: Starting for workspace {workspace_id}, paper: {paper.title}")
@@ -156,37 +160,19 @@ def add_paper_to_workspace(
         # Ensure https
         pdf_url = pdf_url.replace("http://", "https://")
         
-        print(f"DEBUG [add_paper]: Downloading from {pdf_url}")
-        logger.info(f"Downloading paper from: {pdf_url}")
+        logger.info(f"Queueing paper from: {pdf_url}")
         
-        # 3. Load & Chunk
-        # load_paper handles download and extraction
-        full_text, abstract = load_paper(pdf_url)
-        print(f"DEBUG [add_paper]: Extracted {len(full_text)} chars, abstract: {len(abstract) if abstract else 0} chars")
-        
-        if not full_text:
-             raise HTTPException(status_code=400, detail="Failed to extract text from PDF")
-
-        chunks = prepare_chunks(full_text, abstract)
-        print(f"DEBUG [add_paper]: Created {len(chunks)} chunks")
-        
-        # 4. Embed
-        texts = [c["text"] for c in chunks]
-        embeddings = embedder.encode(texts).tolist()
-        print(f"DEBUG [add_paper]: Generated {len(embeddings)} embeddings")
-        
-        # 5. Store in Vector Store (rag_files)
+        # 3. Download, extract, chunk, embed and store in the background
         # We reuse the paper details provided or from extraction
-        filename = paper.title or "Untitled Paper"
-        
-        print(f"DEBUG [add_paper]: Calling vector_store.add_document...")
-        doc_id = vector_store.add_document(
+        job = job_manager.submit(
+            "add_paper",
+            user.id,
+            ingest_paper,
             user_id=user.id,
             workspace_id=workspace_id,
-            filename=filename,
+            filename=paper.title or "Untitled Paper",
             file_url=pdf_url,
-            chunks=chunks,
-            embeddings=embeddings,
+            pdf_url=pdf_url,
             title=paper.title,
             authors=paper.authors,
             abstract=paper.abstract,
@@ -194,10 +180,12 @@ def add_paper_to_workspace(
             source=paper.source,
             link=paper.link
         )
-        print( f"DEBUG [add_paper]: SUCCESS! Document ID: {doc_id}")
+        print(f"DEBUG [add_paper]: Queued job {job.id}")
         
-        return {"id": doc_id, "message": "Paper added successfully"}
+        return {"job_id": job.id, "status": job.status, "message": "Paper queued for processing"}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error adding paper: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to add paper: {str(e)}")
@@ -214,6 +202,8 @@ def delete_paper(workspace_id: str, paper_id: str, user: User = Depends(get_curr
         # Check if exists and belongs to user
         
         res = supabase.table("rag_files").delete().eq("id", paper_id).eq("workspace_id", workspace_id).eq("user_id", user.id).execute()
+        answer_cache.invalidate(workspace_id)
+        workspace_indexes.remove_file(user.id, workspace_id, paper_id)
         
         # res.data might be empty if delete failed/not found?
         # Supabase delete returns deleted rows if authorized.
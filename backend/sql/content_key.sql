@@ -0,0 +1,4 @@
+-- Index the content key (arXiv ID or sha256 of the PDF) stored in
+-- rag_files.metadata so ingestion can find an already-processed copy.
+create index if not exists rag_files_content_key_idx
+on public.rag_files ((metadata->>'content_key'));
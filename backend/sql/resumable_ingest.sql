@@ -0,0 +1,59 @@
+-- Resumable ingestion: a document is stored with metadata.ingest_state =
+-- 'partial' (and its content key under metadata.ingest_key) until all of
+-- its chunks are in. The ingest storing it holds a lease
+-- (metadata.lease_owner, renewed into metadata.lease_expires); a retry
+-- resumes it only once the lease has expired.
+create index if not exists rag_files_ingest_key_idx
+on public.rag_files (user_id, workspace_id, (metadata->>'ingest_key'));
+
+-- At most one partial document per paper and workspace, so two ingests
+-- starting together cannot both create one
+create unique index if not exists rag_files_partial_ingest_key_idx
+on public.rag_files (user_id, workspace_id, (metadata->>'ingest_key'))
+where metadata->>'ingest_state' = 'partial';
+
+-- Which chunks of a partial document are already stored; unique, so a
+-- resent batch skips rows that are already in (insert ... on conflict do nothing)
+delete from public.rag_chunks a
+using public.rag_chunks b
+where a.file_id = b.file_id and a.chunk_index = b.chunk_index and a.ctid > b.ctid;
+
+drop index if exists public.rag_chunks_file_chunk_idx;
+create unique index rag_chunks_file_chunk_idx
+on public.rag_chunks (file_id, chunk_index);
+
+-- Search only complete documents
+create or replace function match_rag_chunks (
+  query_embedding vector(384),
+  match_threshold float,
+  match_count int,
+  filter_user_id uuid,
+  filter_workspace_id uuid
+)
+returns table (
+  id uuid,
+  file_id uuid,
+  chunk_text text,
+  similarity float,
+  metadata jsonb
+)
+language plpgsql
+as $$
+begin
+  return query
+  select
+    rag_chunks.id,
+    rag_chunks.file_id,
+    rag_chunks.chunk_text,
+    1 - (rag_chunks.embedding <=> query_embedding) as similarity,
+    rag_chunks.metadata
+  from rag_chunks
+  join rag_files on rag_files.id = rag_chunks.file_id
+  where 1 - (rag_chunks.embedding <=> query_embedding) > match_threshold
+  and rag_files.user_id = filter_user_id
+  and rag_files.workspace_id = filter_workspace_id
+  and coalesce(rag_files.metadata->>'ingest_state', 'complete') <> 'partial'
+  order by rag_chunks.embedding <=> query_embedding
+  limit match_count;
+end;
+$$;
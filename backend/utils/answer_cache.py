@@ -0,0 +1,130 @@
+"""
+Semantic Answer Cache
+Reuses chat answers for near-identical questions against an unchanged workspace
+"""
+import os
+import time
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class _Scope:
+    def __init__(self, version: int, dim: int, capacity: int):
+        self.version = version
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.answers = []  # (created_at, answer) aligned with vectors rows
+        self.next_row = 0  # ring buffer position once full
+
+
+class SemanticAnswerCache:
+    """
+    Answers are cached per (user, workspace) together with the workspace's
+    content version. A question whose unit-normalized embedding lies within
+    `max_distance` (cosine distance) of a cached one gets the cached answer.
+    Adding or deleting papers bumps the workspace version, dropping its
+    entries. Each scope holds at most `per_scope` answers (oldest replaced
+    first) and at most `max_scopes` scopes are kept (LRU).
+    """
+
+    def __init__(self, max_distance: float = 0.05, per_scope: int = 128, max_scopes: int = 1024, ttl: float = 3600.0):
+        self.max_distance = max_distance
+        self.per_scope = per_scope
+        self.max_scopes = max_scopes
+        self.ttl = ttl
+        self._versions = {}  # workspace_id -> int
+        self._scopes = OrderedDict()  # (user_id, workspace_id) -> _Scope
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, user_id: str, workspace_id: str, question_embedding) -> dict | None:
+        query = self._unit(question_embedding)
+        with self._lock:
+            self.lookups += 1
+            scope = self._scopes.get((user_id, workspace_id))
+            if scope is None or scope.version != self._versions.get(workspace_id, 0) or not scope.answers:
+                return None
+            self._scopes.move_to_end((user_id, workspace_id))
+
+            similarities = scope.vectors[:len(scope.answers)] @ query
+            best = int(np.argmax(similarities))
+            created_at, answer = scope.answers[best]
+            if 1.0 - similarities[best] > self.max_distance or time.time() - created_at > self.ttl:
+                return None
+            self.hits += 1
+            return answer
+
+    def version(self, workspace_id: str) -> int:
+        with self._lock:
+            return self._versions.get(workspace_id, 0)
+
+    def put(self, user_id: str, workspace_id: str, question_embedding, answer: dict, version: int):
+        """
+        Cache an answer computed against workspace `version` (read via
+        version() before retrieval); dropped if the workspace changed since.
+        """
+        vector = self._unit(question_embedding)
+        key = (user_id, workspace_id)
+        with self._lock:
+            if version != self._versions.get(workspace_id, 0):
+                return
+            scope = self._scopes.get(key)
+            if scope is None or scope.version != version:
+                scope = _Scope(version, vector.shape[0], self.per_scope)
+                self._scopes[key] = scope
+            self._scopes.move_to_end(key)
+
+            entry = (time.time(), answer)
+            if len(scope.answers) < self.per_scope:
+                row = len(scope.answers)
+                scope.answers.append(entry)
+            else:
+                row = scope.next_row
+                scope.answers[row] = entry
+                scope.next_row = (row + 1) % self.per_scope
+            scope.vectors[row] = vector
+
+            while len(self._scopes) > self.max_scopes:
+                self._scopes.popitem(last=False)
+
+    def invalidate(self, workspace_id: str):
+        """
+        Call whenever papers are added to or deleted from the workspace.
+        """
+        with self._lock:
+            self._versions[workspace_id] = self._versions.get(workspace_id, 0) + 1
+            for key in [k for k in self._scopes if k[1] == workspace_id]:
+                del self._scopes[key]
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "scopes": len(self._scopes),
+                "entries": sum(len(s.answers) for s in self._scopes.values()),
+                "max_distance": self.max_distance,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "llm_calls_saved": self.hits,
+                "invalidations": self.invalidations,
+            }
+
+
+answer_cache = SemanticAnswerCache(
+    max_distance=float(os.environ.get("ANSWER_CACHE_MAX_DISTANCE", "0.05")),
+    per_scope=int(os.environ.get("ANSWER_CACHE_PER_WORKSPACE", "128")),
+    max_scopes=int(os.environ.get("ANSWER_CACHE_MAX_WORKSPACES", "1024")),
+    ttl=float(os.environ.get("ANSWER_CACHE_TTL", "3600")),
+)
@@ -0,0 +1,261 @@
+"""
+arXiv Search Client
+Pooled async HTTP client + TTL result cache with coalescing of identical queries
+"""
+import os
+import time
+import uuid
+import asyncio
+import logging
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+ARXIV_API_URL = "http://export.arxiv.org/api/query"
+ATOM_NS = {"atom": "http://www.w3.org/2005/Atom"}
+STREAM_CACHE_MAX_RESULTS = 200
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+
+BOOLEAN_OPERATORS = {"AND", "OR", "ANDNOT"}
+
+
+def normalize_query(query: str) -> str:
+    """
+    Cache key form of a query. arXiv terms are case-insensitive and repeated
+    whitespace is ignored, but AND / OR / ANDNOT are operators only in upper
+    case, so those keep their case. Only used for keys: upstream always
+    gets the query as the user typed it.
+    """
+    return " ".join(word if word in BOOLEAN_OPERATORS else word.lower() for word in query.split())
+
+
+def parse_entry(entry) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "title": entry.find("atom:title", ATOM_NS).text.strip(),
+        "authors": [
+            a.find("atom:name", ATOM_NS).text
+            for a in entry.findall("atom:author", ATOM_NS)
+        ],
+        "abstract": entry.find("atom:summary", ATOM_NS).text.strip(),
+        "date": entry.find("atom:published", ATOM_NS).text[:4],
+        "source": "arXiv",
+        "citations": None,
+        "tags": [],
+        "imported": False,
+        "link": entry.find("atom:id", ATOM_NS).text,
+    }
+
+
+class AtomEntryParser:
+    """
+    Incremental Atom parser: feed() bytes as they arrive and get back the
+    paper dicts of every <entry> completed so far. Finished entries are
+    detached from the tree, so memory stays flat for any feed size.
+    """
+
+    ENTRY_TAG = "{http://www.w3.org/2005/Atom}entry"
+
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._root = None
+
+    def feed(self, data: bytes) -> list[dict]:
+        self._parser.feed(data)
+        return self._drain()
+
+    def close(self) -> list[dict]:
+        self._parser.close()
+        return self._drain()
+
+    def _drain(self) -> list[dict]:
+        papers = []
+        for event, elem in self._parser.read_events():
+            if event == "start":
+                if self._root is None:
+                    self._root = elem
+            elif elem.tag == self.ENTRY_TAG:
+                papers.append(parse_entry(elem))
+                self._root.remove(elem)
+        return papers
+
+
+def parse_feed(response_text: str) -> list[dict]:
+    """
+    Parse an arXiv Atom feed into paper dicts. Raises ET.ParseError.
+    """
+    parser = AtomEntryParser()
+    return parser.feed(response_text.encode("utf-8")) + parser.close()
+
+
+class ArxivSearchClient:
+    """
+    One long-lived httpx.AsyncClient (keep-alive to export.arxiv.org), a TTL
+    cache keyed by (normalized query, start, max_results), and in-flight
+    coalescing so concurrent identical searches share one upstream request.
+    """
+
+    def __init__(self, ttl: float = 600.0, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._client = None
+        self._cache = OrderedDict()  # key -> (expires_at, papers)
+        self._inflight = {}  # key -> asyncio.Task
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.upstream_requests = 0
+
+    def _get_client(self):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                headers=HEADERS,
+                timeout=httpx.Timeout(30.0, connect=10.0),
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _cache_get(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, papers = entry
+        if expires_at <= time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return papers
+
+    def _cache_put(self, key, papers):
+        self._cache[key] = (time.monotonic() + self.ttl, papers)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def search(self, query: str, start: int = 0, max_results: int = 12) -> list[dict]:
+        """
+        Search arXiv. Upstream or parse failures return [] and are not cached.
+        """
+        key = (normalize_query(query), start, max_results)
+
+        papers = self._cache_get(key)
+        if papers is not None:
+            self.hits += 1
+            return papers
+        self.misses += 1
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(self._fetch(key, query))
+        self._inflight[key] = task
+        try:
+            papers = await asyncio.shield(task)
+        finally:
+            self._inflight.pop(key, None)
+        return papers
+
+    async def _fetch(self, key, query: str) -> list[dict]:
+        _, start, max_results = key
+        params = {
+            "search_query": f"all:{query}",
+            "start": start,
+            "max_results": max_results,
+        }
+        self.upstream_requests += 1
+        try:
+            response = await self._get_client().get(ARXIV_API_URL, params=params)
+            logger.info(f"arXiv response status: {response.status_code}")
+            if response.status_code != 200:
+                logger.error(f"Error fetching from arXiv: {response.status_code}")
+                return []
+        except Exception as e:
+            logger.error(f"Error fetching from arXiv: {e}")
+            return []
+
+        try:
+            papers = parse_feed(response.text)
+        except ET.ParseError as e:
+            logger.error(f"XML Parse Error: {e}")
+            return []
+
+        self._cache_put(key, papers)
+        return papers
+
+    async def stream(self, query: str, start: int = 0, max_results: int = 100):
+        """
+        Async generator of paper dicts, yielded as entries arrive from arXiv.
+        Served from the result cache when possible; pages of up to
+        STREAM_CACHE_MAX_RESULTS entries are cached once complete.
+        """
+        key = (normalize_query(query), start, max_results)
+        papers = self._cache_get(key)
+        if papers is not None:
+            self.hits += 1
+            for paper in papers:
+                yield paper
+            return
+        self.misses += 1
+
+        params = {
+            "search_query": f"all:{query}",
+            "start": start,
+            "max_results": max_results,
+        }
+        collected = [] if max_results <= STREAM_CACHE_MAX_RESULTS else None
+        parser = AtomEntryParser()
+        self.upstream_requests += 1
+        try:
+            async with self._get_client().stream("GET", ARXIV_API_URL, params=params) as response:
+                if response.status_code != 200:
+                    logger.error(f"Error fetching from arXiv: {response.status_code}")
+                    return
+                async for data in response.aiter_bytes():
+                    for paper in parser.feed(data):
+                        if collected is not None:
+                            collected.append(paper)
+                        yield paper
+            for paper in parser.close():
+                if collected is not None:
+                    collected.append(paper)
+                yield paper
+        except ET.ParseError as e:
+            logger.error(f"XML Parse Error: {e}")
+            return
+        except Exception as e:
+            logger.error(f"Error streaming from arXiv: {e}")
+            return
+
+        if collected is not None:
+            self._cache_put(key, collected)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._cache),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "coalesced": self.coalesced,
+            "upstream_requests": self.upstream_requests,
+        }
+
+
+arxiv_client = ArxivSearchClient(
+    ttl=float(os.environ.get("ARXIV_CACHE_TTL", "600")),
+    max_entries=int(os.environ.get("ARXIV_CACHE_MAX_ENTRIES", "1024")),
+)
@@ -0,0 +1,185 @@
+"""
+Auth Utility
+Local Supabase JWT verification + bounded TTL cache of verified tokens
+"""
+import os
+import json
+import time
+import base64
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def token_expiry(token: str) -> float | None:
+    """
+    Read the `exp` claim without verifying the signature.
+    Only used to bound cache lifetime of tokens already verified elsewhere.
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except Exception:
+        return None
+
+
+class TokenCache:
+    """
+    Bounded TTL cache of verified users, keyed by the SHA-256 of the token.
+    Entries never outlive the token's own `exp` claim.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # token hash -> (expires_at, claims)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str) -> dict | None:
+        key = self.key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, claims = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return claims
+
+    def put(self, token: str, claims: dict, token_exp: float | None = None):
+        expires_at = time.time() + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        if expires_at <= time.time():
+            return
+        key = self.key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+class LocalJWTVerifier:
+    """
+    Verify Supabase access tokens without calling the Auth server.
+
+    Uses SUPABASE_JWT_SECRET (HS256 projects) when set, otherwise the
+    project's JWKS endpoint (asymmetric signing keys), which PyJWT caches.
+    A JWKS that cannot be fetched or has no signing keys (a legacy HS256
+    project without the secret) turns local verification off for
+    `unusable_ttl` seconds, so cache misses go straight to Supabase Auth
+    instead of fetching JWKS first. A problem with one token (HS256 header,
+    unknown kid) only sends that token to Supabase Auth.
+    """
+
+    def __init__(self, unusable_ttl: float = 300.0):
+        self._jwks_client = None
+        self.unusable_ttl = unusable_ttl
+        self._unusable_until = 0.0
+        self.local_verifications = 0
+        self.remote_fallbacks = 0
+        self.jwks_unusable = 0
+
+    @property
+    def available(self) -> bool:
+        if os.environ.get("AUTH_LOCAL_JWT", "1") == "0":
+            return False
+        try:
+            import jwt  # noqa: F401
+        except ImportError:
+            return False
+        if os.environ.get("SUPABASE_JWT_SECRET"):
+            return True
+        return bool(os.environ.get("SUPABASE_URL")) and time.monotonic() >= self._unusable_until
+
+    def _mark_unusable(self, reason: str):
+        self._unusable_until = time.monotonic() + self.unusable_ttl
+        self.jwks_unusable += 1
+        logger.warning(f"No usable JWKS key ({reason}); using Supabase Auth for {self.unusable_ttl:.0f}s")
+
+    def _signing_key(self, token: str):
+        import jwt
+        from jwt.exceptions import PyJWKClientConnectionError, PyJWKSetError
+
+        secret = os.environ.get("SUPABASE_JWT_SECRET")
+        if secret:
+            return secret, ["HS256"]
+
+        if jwt.get_unverified_header(token).get("alg") == "HS256":
+            raise jwt.InvalidAlgorithmError("HS256 token and no SUPABASE_JWT_SECRET")
+        if self._jwks_client is None:
+            jwks_url = os.environ["SUPABASE_URL"].rstrip("/") + "/auth/v1/.well-known/jwks.json"
+            self._jwks_client = jwt.PyJWKClient(jwks_url, cache_keys=True, lifespan=3600)
+        try:
+            # Served from PyJWT's cache after the first fetch
+            self._jwks_client.get_signing_keys()
+        except (jwt.PyJWKClientError, PyJWKSetError) as e:
+            # Unreachable, malformed or empty JWKS: no token can be verified locally
+            self._mark_unusable(str(e))
+            raise
+        # No key for this token's kid (even after a refetch) only fails this token
+        try:
+            return self._jwks_client.get_signing_key_from_jwt(token).key, ["RS256", "ES256"]
+        except PyJWKClientConnectionError as e:
+            # The refetch for an unknown kid failed
+            self._mark_unusable(str(e))
+            raise
+
+    def verify(self, token: str) -> dict:
+        """
+        Decode and validate the token. Raises jwt.PyJWTError on any failure.
+        """
+        import jwt
+
+        key, algorithms = self._signing_key(token)
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=algorithms,
+            audience=os.environ.get("SUPABASE_JWT_AUDIENCE", "authenticated"),
+            options={"require": ["exp", "sub"]},
+        )
+        self.local_verifications += 1
+        return claims
+
+    def stats(self) -> dict:
+        return {
+            "local_verifications": self.local_verifications,
+            "remote_fallbacks": self.remote_fallbacks,
+            "jwks_unusable": self.jwks_unusable,
+            "local_enabled": self.available,
+        }
+
+
+token_cache = TokenCache(
+    max_entries=int(os.environ.get("AUTH_CACHE_MAX_ENTRIES", "10000")),
+    ttl=float(os.environ.get("AUTH_CACHE_TTL", "300")),
+)
+jwt_verifier = LocalJWTVerifier(unusable_ttl=float(os.environ.get("AUTH_JWKS_UNUSABLE_TTL", "300")))
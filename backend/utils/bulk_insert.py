@@ -0,0 +1,263 @@
+"""
+Bulk Insert Utility
+Concurrent, payload-sized batch inserts through PostgREST, with compact pgvector literals
+"""
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List
+import httpx
+import numpy as np
+from utils.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Batches in flight per writer, and the cap on a batch's estimated JSON body
+BULK_INSERT_WORKERS = int(os.environ.get("BULK_INSERT_WORKERS", "4"))
+BULK_INSERT_MAX_BYTES = int(os.environ.get("BULK_INSERT_MAX_BYTES", str(1024 * 1024)))
+BULK_INSERT_MAX_ROWS = int(os.environ.get("BULK_INSERT_MAX_ROWS", "500"))
+# Resends of a batch after a transient error, with exponential backoff
+BULK_INSERT_RETRIES = int(os.environ.get("BULK_INSERT_RETRIES", "3"))
+BULK_INSERT_BACKOFF = float(os.environ.get("BULK_INSERT_BACKOFF", "0.5"))
+# Decimals kept per vector component; 6 is far below float32 noise in cosine scores
+VECTOR_TEXT_DIGITS = int(os.environ.get("VECTOR_TEXT_DIGITS", "6"))
+
+# Shared by all writers; each writer bounds its own in-flight batches
+_executor = ThreadPoolExecutor(max_workers=BULK_INSERT_WORKERS * 4, thread_name_prefix="bulk-insert")
+_formats = {}
+
+
+def vector_literals(vectors, digits: int | None = None) -> List[str]:
+    """
+    pgvector text literals ("[0.012346,-0.5,...]") for the rows of a
+    matrix, with a fixed number of decimals. About half the size of a JSON
+    list of float64 reprs and faster to build; PostgREST casts the string
+    into the vector column.
+    """
+    digits = VECTOR_TEXT_DIGITS if digits is None else digits
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    key = (vectors.shape[1], digits)
+    fmt = _formats.get(key)
+    if fmt is None:
+        # One C-level %-format per row instead of one per component
+        fmt = _formats[key] = "[" + ",".join([f"%.{digits}f"] * vectors.shape[1]) + "]"
+    return [fmt % tuple(row) for row in vectors.tolist()]
+
+
+def vector_literal(vector, digits: int | None = None) -> str:
+    """
+    One embedding as a pgvector literal. Strings (e.g. embeddings read back
+    from rag_chunks) are passed through unchanged.
+    """
+    if isinstance(vector, str):
+        return vector
+    return vector_literals(vector, digits)[0]
+
+
+def _row_bytes(row: Dict[str, Any]) -> int:
+    # Estimated JSON size: strings dominate (chunk text, vector literal)
+    size = 2
+    for key, value in row.items():
+        size += len(key) + 4
+        size += len(value) + 2 if isinstance(value, str) else len(json.dumps(value))
+    return size
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Connection failures, timeouts, 429 and 5xx responses: worth retrying,
+    though the request may or may not have been applied.
+    """
+    if isinstance(error, (ConnectionError, TimeoutError, httpx.TransportError)):
+        return True
+    code = str(getattr(error, "code", "") or "")
+    if code in ("429", "500", "502", "503", "504"):
+        return True
+    message = str(error).lower()
+    return any(s in message for s in ("timed out", "timeout", "connection reset", "503 service", "502 bad gateway", "504 gateway"))
+
+
+def _too_large(error: Exception) -> bool:
+    message = str(error)
+    return "413" in message or "too large" in message.lower()
+
+
+class _BulkInsertStats:
+    def __init__(self):
+        self.request_ms = Histogram([25, 50, 100, 250, 500, 1000, 2500, 5000])
+        self.rows_per_request = Histogram([10, 25, 50, 100, 250, 500, 1000])
+        self.counts = {"requests": 0, "rows": 0, "bytes": 0, "split_retries": 0, "transient_retries": 0, "rows_already_stored": 0, "failures": 0}
+        self._lock = threading.Lock()
+
+    def record(self, rows: int, size: int, seconds: float):
+        self.request_ms.observe(seconds * 1000.0)
+        self.rows_per_request.observe(rows)
+        with self._lock:
+            self.counts["requests"] += 1
+            self.counts["rows"] += rows
+            self.counts["bytes"] += size
+
+    def count(self, name: str):
+        self.count_rows(name, 1)
+
+    def count_rows(self, name: str, n: int):
+        with self._lock:
+            self.counts[name] += n
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = dict(self.counts)
+        return {
+            **counts,
+            "workers": BULK_INSERT_WORKERS,
+            "max_bytes": BULK_INSERT_MAX_BYTES,
+            "max_rows": BULK_INSERT_MAX_ROWS,
+            "vector_digits": VECTOR_TEXT_DIGITS,
+            "bytes_per_row": round(counts["bytes"] / counts["rows"], 1) if counts["rows"] else None,
+            "request_ms": self.request_ms.snapshot(),
+            "rows_per_request": self.rows_per_request.snapshot(),
+        }
+
+
+bulk_insert_stats = _BulkInsertStats()
+
+
+class BulkInserter:
+    """
+    Inserts rows into one table. Rows are grouped into batches of at most
+    max_rows rows and max_bytes of estimated payload, so batch size adapts
+    to chunk length, and up to `workers` batches are sent at once. add()
+    blocks while that many are in flight. A batch rejected as too large
+    (HTTP 413) is split in half and retried. A batch that failed
+    transiently is resent up to `retries` times; `missing`, if given,
+    first filters out rows that reached the table anyway. With
+    `on_conflict` (a unique key's columns), rows are upserted and rows
+    whose key is already present are skipped instead of failing the batch.
+
+    Call flush() to send the rest and wait; it raises the first insert
+    error. on_progress, if given, gets the number of rows stored so far.
+    """
+
+    def __init__(
+        self,
+        client,
+        table: str,
+        workers: int | None = None,
+        max_bytes: int | None = None,
+        max_rows: int | None = None,
+        on_progress: Callable[[int], None] = None,
+        missing: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]] = None,
+        retries: int | None = None,
+        on_conflict: str | None = None
+    ):
+        self.client = client
+        self.table = table
+        self.workers = BULK_INSERT_WORKERS if workers is None else max(1, workers)
+        self.max_bytes = BULK_INSERT_MAX_BYTES if max_bytes is None else max_bytes
+        self.max_rows = BULK_INSERT_MAX_ROWS if max_rows is None else max_rows
+        self.on_progress = on_progress
+        self.missing = missing
+        self.retries = BULK_INSERT_RETRIES if retries is None else retries
+        self.on_conflict = on_conflict
+        self.stored = 0
+        self._pending = []
+        self._pending_bytes = 0
+        self._futures = []
+        self._errors = []
+        self._slots = threading.Semaphore(self.workers)
+        self._lock = threading.Lock()
+
+    def add(self, rows: List[Dict[str, Any]]):
+        self._raise_if_failed()
+        for row in rows:
+            size = _row_bytes(row)
+            if self._pending and (self._pending_bytes + size > self.max_bytes or len(self._pending) >= self.max_rows):
+                self._submit()
+            self._pending.append(row)
+            self._pending_bytes += size
+
+    def flush(self) -> int:
+        """
+        Send pending rows, wait for every batch and return the rows stored.
+        """
+        self._raise_if_failed()
+        if self._pending:
+            self._submit()
+        wait(self._futures)
+        self._futures = []
+        self._raise_if_failed()
+        return self.stored
+
+    def close(self):
+        """
+        Drop pending rows and wait for batches already sent, e.g. before
+        deleting a document whose insert failed.
+        """
+        self._pending, self._pending_bytes = [], 0
+        wait(self._futures)
+        self._futures = []
+
+    def _raise_if_failed(self):
+        if self._errors:
+            raise self._errors[0]
+
+    def _submit(self):
+        batch, size = self._pending, self._pending_bytes
+        self._pending, self._pending_bytes = [], 0
+        self._slots.acquire()
+        self._futures.append(_executor.submit(self._run, batch, size))
+
+    def _run(self, batch: List[Dict[str, Any]], size: int):
+        try:
+            if not self._errors:
+                self._insert(batch, size)
+        except Exception as e:
+            bulk_insert_stats.count("failures")
+            logger.error(f"Bulk insert into {self.table} failed ({len(batch)} rows): {e}")
+            self._errors.append(e)
+        finally:
+            self._slots.release()
+
+    def _insert(self, batch: List[Dict[str, Any]], size: int, attempt: int = 0):
+        started = time.perf_counter()
+        try:
+            table = self.client.table(self.table)
+            if self.on_conflict:
+                # INSERT ... ON CONFLICT DO NOTHING
+                table.upsert(batch, on_conflict=self.on_conflict, ignore_duplicates=True).execute()
+            else:
+                table.insert(batch).execute()
+        except Exception as e:
+            if len(batch) >= 2 and _too_large(e):
+                bulk_insert_stats.count("split_retries")
+                half = len(batch) // 2
+                for part in (batch[:half], batch[half:]):
+                    self._insert(part, sum(_row_bytes(row) for row in part))
+                return
+            if attempt >= self.retries or not is_transient(e) or self._errors:
+                raise
+            bulk_insert_stats.count("transient_retries")
+            logger.warning(f"Bulk insert into {self.table} failed transiently, retrying: {e}")
+            time.sleep(BULK_INSERT_BACKOFF * 2 ** attempt)
+            remaining = self.missing(batch) if self.missing else batch
+            self._stored(len(batch) - len(remaining))
+            bulk_insert_stats.count_rows("rows_already_stored", len(batch) - len(remaining))
+            if remaining:
+                self._insert(remaining, sum(_row_bytes(row) for row in remaining), attempt + 1)
+            return
+        bulk_insert_stats.record(len(batch), size, time.perf_counter() - started)
+        self._stored(len(batch))
+
+    def _stored(self, rows: int):
+        if not rows:
+            return
+        with self._lock:
+            self.stored += rows
+            # Under the lock so progress never goes backwards
+            if self.on_progress:
+                self.on_progress(self.stored)
@@ -2,8 +2,24 @@
 Text Chunking Utility
 Chunks text intelligently with minimal filtering
 """
+import os
 import re
-from typing import List
+import logging
+import threading
+from itertools import chain
+from typing import Iterable, Iterator, List
+from utils.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# "chars": fixed character windows; "tokens": sentence/section-aligned chunks
+# sized by the embedder's tokenizer so nothing is truncated at embedding time
+CHUNKING_MODE = os.environ.get("CHUNKING_MODE", "chars")
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "32"))
+CHUNK_MIN_TOKENS = 8
+# iter_chunks in "tokens" mode chunks this much cleaned text at a time,
+# cut at a section heading (or, failing one, at 4x this size)
+STREAM_SEGMENT_CHARS = 20000
 
 
 BAD_SECTIONS = [
@@ -11,60 +27,141 @@ BAD_SECTIONS = [
     "bibliography"
 ]
 
+BOILERPLATE = [
+    "all rights reserved",
+    "this paper is submitted to",
+]
+
+# Line boundaries other than "\n" that str.splitlines() also honours
+OTHER_LINE_BREAKS = "\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+LINE_BREAK_TABLE = str.maketrans({c: "\n" for c in OTHER_LINE_BREAKS})
+NON_BLANK_RE = re.compile(r"\S")
+
+# Abstracts sit near the top and are short, so the search is bounded by
+# these windows instead of scanning (and backtracking over) the whole text
+ABSTRACT_SCAN_CHARS = 50000
+ABSTRACT_MAX_CHARS = 5000
+ABSTRACT_MAX_HEADERS = 10
+ABSTRACT_HEADER_RE = re.compile(r"^[ \t]*abstract\b[ \t]*[:\-—.]?", re.IGNORECASE | re.MULTILINE)
+ABSTRACT_END_RE = re.compile(r"\n[ \t]*\n|\n[ \t]*(?:1[.\s]|introduction)", re.IGNORECASE)
+LATEX_ABSTRACT = ("\\begin{abstract}", "\\end{abstract}")
+
+# Numbered ("3.2 Training Setup", section numbers up to 99) or all-caps
+# ("RELATED WORK") short lines; _headings() also checks the lines around them
+SECTION_HEADING_RE = re.compile(
+    r"^[ \t]*(?:[1-9]\d?(?:\.\d{1,2}){0,3}\.?[ \t]+[A-Z][^\n]{0,56}[^.,;:\n]|[A-Z][A-Z \t\-]{3,40}[A-Z])[ \t]*$",
+    re.MULTILINE,
+)
+# A wrapped body line ("100 Million tokens from the web and") ends mid-phrase
+HEADING_TRAILING_WORD_RE = re.compile(r"\b(?:a|an|and|as|at|by|for|from|in|of|on|or|the|to|with)$")
+# Characters that may end the line before a heading
+HEADING_PRECEDING_END = ".!?:;)]"
+# Split after sentence-ending punctuation followed by whitespace
+SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def _is_header_line(text: str, start: int, end: int) -> bool:
+    # text[start:end] is alone on a line (besides spaces/tabs), with a newline on both sides
+    while start > 0 and text[start - 1] in " \t":
+        start -= 1
+    while end < len(text) and text[end] in " \t":
+        end += 1
+    return start > 0 and text[start - 1] == "\n" and end < len(text) and text[end] == "\n"
+
+
+def _references_start(text: str, lowered: str) -> int:
+    """
+    Offset of the newline before the first header line of the first
+    BAD_SECTIONS entry present (in list order), else len(text).
+    `lowered` is text.lower(), used for case-insensitive str.find.
+    """
+    for sec in BAD_SECTIONS:
+        pos = lowered.find(sec)
+        while pos != -1:
+            if _is_header_line(lowered, pos, pos + len(sec)):
+                return lowered.rfind("\n", 0, pos)
+            pos = lowered.find(sec, pos + len(sec))
+    return len(text)
+
+
+def _lower(text: str) -> str:
+    lowered = text.lower()
+    # A few characters lower-case to two; keep offsets aligned with text
+    return lowered if len(lowered) == len(text) else "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
 
 def clean_text(text: str) -> str:
     """
     Light cleaning ONLY.
     Do NOT delete content aggressively.
+    Drops blank lines, pure boilerplate lines and everything after a
+    references/bibliography header. Every step is a linear C-level string
+    pass; lines are only lower-cased when the text contains boilerplate.
     """
-    lines = text.splitlines()
-    cleaned = []
+    return _clean(text)[0]
 
-    for line in lines:
-        l = line.lower().strip()
 
-        # Drop empty lines
-        if not l:
-            continue
+def _clean(text: str) -> tuple[str, bool]:
+    # clean_text, plus whether a references header cut the text short
+    lowered = _lower(text)
+    cut = _references_start(text, lowered)
+    was_cut = cut < len(text)
+    if was_cut:
+        text, lowered = text[:cut], lowered[:cut]
+    if any(c in text for c in OTHER_LINE_BREAKS):
+        text = text.replace("\r\n", "\n").translate(LINE_BREAK_TABLE)
 
-        # Drop pure boilerplate lines ONLY
-        if (
-            "all rights reserved" in l
-            or "this paper is submitted to" in l
-        ):
-            continue
+    lines = [line for line in text.split("\n") if line and not line.isspace()]
 
-        cleaned.append(line)
+    # Drop pure boilerplate lines ONLY (per-line lower() only for phrases present)
+    for phrase in BOILERPLATE:
+        if phrase in lowered:
+            lines = [line for line in lines if phrase not in line.lower()]
 
-    return "\n".join(cleaned)
+    return "\n".join(lines), was_cut
+
+
+def abstract_span(text: str) -> tuple[int, int] | None:
+    """
+    Offsets of the abstract body, or None. Looks for a LaTeX abstract
+    environment or an "Abstract" header line within the first
+    ABSTRACT_SCAN_CHARS, ending at a blank line or an introduction /
+    section 1 heading within ABSTRACT_MAX_CHARS. Worst case is linear in
+    those windows, never in the text length.
+    """
+    scan_end = min(len(text), ABSTRACT_SCAN_CHARS)
+
+    begin = text.find(LATEX_ABSTRACT[0], 0, scan_end)
+    if begin != -1:
+        start = begin + len(LATEX_ABSTRACT[0])
+        end = text.find(LATEX_ABSTRACT[1], start, start + ABSTRACT_MAX_CHARS)
+        if end != -1:
+            return start, end
+
+    for attempt, header in enumerate(ABSTRACT_HEADER_RE.finditer(text, 0, scan_end)):
+        if attempt >= ABSTRACT_MAX_HEADERS:
+            break
+        start = header.end()
+        # Header on its own line: the body starts on the next non-blank line
+        body = NON_BLANK_RE.search(text, start, start + ABSTRACT_MAX_CHARS)
+        if not body:
+            continue
+        end = ABSTRACT_END_RE.search(text, body.start(), body.start() + ABSTRACT_MAX_CHARS)
+        if end:
+            return body.start(), end.start()
+    return None
 
 
 def extract_abstract(text: str) -> str | None:
     """
-    Extract abstract safely with multiple patterns.
-    """
-    # Try multiple patterns
-    patterns = [
-        # Standard "Abstract" header
-        r"abstract\s*(.+?)(\n\s*\n|introduction|\n1\s)",
-        # LaTeX style
-        r"\\begin{abstract}(.+?)\\end{abstract}",
-        # All caps
-        r"ABSTRACT\s*(.+?)(\n\s*\n|INTRODUCTION|\n1\s)",
-        # With colon/dash
-        r"abstract\s*[:\-—]\s*(.+?)(\n\s*\n|introduction|\n1\s)",
-        # Numbered section
-        r"abstract\s*\n(.+?)(\n\s*\n|\n1\.|introduction)",
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-        if match:
-            abstract = match.group(1).strip()
-            # Clean up and validate
-            if len(abstract) > 50:  # Must be substantial
-                return abstract[:2000]  # Cap at reasonable length
-    
+    Extract abstract safely (bounded search, see abstract_span).
+    """
+    span = abstract_span(text)
+    if span:
+        abstract = text[span[0]:span[1]].strip()
+        # Clean up and validate
+        if len(abstract) > 50:  # Must be substantial
+            return abstract[:2000]  # Cap at reasonable length
     return None
 
 
@@ -72,12 +169,38 @@ def remove_references(text: str) -> str:
     """
     Remove references ONLY after section header.
     """
-    for sec in BAD_SECTIONS:
-        pattern = rf"\n{sec}\n"
-        split = re.split(pattern, text, flags=re.IGNORECASE)
-        if len(split) > 1:
-            return split[0]
-    return text
+    cut = _references_start(text, _lower(text))
+    return text[:cut] if cut < len(text) else text
+
+
+def chunk_spans(
+    text: str,
+    chunk_size: int = 1200,
+    overlap: int = 200
+) -> tuple[str, List[tuple[int, int]]]:
+    """
+    Clean the text once and return it with the (start, end) offsets of its
+    chunks: windows of chunk_size characters, overlapping by `overlap`,
+    trimmed of surrounding whitespace, dropping those of 200 characters or
+    fewer. Chunks are only copied out when the caller slices them.
+    """
+    text = clean_text(text)
+    step = chunk_size - overlap
+    spans = []
+
+    for start in range(0, len(text), step):
+        end = min(start + chunk_size, len(text))
+        # Trim whitespace by moving the offsets instead of calling strip()
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+
+        # KEEP chunks unless they are very small
+        if end - start > 200:
+            spans.append((start, end))
+
+    return text, spans
 
 
 def chunk_text(
@@ -88,40 +211,203 @@ def chunk_text(
     """
     Chunk by characters, not lines.
     """
-    text = remove_references(text)
-    text = clean_text(text)
+    text, spans = chunk_spans(text, chunk_size, overlap)
+    return [text[start:end] for start, end in spans]
 
-    chunks = []
-    start = 0
 
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end].strip()
+def _headings(text: str, pos: int = 0) -> Iterator[re.Match]:
+    """
+    SECTION_HEADING_RE matches in cleaned text (from `pos`) that also look
+    like headings in context: the line does not end on a connecting word,
+    the next line does not continue it in lower case, and the line opens
+    the text or follows a finished sentence or another heading-like line.
+    Only the neighbouring lines are read, so a match's verdict does not
+    depend on where the scan started.
+    """
+    for match in SECTION_HEADING_RE.finditer(text, pos):
+        line = match.group(0).strip()
+        if HEADING_TRAILING_WORD_RE.search(line):
+            continue
+        following = text[match.end() + 1:match.end() + 2]
+        if following.islower():
+            continue
+        start = match.start()
+        if start > 0:
+            previous = text[text.rfind("\n", 0, start - 1) + 1:start - 1].rstrip()
+            if previous and previous[-1] not in HEADING_PRECEDING_END and not SECTION_HEADING_RE.fullmatch(previous):
+                continue
+        yield match
 
-        # KEEP chunks unless they are very small
-        if len(chunk) > 200:
-            chunks.append(chunk)
 
-        start = end - overlap
+def _sections(text: str) -> List[tuple[str | None, str]]:
+    """
+    Split cleaned text at heading lines into (heading, body) pairs. The
+    heading line stays at the start of its body, so no text is dropped
+    even when a body line is mistaken for a heading.
+    """
+    sections = []
+    title, start = None, 0
+    for match in _headings(text):
+        sections.append((title, text[start:match.start()]))
+        title, start = match.group(0).strip(), match.start()
+    sections.append((title, text[start:]))
+    return [(t, body) for t, body in sections if body.strip()]
+
+
+def _split_long(sentence: str, tokenizer, max_tokens: int, overlap_tokens: int) -> List[tuple[str, int]]:
+    # Cut a sentence longer than the budget at token boundaries
+    offsets = tokenizer(sentence, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    step = max(1, max_tokens - overlap_tokens)
+    pieces = []
+    for i in range(0, len(offsets), step):
+        window = offsets[i:i + max_tokens]
+        pieces.append((sentence[window[0][0]:window[-1][1]], len(window)))
+        if i + max_tokens >= len(offsets):
+            break
+    return pieces
+
 
+def chunk_by_tokens(
+    text: str,
+    tokenizer,
+    max_tokens: int,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS
+) -> List[dict]:
+    """
+    Pack whole sentences into chunks of at most max_tokens word pieces,
+    never crossing a section heading. Consecutive chunks of a section share
+    up to overlap_tokens worth of trailing sentences. Sentences longer than
+    the budget are cut at token boundaries.
+
+    Returns:
+        List of {"text", "section", "tokens"} dicts
+    """
+    return _token_chunks(clean_text(text), tokenizer, max_tokens, overlap_tokens)
+
+
+def _token_chunks(cleaned: str, tokenizer, max_tokens: int, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[dict]:
+    # chunk_by_tokens on already cleaned text
+    sections = _sections(cleaned)
+    sentences = [
+        [s for s in SENTENCE_SPLIT_RE.split(body.strip()) if s and not s.isspace()]
+        for _, body in sections
+    ]
+    flat = [s for group in sentences for s in group]
+    if not flat:
+        return []
+    # One batched (fast, Rust) tokenizer call for the whole paper
+    lengths = iter([len(ids) for ids in tokenizer(flat, add_special_tokens=False)["input_ids"]])
+
+    chunks = []
+    for (title, _), group in zip(sections, sentences):
+        current, current_tokens = [], 0
+
+        def flush():
+            if current_tokens >= CHUNK_MIN_TOKENS:
+                chunks.append({"text": " ".join(s for s, _ in current), "section": title, "tokens": current_tokens})
+
+        for sentence in group:
+            n = next(lengths)
+            if n > max_tokens:
+                flush()
+                current, current_tokens = [], 0
+                for piece, piece_tokens in _split_long(sentence, tokenizer, max_tokens, overlap_tokens):
+                    chunks.append({"text": piece, "section": title, "tokens": piece_tokens})
+                continue
+            if current_tokens + n > max_tokens:
+                flush()
+                # Carry trailing sentences into the next chunk as overlap
+                carried, carried_tokens = [], 0
+                for s, m in reversed(current):
+                    if carried_tokens + m > overlap_tokens or carried_tokens + m + n > max_tokens:
+                        break
+                    carried.insert(0, (s, m))
+                    carried_tokens += m
+                current, current_tokens = carried, carried_tokens
+            current.append((sentence, n))
+            current_tokens += n
+        flush()
     return chunks
 
 
-def prepare_chunks(full_text: str, abstract: str | None = None) -> List[dict]:
+class _ChunkingStats:
+    """
+    How well chunks fit the embedder's input: a chunk longer than its
+    token limit is silently truncated, and those tokens are never embedded.
+    """
+
+    def __init__(self):
+        self.chunk_tokens = Histogram([32, 64, 128, 192, 256, 384, 512, 1024])
+        self.counts = {"papers": 0, "chunks": 0, "truncated_chunks": 0, "tokens": 0, "tokens_truncated": 0}
+        self.last_paper = None
+        self._lock = threading.Lock()
+
+    def record(self, mode: str, token_counts: List[int], max_tokens: int):
+        for n in token_counts:
+            self.chunk_tokens.observe(n)
+        truncated = [n - max_tokens for n in token_counts if n > max_tokens]
+        with self._lock:
+            self.counts["papers"] += 1
+            self.counts["chunks"] += len(token_counts)
+            self.counts["truncated_chunks"] += len(truncated)
+            self.counts["tokens"] += sum(token_counts)
+            self.counts["tokens_truncated"] += sum(truncated)
+            self.last_paper = {
+                "mode": mode,
+                "chunks": len(token_counts),
+                "truncated_chunks": len(truncated),
+                "tokens": sum(token_counts),
+                "tokens_truncated": sum(truncated),
+                # Share of the embedder's input capacity filled with text
+                "utilization": round(sum(min(n, max_tokens) for n in token_counts) / (len(token_counts) * max_tokens), 3) if token_counts else None,
+            }
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                **self.counts,
+                "mode": CHUNKING_MODE,
+                "truncated_token_share": self.counts["tokens_truncated"] / self.counts["tokens"] if self.counts["tokens"] else 0.0,
+                "chunk_tokens": self.chunk_tokens.snapshot(),
+                "last_paper": self.last_paper,
+            }
+
+
+chunking_stats = _ChunkingStats()
+
+
+def _token_budget() -> tuple:
+    from utils.embeddings import embedder
+    # [CLS] and [SEP] take two of the model's positions
+    return embedder.tokenizer, embedder.max_seq_length - 2
+
+
+def prepare_chunks(full_text: str, abstract: str | None = None, mode: str | None = None) -> List[dict]:
     """
     Chunk text and prepare with metadata
-    
+
     Args:
         full_text: Full paper text
         abstract: Abstract text (injected separately)
-    
+        mode: "chars" or "tokens" (defaults to CHUNKING_MODE)
+
     Returns:
         List of chunk dicts with text and metadata
     """
+    mode = mode or CHUNKING_MODE
+    if mode == "tokens":
+        tokenizer, max_tokens = _token_budget()
+        pieces = [dict(piece, type="abstract") for piece in chunk_by_tokens(abstract, tokenizer, max_tokens)] if abstract else []
+        pieces += [dict(piece, type="body") for piece in chunk_by_tokens(full_text, tokenizer, max_tokens)]
+        # Abstract first at index 0, body from 1 when there is no abstract (as in "chars" mode)
+        chunk_dicts = [dict(piece, index=i) for i, piece in enumerate(pieces, start=0 if abstract else 1)]
+        chunking_stats.record(mode, [c["tokens"] for c in chunk_dicts], max_tokens)
+        return chunk_dicts
+
     chunks = chunk_text(full_text, chunk_size=1000, overlap=175)
-    
+
     chunk_dicts = []
-    
+
     # Add abstract as first chunk if available
     if abstract:
         chunk_dicts.append({
@@ -129,7 +415,7 @@ def prepare_chunks(full_text: str, abstract: str | None = None) -> List[dict]:
             "type": "abstract",
             "index": 0
         })
-    
+
     # Add regular chunks
     for i, chunk in enumerate(chunks, start=1):
         chunk_dicts.append({
@@ -137,5 +423,134 @@ def prepare_chunks(full_text: str, abstract: str | None = None) -> List[dict]:
             "type": "body",
             "index": i
         })
-    
+
+    _record_char_chunks(chunk_dicts)
     return chunk_dicts
+
+
+def _record_char_chunks(chunk_dicts: List[dict]):
+    # Measure how much of each character window the embedder actually sees
+    counts = _extend_token_counts([], [c["text"] for c in chunk_dicts])
+    if counts:
+        chunking_stats.record("chars", counts, _token_budget()[1])
+
+
+def _extend_token_counts(counts: List[int] | None, texts: List[str]) -> List[int] | None:
+    # None once the tokenizer has failed, so the paper is not recorded
+    if counts is None or not texts:
+        return counts
+    try:
+        tokenizer, _ = _token_budget()
+        counts.extend(len(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"])
+        return counts
+    except Exception as e:
+        logger.warning(f"Could not measure chunk token lengths: {e}")
+        return None
+
+
+def _clean_pages(pages: Iterable[str]) -> Iterator[str]:
+    """
+    clean_text applied page by page, stopping after the first page with a
+    references header. Pages are whole lines, so this matches cleaning the
+    joined text, except that the first header seen wins over BAD_SECTIONS order.
+    """
+    first = True
+    for page in pages:
+        if not page:
+            continue
+        # Pages are joined by blank lines, so a header may open or close a page
+        cleaned, cut = _clean(("" if first else "\n") + page + "\n")
+        first = False
+        if cleaned:
+            yield cleaned
+        if cut:
+            return
+
+
+def _char_windows(texts: Iterable[str], chunk_size: int, overlap: int) -> Iterator[str]:
+    # chunk_text over the "\n"-joined texts, buffering less than one window
+    step = chunk_size - overlap
+    buf, pos = "", 0
+    for text in texts:
+        buf = buf[pos:] + "\n" + text if buf else text
+        pos = 0
+        while pos + chunk_size <= len(buf):
+            window = buf[pos:pos + chunk_size].strip()
+            if len(window) > 200:
+                yield window
+            pos += step
+    while pos < len(buf):
+        window = buf[pos:pos + chunk_size].strip()
+        if len(window) > 200:
+            yield window
+        pos += step
+
+
+def _segments(texts: Iterable[str], size: int = STREAM_SEGMENT_CHARS) -> Iterator[str]:
+    # Regroup cleaned texts into runs of about `size` chars that start at a heading
+    buf, heading, scanned = "", 0, 0
+    for text in texts:
+        buf = buf + "\n" + text if buf else text
+        # The last line's next line is on a later page, so it is judged once that arrives
+        last_line = buf.rfind("\n") + 1
+        for match in _headings(buf, scanned):
+            if match.start() >= last_line:
+                break
+            heading = match.start()
+        scanned = last_line
+        if len(buf) < size:
+            continue
+        if heading > 0:
+            yield buf[:heading]
+            buf, scanned, heading = buf[heading:], scanned - heading, 0
+        elif len(buf) >= 4 * size:
+            yield buf
+            buf, scanned = "", 0
+    if buf:
+        yield buf
+
+
+def iter_chunks(pages: Iterable[str], abstract: str | None = None, mode: str | None = None) -> Iterator[dict]:
+    """
+    Streaming prepare_chunks: consumes page texts lazily and yields the
+    same chunk dicts (abstract first, running "index") while buffering
+    about one window, or one STREAM_SEGMENT_CHARS segment in "tokens" mode.
+    Stops pulling pages at the references header.
+    """
+    mode = mode or CHUNKING_MODE
+    texts = _clean_pages(pages)
+    index = 0 if abstract else 1
+
+    if mode == "tokens":
+        tokenizer, max_tokens = _token_budget()
+
+        def body():
+            # A segment cut mid-section continues the previous section
+            section = None
+            for segment in _segments(texts):
+                for piece in _token_chunks(segment, tokenizer, max_tokens):
+                    section = piece["section"] = piece["section"] or section
+                    yield dict(piece, type="body")
+
+        head = [dict(piece, type="abstract") for piece in chunk_by_tokens(abstract, tokenizer, max_tokens)] if abstract else []
+        counts = []
+        for piece in chain(head, body()):
+            counts.append(piece["tokens"])
+            yield dict(piece, index=index)
+            index += 1
+        chunking_stats.record(mode, counts, max_tokens)
+        return
+
+    # Token lengths are measured a batch at a time, as in _record_char_chunks
+    counts, pending = [], []
+    windows = _char_windows(texts, chunk_size=1000, overlap=175)
+    for text in chain([abstract] if abstract else [], windows):
+        yield {"text": text, "type": "abstract" if index == 0 else "body", "index": index}
+        index += 1
+        pending.append(text)
+        if len(pending) >= 64:
+            counts = _extend_token_counts(counts, pending)
+            pending = []
+    counts = _extend_token_counts(counts, pending)
+    if counts:
+        chunking_stats.record("chars", counts, _token_budget()[1])
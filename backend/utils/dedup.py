@@ -0,0 +1,103 @@
+"""
+Ingestion Dedup Utility
+Content keys for papers + in-process store of extracted text, chunks and embeddings
+"""
+import os
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+ARXIV_HOSTS = {"arxiv.org", "export.arxiv.org"}
+# New-style (2103.14030v2) and old-style (hep-th/9901001, math.GT/0309136v1) IDs
+ARXIV_ID_RE = re.compile(r"(?:\d{4}\.\d{4,5}|[a-z]+(?:-[a-z]+)*(?:\.[A-Z]{2})?/\d{7})(?:v\d+)?")
+ARXIV_PATH_RE = re.compile(r"/(?:abs|pdf)/(.+?)(?:\.pdf)?/?")
+
+
+def is_arxiv_id(arxiv_id: str | None) -> bool:
+    return bool(arxiv_id) and ARXIV_ID_RE.fullmatch(arxiv_id) is not None
+
+
+def arxiv_id_from_url(url: str) -> str | None:
+    """
+    'https://arxiv.org/pdf/2103.14030v2.pdf' -> '2103.14030v2'
+    Only URLs on the arXiv hosts count; anything else (including a URL
+    that merely contains an arXiv path) returns None.
+    """
+    try:
+        parsed = urlparse(url or "")
+        host = parsed.hostname
+    except ValueError:
+        return None
+    if parsed.scheme not in ("http", "https") or host not in ARXIV_HOSTS:
+        return None
+    match = ARXIV_PATH_RE.fullmatch(parsed.path)
+    if not match or not is_arxiv_id(match.group(1)):
+        return None
+    return match.group(1)
+
+
+def content_key_for_url(url: str) -> str | None:
+    """
+    Content key of an arXiv URL; None for other URLs, which are keyed by
+    content_key_for_bytes once downloaded.
+    """
+    arxiv_id = arxiv_id_from_url(url)
+    return f"arxiv:{arxiv_id}" if arxiv_id else None
+
+
+def content_key_for_bytes(content: bytes) -> str:
+    return "sha256:" + hashlib.sha256(content).hexdigest()
+
+
+class ContentStore:
+    """
+    Bounded LRU of content key -> processed paper. Each entry may hold
+    `full_text`/`abstract` (after extraction) and `chunks`/`embeddings`
+    (after embedding). Counts hits per source so /metrics can report
+    how much work dedup saved.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {"present": 0, "in_progress": 0, "db_copy": 0, "resumed": 0, "embedded": 0, "text": 0, "miss": 0}
+
+    def get(self, key: str | None) -> dict | None:
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str | None, **fields):
+        if key is None:
+            return
+        with self._lock:
+            entry = self._entries.pop(key, {})
+            entry.update(fields)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record(self, outcome: str):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                **self.counts,
+            }
+
+
+content_store = ContentStore(max_entries=int(os.environ.get("CONTENT_STORE_MAX_ENTRIES", "256")))
@@ -0,0 +1,413 @@
+"""
+Embedding Store
+Memory-mapped on-disk workspace indexes: a float32/float16 vector matrix plus sidecars
+"""
+import os
+import json
+import time
+import logging
+import threading
+import numpy as np
+from typing import List
+from utils.rag import top_k_rows, as_vector, normalize_rows, COMPACT_RATIO, COMPACT_MIN_ROWS
+from utils.quantization import quantize_int8, int8_scores
+
+try:
+    import fcntl
+except ImportError:  # Windows: lock a byte of the lock file with msvcrt instead
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+META_FILE = "meta.json"
+LOCK_FILE = "lock"
+SEARCH_BLOCK_ROWS = 16384  # rows scored per matmul, bounds temporary float32 memory
+REFRESH_ATTEMPTS = 3
+
+
+def _lock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return
+    lock_file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            time.sleep(0.1)  # LK_LOCK gave up after ~10s; keep waiting like flock
+
+
+def _unlock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class MmapWorkspaceIndex:
+    """
+    One workspace's chunks on disk, searched through np.memmap so workers
+    share pages via the OS page cache and resident memory stays small.
+
+    Directory layout (<gen> changes on every rebuild/compaction):
+        meta.json        dim, dtype, count, generation, live row range per file, dead row ranges
+        vectors-<gen>    (count, dim) unit-normalized vectors, raw float32/float16
+        ends-<gen>       (count,) int64 end offset of each row's record in chunks-<gen>
+        chunks-<gen>     one JSON record per row (id, file_id, chunk_text, metadata, ...)
+        codes-<gen>      (count, dim) int8 codes, scales-<gen> (count,) float32  [quantization="int8"]
+
+    With int8 quantization the scan reads the 4x smaller codes and only a
+    shortlist of rerank_factor * k rows is rescored with exact vectors.
+
+    Appends write the data files first and replace meta.json last, so a
+    reader always sees a consistent prefix. Writers across processes are
+    serialized with flock (msvcrt.locking on Windows). Same interface as
+    InMemoryRAG.
+    """
+
+    def __init__(self, path: str, dtype: str = "float32", quantization: str = "none", rerank_factor: int = 4):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self._lock = threading.Lock()
+        self._meta = None
+        self._meta_mtime = None
+        self._vectors = None
+        self._ends = None
+        self._chunks = None
+        self._codes = None
+        self._scales = None
+        self._alive = None
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.path, META_FILE))
+
+    def _file(self, kind: str, generation: int) -> str:
+        return os.path.join(self.path, f"{kind}-{generation}")
+
+    # --- reading ---
+
+    def _refresh(self):
+        """
+        (Re)open the memmaps if meta.json changed since they were opened.
+        """
+        for attempt in range(REFRESH_ATTEMPTS):
+            try:
+                return self._open_current()
+            except FileNotFoundError:
+                # A compaction or rebuild removed the generation meta.json named
+                # before it was mapped; the new meta.json names its successor
+                if attempt == REFRESH_ATTEMPTS - 1:
+                    raise
+
+    def _open_current(self):
+        meta_path = os.path.join(self.path, META_FILE)
+        try:
+            st = os.stat(meta_path)
+            mtime = (st.st_ino, st.st_mtime_ns)  # meta.json is replaced, never edited in place
+        except FileNotFoundError:
+            with self._lock:
+                self._meta, self._vectors, self._ends, self._alive, self._meta_mtime = None, None, None, None, None
+                self._chunks = self._codes = self._scales = None
+            return
+        if mtime == self._meta_mtime:
+            return
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+        count, gen = meta["count"], meta["generation"]
+        vectors = ends = chunks = codes = scales = None
+        if count:
+            vectors = np.memmap(self._file("vectors", gen), dtype=meta["dtype"], mode="r", shape=(count, meta["dim"]))
+            ends = np.memmap(self._file("ends", gen), dtype=np.int64, mode="r", shape=(count,))
+            # Mapped like the vectors, so a search keeps reading its generation after a rebuild unlinks it
+            chunks = np.memmap(self._file("chunks", gen), dtype=np.uint8, mode="r", shape=(int(ends[-1]),))
+            if meta.get("quantization") == "int8":
+                codes = np.memmap(self._file("codes", gen), dtype=np.int8, mode="r", shape=(count, meta["dim"]))
+                scales = np.memmap(self._file("scales", gen), dtype=np.float32, mode="r", shape=(count,))
+        alive = np.ones(count, dtype=bool)
+        for start, end in meta["dead"]:
+            alive[start:end] = False
+
+        with self._lock:
+            self._meta, self._vectors, self._ends, self._alive = meta, vectors, ends, alive
+            self._chunks, self._codes, self._scales = chunks, codes, scales
+            self._meta_mtime = mtime
+
+    @property
+    def size(self) -> int:
+        self._refresh()
+        return int(self._alive.sum()) if self._alive is not None else 0
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Size of the mapped files plus the row mask, so a byte-bounded cache
+        of indexes also bounds how much they keep mapped.
+        """
+        with self._lock:
+            arrays = (self._alive, self._vectors, self._ends, self._chunks, self._codes, self._scales)
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    @staticmethod
+    def _read_chunk(chunks, ends, row: int) -> dict:
+        start = int(ends[row - 1]) if row else 0
+        return json.loads(chunks[start:int(ends[row])].tobytes())
+
+    def search(self, query_embedding, top_k: int = 5, min_similarity: float | None = None) -> List[dict]:
+        """
+        Top-k chunks by cosine similarity to an already computed query embedding.
+        """
+        return self.search_batch(np.asarray(query_embedding, dtype=np.float32)[None, :], top_k, min_similarity)[0]
+
+    def search_batch(self, query_embeddings, top_k: int = 5, min_similarity: float | None = None) -> List[List[dict]]:
+        """
+        search() for a (Q, D) matrix of queries. The matrix (or the int8
+        codes) is scanned in blocks of SEARCH_BLOCK_ROWS, keeping the running
+        top candidates per query.
+        """
+        queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32))
+        self._refresh()
+        with self._lock:
+            vectors, ends, chunks, alive = self._vectors, self._ends, self._chunks, self._alive
+            codes, scales = self._codes, self._scales
+        if vectors is None or not alive.any():
+            return [[] for _ in range(len(queries))]
+
+        scan_k = top_k * self.rerank_factor if codes is not None else top_k
+        candidates, candidate_scores = [], []
+        for start in range(0, len(vectors), SEARCH_BLOCK_ROWS):
+            end = start + SEARCH_BLOCK_ROWS
+            if codes is not None:
+                similarities = int8_scores(queries, codes[start:end], scales[start:end])
+            else:
+                similarities = queries @ np.asarray(vectors[start:end], dtype=np.float32).T
+            similarities[:, ~alive[start:end]] = -np.inf
+            top, scores = top_k_rows(similarities, scan_k)
+            candidates.append(top + start)
+            candidate_scores.append(scores)
+        order, top_scores = top_k_rows(np.concatenate(candidate_scores, axis=1), scan_k)
+        top = np.take_along_axis(np.concatenate(candidates, axis=1), order, axis=1)
+
+        if codes is not None:
+            # Exact rerank of the shortlist; only these rows of the full vectors are read
+            exact = np.einsum("qd,qsd->qs", queries, np.asarray(vectors[top], dtype=np.float32))
+            exact[top_scores == -np.inf] = -np.inf
+            order, top_scores = top_k_rows(exact, top_k)
+            top = np.take_along_axis(top, order, axis=1)
+
+        batch = []
+        for rows, scores in zip(top, top_scores):
+            results = []
+            for row, score in zip(rows, scores):
+                if score == -np.inf or (min_similarity is not None and score <= min_similarity):
+                    break
+                results.append({
+                    **self._read_chunk(chunks, ends, int(row)),
+                    "similarity": float(score)
+                })
+            batch.append(results)
+        return batch
+
+    # --- writing ---
+
+    def _write_locked(self, fn):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, LOCK_FILE), "a") as lock_file:
+            _lock(lock_file)
+            try:
+                return fn()
+            finally:
+                _unlock(lock_file)
+
+    def _load_meta(self) -> dict | None:
+        try:
+            with open(os.path.join(self.path, META_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _save_meta(self, meta: dict):
+        tmp_path = os.path.join(self.path, f"{META_FILE}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.path, META_FILE))
+
+    def _append(self, meta: dict, chunks: List[dict]) -> dict:
+        """
+        Append chunks (grouped by file) after meta["count"] rows; returns the new meta.
+        Any tail left by an interrupted append is truncated first.
+        """
+        gen, count = meta["generation"], meta["count"]
+        chunks = sorted(chunks, key=lambda c: str(c.get("file_id")))  # rows of a file stay contiguous
+        vectors = np.empty((len(chunks), meta["dim"] or len(as_vector(chunks[0]["embedding"]))), dtype=np.float32)
+        for row, c in enumerate(chunks):
+            vectors[row] = as_vector(c["embedding"])
+        meta["dim"] = vectors.shape[1]
+        vectors = normalize_rows(vectors)
+        parts = [("vectors", count * meta["dim"] * np.dtype(meta["dtype"]).itemsize, vectors.astype(meta["dtype"]).tobytes())]
+        if meta["quantization"] == "int8":
+            codes, scales = quantize_int8(vectors)
+            parts += [("codes", count * meta["dim"], codes.tobytes()), ("scales", count * 4, scales.tobytes())]
+
+        records = [
+            json.dumps({k: v for k, v in c.items() if k != "embedding"}).encode("utf-8") + b"\n"
+            for c in chunks
+        ]
+        chunk_bytes = 0
+        if count:
+            chunk_bytes = int(np.memmap(self._file("ends", gen), dtype=np.int64, mode="r", shape=(count,))[-1])
+        ends = chunk_bytes + np.cumsum([len(r) for r in records], dtype=np.int64)
+
+        parts += [("ends", count * 8, ends.tobytes()), ("chunks", chunk_bytes, b"".join(records))]
+        for kind, offset, data in parts:
+            with open(self._file(kind, gen), "r+b" if os.path.exists(self._file(kind, gen)) else "wb") as f:
+                f.truncate(offset)
+                f.seek(offset)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+        for row, c in enumerate(chunks):
+            file_id = c.get("file_id")
+            if file_id is None:
+                continue
+            start, _ = meta["files"].get(str(file_id), (count + row, None))
+            meta["files"][str(file_id)] = [start, count + row + 1]
+        meta["count"] = count + len(chunks)
+        return meta
+
+    def _new_meta(self, generation: int) -> dict:
+        return {"dim": 0, "dtype": self.dtype.name, "count": 0, "generation": generation, "files": {}, "dead": [],
+                "quantization": self.quantization}
+
+    def index_chunks(self, chunks: List[dict]):
+        """
+        Replace the store with these chunks (chunks without an embedding are skipped).
+        """
+        chunks = [c for c in chunks if c.get("embedding") is not None and len(c["embedding"])]
+
+        def build():
+            old = self._load_meta()
+            meta = self._new_meta(old["generation"] + 1 if old else 1)
+            if chunks:
+                meta = self._append(meta, chunks)
+            self._save_meta(meta)
+            if old:
+                self._remove_generation(old["generation"])
+
+        self._write_locked(build)
+        self._refresh()
+
+    def add_chunks(self, chunks: List[dict]):
+        """
+        Append chunks in O(len(chunks)).
+        """
+        chunks = [c for c in chunks if c.get("embedding") is not None and len(c["embedding"])]
+        if not chunks:
+            return
+
+        def append():
+            meta = self._load_meta() or self._new_meta(1)
+            self._save_meta(self._append(meta, chunks))
+
+        self._write_locked(append)
+        self._refresh()
+
+    def remove_file(self, file_id) -> int:
+        """
+        Tombstone a file's rows; compacts into a new generation once removed
+        rows exceed COMPACT_RATIO of the store.
+        """
+        file_id = str(file_id)
+
+        def remove():
+            meta = self._load_meta()
+            if not meta or file_id not in meta["files"]:
+                return 0
+            start, end = meta["files"].pop(file_id)
+            meta["dead"].append([start, end])
+            dead = sum(e - s for s, e in meta["dead"])
+            if dead > COMPACT_MIN_ROWS and dead > meta["count"] * COMPACT_RATIO:
+                self._compact(meta)
+            else:
+                self._save_meta(meta)
+            return end - start
+
+        removed = self._write_locked(remove)
+        self._refresh()
+        return removed
+
+    def _compact(self, meta: dict):
+        # Caller holds the write lock. Streams live rows into a new generation.
+        gen, count = meta["generation"], meta["count"]
+        alive = np.ones(count, dtype=bool)
+        for start, end in meta["dead"]:
+            alive[start:end] = False
+        keep = np.flatnonzero(alive)
+
+        new_gen = gen + 1
+        new_meta = self._new_meta(new_gen)
+        new_meta.update(dim=meta["dim"], dtype=meta["dtype"], count=len(keep), quantization=meta["quantization"])
+        vectors = np.memmap(self._file("vectors", gen), dtype=meta["dtype"], mode="r", shape=(count, meta["dim"]))
+        ends = np.memmap(self._file("ends", gen), dtype=np.int64, mode="r", shape=(count,))
+        new_ends = np.empty(len(keep), dtype=np.int64)
+        position = 0
+        with open(self._file("vectors", new_gen), "wb") as vf, open(self._file("chunks", new_gen), "wb") as cf, \
+                open(self._file("chunks", gen), "rb") as old_chunks:
+            for i in range(0, len(keep), SEARCH_BLOCK_ROWS):
+                vf.write(np.ascontiguousarray(vectors[keep[i:i + SEARCH_BLOCK_ROWS]]).tobytes())
+            if meta["quantization"] == "int8":
+                codes = np.memmap(self._file("codes", gen), dtype=np.int8, mode="r", shape=(count, meta["dim"]))
+                scales = np.memmap(self._file("scales", gen), dtype=np.float32, mode="r", shape=(count,))
+                with open(self._file("codes", new_gen), "wb") as qf:
+                    for i in range(0, len(keep), SEARCH_BLOCK_ROWS):
+                        qf.write(np.ascontiguousarray(codes[keep[i:i + SEARCH_BLOCK_ROWS]]).tobytes())
+                with open(self._file("scales", new_gen), "wb") as sf:
+                    sf.write(np.ascontiguousarray(scales[keep]).tobytes())
+            for new_row, row in enumerate(keep):
+                start = int(ends[row - 1]) if row else 0
+                old_chunks.seek(start)
+                record = old_chunks.read(int(ends[row]) - start)
+                cf.write(record)
+                position += len(record)
+                new_ends[new_row] = position
+        with open(self._file("ends", new_gen), "wb") as f:
+            f.write(new_ends.tobytes())
+
+        new_row = np.full(count, -1)
+        new_row[keep] = np.arange(len(keep))
+        for f, (start, end) in meta["files"].items():
+            new_meta["files"][f] = [int(new_row[start]), int(new_row[end - 1]) + 1]
+        self._save_meta(new_meta)
+        self._remove_generation(gen)
+        logger.info(f"Compacted {self.path} from {count} to {len(keep)} rows")
+
+    def _remove_generation(self, generation: int):
+        # Open memmaps of other readers (chunks included) keep the unlinked inodes alive
+        for kind in ("vectors", "ends", "chunks", "codes", "scales"):
+            try:
+                os.unlink(self._file(kind, generation))
+            except FileNotFoundError:
+                pass
+
+    def delete(self):
+        """
+        Remove the store from disk (rebuilt from the database on next use).
+        """
+        self._write_locked(lambda: [
+            os.unlink(os.path.join(self.path, name))
+            for name in os.listdir(self.path) if name != LOCK_FILE
+        ])
+        self._refresh()
+
+    def disk_bytes(self) -> int:
+        total = 0
+        for dirpath, _, filenames in os.walk(self.path):
+            total += sum(os.path.getsize(os.path.join(dirpath, name)) for name in filenames)
+        return total
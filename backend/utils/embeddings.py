@@ -1,5 +1,12 @@
 # from sentence_transformers import SentenceTransformer
+import os
+import time
+import queue
 import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from utils.metrics import Histogram
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +24,219 @@ class LazyEmbedder:
             logger.info("Embedding model loaded.")
         return self._model
 
+    @property
+    def tokenizer(self):
+        return self.model.tokenizer
+
+    @property
+    def max_seq_length(self) -> int:
+        # Word pieces per input, including [CLS]/[SEP]; the rest is truncated
+        return self.model.max_seq_length
+
     def encode(self, *args, **kwargs):
         return self.model.encode(*args, **kwargs)
 
+class BatchingEmbedder:
+    """
+    Micro-batches concurrent single-text encode calls into one forward pass.
+
+    Callers block on encode(text). A background thread takes the first
+    waiting request, keeps collecting for up to `max_wait_ms` or until
+    `max_batch` requests are queued, then encodes them together.
+    """
+
+    def __init__(self, base: LazyEmbedder, max_batch: int = 32, max_wait_ms: float = 5.0):
+        self.base = base
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64])
+        self.queue_wait_ms = Histogram([1, 2, 5, 10, 25, 50, 100, 250])
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._start_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+                    self._worker.start()
+
+    def encode(self, text: str):
+        """
+        Encode one string, returns a 1-D numpy array.
+        """
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future.result()
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            for _, _, enqueued_at in batch:
+                self.queue_wait_ms.observe((started - enqueued_at) * 1000.0)
+            self.batch_sizes.observe(len(batch))
+
+            try:
+                vectors = self.base.encode([text for text, _, _ in batch], convert_to_numpy=True)
+            except Exception as e:
+                logger.error(f"Batch encode failed: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queued": self._queue.qsize(),
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+        }
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU of query text -> float32 vector in front of an encoder.
+
+    Keys are (prefix, normalized text); the prefix is kept separate so a
+    fixed retrieval prefix does not bloat every key. Normalization collapses
+    whitespace and lower-cases, which is lossless for the uncased MiniLM
+    tokenizer. Optionally persisted to `path` (.npz) across restarts.
+    """
+
+    def __init__(self, encoder, max_bytes: int = 16 * 1024 * 1024, path: str | None = None):
+        self.encoder = encoder
+        self.max_bytes = max_bytes
+        self.path = path
+        self._entries = OrderedDict()  # key -> np.ndarray (float32)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path:
+            self.load()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.split()).lower()
+
+    @staticmethod
+    def _entry_bytes(key: str, vector) -> int:
+        return vector.nbytes + len(key) + 64  # rough per-entry overhead
+
+    def encode(self, text: str, prefix: str = ""):
+        """
+        Encode prefix + text, returns a 1-D float32 numpy array.
+        The returned array is shared with the cache; do not modify it in place.
+        """
+        import numpy as np
+
+        normalized = self.normalize(text)
+        key = f"{prefix}\x00{normalized}"
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        vector = np.asarray(self.encoder.encode(prefix + normalized), dtype=np.float32)
+        vector.setflags(write=False)
+        self._put(key, vector)
+        return vector
+
+    def _put(self, key: str, vector):
+        size = self._entry_bytes(key, vector)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= self._entry_bytes(key, old)
+            self._entries[key] = vector
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                old_key, old_vector = self._entries.popitem(last=False)
+                self._bytes -= self._entry_bytes(old_key, old_vector)
+
+    def load(self):
+        import numpy as np
+
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                keys, vectors = data["keys"], data["vectors"]
+            for key, vector in zip(keys.tolist(), vectors):
+                vector = np.ascontiguousarray(vector, dtype=np.float32)
+                vector.setflags(write=False)
+                self._put(key, vector)
+            logger.info(f"Loaded {len(self._entries)} cached query embeddings from {self.path}")
+        except Exception as e:
+            logger.warning(f"Could not load query embedding cache: {e}")
+
+    def save(self):
+        """
+        Atomically write the cache to `path` (no-op if persistence is off).
+        """
+        import numpy as np
+
+        if not self.path:
+            return
+        with self._lock:
+            if not self._entries:
+                return
+            keys = np.array(list(self._entries.keys()))
+            vectors = np.stack(list(self._entries.values()))
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, keys=keys, vectors=vectors)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"Could not save query embedding cache: {e}")
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
 embedder = LazyEmbedder()
+query_embedder = BatchingEmbedder(
+    embedder,
+    max_batch=int(os.environ.get("EMBED_MAX_BATCH", "32")),
+    max_wait_ms=float(os.environ.get("EMBED_MAX_WAIT_MS", "5")),
+)
+query_cache = QueryEmbeddingCache(
+    query_embedder,
+    max_bytes=int(float(os.environ.get("QUERY_CACHE_MAX_MB", "16")) * 1024 * 1024),
+    path=os.environ.get("QUERY_CACHE_PATH") or None,
+)
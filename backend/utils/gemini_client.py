@@ -1,52 +1,380 @@
 import os
 import time
+import random
+import asyncio
 import logging
+import threading
 import traceback
+from collections import deque
 # from google import genai
 from dotenv import load_dotenv
 
 # Setup logger
 logger = logging.getLogger(__name__)
 
-def generate_response(system_prompt: str, user_prompt: str):
+MODEL = "gemini-2.5-flash"
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+ERROR_MESSAGE = "I encountered an error while processing your request. Please try again later."
+
+
+class LLMOverloaded(Exception):
     """
-    Generate response using Gemini 2.5 Flash with retry logic
+    Raised instead of queueing when the LLM budget is exhausted, so callers
+    can answer 503 + Retry-After right away.
     """
-    try:
-        load_dotenv()
-        api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY or GEMINI_API_KEY not found in environment variables")
-            
-        from google import genai
-        c = genai.Client(api_key=api_key)
-        
-        combined_prompt = f"{system_prompt}\n\nUser Question: {user_prompt}"
-        
-        # Retry with exponential backoff for rate limits
-        max_retries = 3
-        for attempt in range(max_retries):
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM is overloaded, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def _is_rate_limit(e: Exception) -> bool:
+    # Check for rate limit errors (429 or ResourceExhausted)
+    error_str = str(e)
+    return "429" in error_str or "ResourceExhausted" in error_str
+
+
+class FairLimiter:
+    """
+    FIFO concurrency limiter shared by threads and asyncio tasks.
+    When a slot frees up it is handed directly to the longest waiter,
+    so bursts are served in arrival order.
+    """
+
+    def __init__(self, limit: int, max_queue: int | None = None):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._waiters = deque()  # wake callbacks
+        self._lock = threading.Lock()
+
+    def _try_acquire(self) -> bool:
+        # Caller holds the lock
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return True
+        if self.max_queue is not None and len(self._waiters) >= self.max_queue:
+            raise LLMOverloaded(retry_after=1.0)
+        return False
+
+    def acquire(self):
+        with self._lock:
+            if self._try_acquire():
+                return
+            event = threading.Event()
+            self._waiters.append(event.set)
+        event.wait()
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._try_acquire():
+                return
+            future = loop.create_future()
+
+            def wake():
+                loop.call_soon_threadsafe(self._hand_over, future)
+
+            self._waiters.append(wake)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # slot arrived just as we were cancelled
+            raise
+
+    def _hand_over(self, future):
+        # A cancelled waiter passes its slot on instead of leaking it
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                wake = self._waiters.popleft()  # slot transfers, in_flight unchanged
+            else:
+                self.in_flight -= 1
+                return
+        wake()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+
+class AdaptiveTokenBucket:
+    """
+    Process-wide request budget. Tokens refill at `rate` per second up to
+    `burst`. Callers reserve a token and get back how long to wait for it
+    (never sleeping here); if that wait exceeds `max_wait` the request is
+    shed with LLMOverloaded. A 429 halves the rate (down to `min_rate`),
+    each success restores 5% of `max_rate` (AIMD).
+    """
+
+    def __init__(self, rate: float, burst: float, min_rate: float = 0.2):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.shed = 0
+        self.rate_limited = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, max_wait: float) -> float:
+        with self._lock:
+            self._refill()
+            wait = max(0.0, (1.0 - self.tokens) / self.rate)
+            if wait > max_wait:
+                self.shed += 1
+                raise LLMOverloaded(retry_after=wait)
+            self.tokens -= 1.0  # may go negative: later callers wait behind this reservation
+            return wait
+
+    def refund(self):
+        # A reservation shed (by the concurrency limiter) before it was used
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + 1.0)
+
+    def on_rate_limited(self):
+        with self._lock:
+            self.rate_limited += 1
+            self.rate = max(self.min_rate, self.rate * 0.5)
+            self.tokens = min(self.tokens, 0.0)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refill()
+            return {
+                "rate": round(self.rate, 3),
+                "max_rate": self.max_rate,
+                "tokens": round(self.tokens, 3),
+                "shed": self.shed,
+                "rate_limited": self.rate_limited,
+            }
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter: uniform in [0, base * 2^attempt], so retries spread out
+    return random.uniform(0, BACKOFF_BASE * (2 ** attempt))
+
+
+class GeminiClientManager:
+    """
+    One long-lived genai.Client (and its pooled HTTP connections) shared by
+    every caller, with sync, streaming and async entry points behind a
+    fair concurrency limit. Only agenerate waits for rate budget and backs
+    off on 429s; the sync entry points run on request threads and shed
+    with LLMOverloaded instead of sleeping.
+    """
+
+    def __init__(self, max_concurrency: int = 8, max_queue: int = 64, bucket: AdaptiveTokenBucket = None, max_wait: float = 5.0):
+        self._client = None
+        self._client_lock = threading.Lock()
+        self.limiter = FairLimiter(max_concurrency, max_queue=max_queue)
+        self.bucket = bucket or AdaptiveTokenBucket(rate=5.0, burst=10.0)
+        self.max_wait = max_wait
+        self.requests = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    load_dotenv()
+                    api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
+                    if not api_key:
+                        raise ValueError("GOOGLE_API_KEY or GEMINI_API_KEY not found in environment variables")
+                    from google import genai
+                    base_url = os.getenv("LLM_BASE_URL")  # e.g. dev/fake_llm_server.py
+                    http_options = {"base_url": base_url} if base_url else None
+                    self._client = genai.Client(api_key=api_key, http_options=http_options)
+        return self._client
+
+    @staticmethod
+    def _prompt(system_prompt: str, user_prompt: str) -> str:
+        return f"{system_prompt}\n\nUser Question: {user_prompt}"
+
+    def _pace(self, attempt: int) -> float:
+        """
+        Seconds to wait before this attempt: the token-bucket reservation
+        plus jittered backoff on retries. Raises LLMOverloaded to shed.
+        """
+        wait = self.bucket.reserve(self.max_wait)
+        if attempt:
+            wait += _backoff(attempt)
+        return wait
+
+    def _acquire_now(self):
+        """
+        Token and slot for a sync call, which never sleeps for either token
+        or backoff: without a token right now it sheds.
+        """
+        self.bucket.reserve(0.0)
+        try:
+            self.limiter.acquire()
+        except LLMOverloaded:
+            self.bucket.refund()
+            raise
+
+    def _shed_if_rate_limited(self, e: Exception):
+        if _is_rate_limit(e):
+            self.bucket.on_rate_limited()
+            raise LLMOverloaded(retry_after=1.0 / self.bucket.rate) from e
+
+    def _retry_or_raise(self, e: Exception, attempt: int):
+        if not _is_rate_limit(e):
+            raise e
+        self.bucket.on_rate_limited()
+        if attempt >= MAX_RETRIES - 1:
+            raise e
+        logger.warning(f"Rate limit hit ({attempt+1}/{MAX_RETRIES}), backing off")
+
+    def generate(self, system_prompt: str, user_prompt: str) -> str:
+        """
+        Blocking call for threads. Sheds with LLMOverloaded when no token is
+        available or the model answers 429 (event-loop callers: agenerate).
+        """
+        contents = self._prompt(system_prompt, user_prompt)
+        self.requests += 1
+        self._acquire_now()
+        try:
+            response = self.client.models.generate_content(model=MODEL, contents=contents)
+            self.bucket.on_success()
+            logger.debug(f"Response received: {response.text[:100]}...")
+            return response.text
+        except Exception as e:
+            self._shed_if_rate_limited(e)
+            raise
+        finally:
+            self.limiter.release()
+
+    def generate_stream(self, system_prompt: str, user_prompt: str):
+        """
+        Yield text pieces as they arrive. Runs on a thread, so like generate
+        it sheds with LLMOverloaded rather than waiting for a token or
+        retrying a 429 (which can only happen before the first piece).
+        """
+        contents = self._prompt(system_prompt, user_prompt)
+        self.requests += 1
+        self._acquire_now()
+        sent = False
+        try:
+            for chunk in self.client.models.generate_content_stream(model=MODEL, contents=contents):
+                if chunk.text:
+                    sent = True
+                    yield chunk.text
+            self.bucket.on_success()
+        except Exception as e:
+            if not sent:
+                self._shed_if_rate_limited(e)
+            raise
+        finally:
+            self.limiter.release()
+
+    async def agenerate(self, system_prompt: str, user_prompt: str) -> str:
+        contents = self._prompt(system_prompt, user_prompt)
+        self.requests += 1
+        for attempt in range(MAX_RETRIES):
+            # Pace before taking a slot, so requests waiting on tokens don't hold one
+            wait = self._pace(attempt)
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                await self.limiter.acquire_async()
+            except LLMOverloaded:
+                self.bucket.refund()
+                raise
             try:
-                # Using the model name requested by user
-                response = c.models.generate_content(
-                    model="gemini-2.5-flash",
-                    contents=combined_prompt,
-                )
-                logger.debug(f"Response received: {response.text[:100]}...")
+                response = await self.client.aio.models.generate_content(model=MODEL, contents=contents)
+                self.bucket.on_success()
                 return response.text
             except Exception as e:
-                error_str = str(e)
-                # Check for rate limit errors (429 or ResourceExhausted)
-                is_rate_limit = "429" in error_str or "ResourceExhausted" in error_str
-                
-                if is_rate_limit and attempt < max_retries - 1:
-                    wait_time = 2 ** attempt  # 1s, 2s, 4s
-                    logger.warning(f"Rate limit hit ({attempt+1}/{max_retries}). Waiting {wait_time}s...")
-                    time.sleep(wait_time)
-                    continue
-                raise e
-                
+                self._retry_or_raise(e, attempt)
+            finally:
+                self.limiter.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.limiter.limit,
+            "in_flight": self.limiter.in_flight,
+            "queued": self.limiter.queued,
+            "max_queue": self.limiter.max_queue,
+            "requests": self.requests,
+            "token_bucket": self.bucket.stats(),
+        }
+
+
+gemini = GeminiClientManager(
+    max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", "8")),
+    max_queue=int(os.environ.get("LLM_MAX_QUEUE", "64")),
+    bucket=AdaptiveTokenBucket(
+        rate=float(os.environ.get("LLM_RATE", "5")),
+        burst=float(os.environ.get("LLM_BURST", "10")),
+    ),
+    max_wait=float(os.environ.get("LLM_MAX_WAIT", "5")),
+)
+
+
+def generate_response(system_prompt: str, user_prompt: str):
+    """
+    Generate response using Gemini 2.5 Flash. Sheds with LLMOverloaded
+    instead of waiting (see GeminiClientManager.generate)
+    """
+    try:
+        return gemini.generate(system_prompt, user_prompt)
+    except LLMOverloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Error generating response: {str(e)}")
+        logger.error(traceback.format_exc())
+        return ERROR_MESSAGE
+
+
+def generate_response_stream(system_prompt: str, user_prompt: str, outcome: dict | None = None):
+    """
+    Stream a Gemini 2.5 Flash response, yielding text pieces as they arrive.
+    Errors and shed requests end the stream with a fallback message; pass
+    `outcome` to find out which happened: outcome["completed"] is set to
+    True only when the model's answer was streamed in full.
+    """
+    if outcome is not None:
+        outcome["completed"] = False
+    try:
+        yield from gemini.generate_stream(system_prompt, user_prompt)
+        if outcome is not None:
+            outcome["completed"] = True
+    except LLMOverloaded as e:
+        logger.warning(f"Streaming request shed: {e}")
+        yield "The assistant is busy right now. Please try again in a few seconds."
+    except Exception as e:
+        logger.error(f"Error streaming response: {str(e)}")
+        logger.error(traceback.format_exc())
+        yield ERROR_MESSAGE
+
+
+async def agenerate_response(system_prompt: str, user_prompt: str):
+    """
+    Async variant of generate_response for event-loop callers.
+    """
+    try:
+        return await gemini.agenerate(system_prompt, user_prompt)
+    except LLMOverloaded:
+        raise
     except Exception as e:
         logger.error(f"Error generating response: {str(e)}")
         logger.error(traceback.format_exc())
-        return "I encountered an error while processing your request. Please try again later."
+        return ERROR_MESSAGE
@@ -0,0 +1,412 @@
+"""
+Ingestion Pipeline
+Download -> Extract -> Chunk -> Embed -> Store, reporting progress on a Job
+"""
+import os
+import time
+import logging
+import threading
+import numpy as np
+from typing import Iterable, Iterator
+from utils.jobs import Job, INGEST_STAGES
+from utils.pdf_loader import fetch_pdf, load_paper_from_bytes, iter_pages, split_abstract
+from utils.paper_cache import paper_cache
+from utils.chunker import prepare_chunks, iter_chunks, CHUNKING_MODE
+from utils.pipeline import run_pipeline, batched
+from utils.embeddings import embedder
+from utils.vector_store import SupabaseVectorStore, DocumentInProgress, is_leased
+from utils.answer_cache import answer_cache
+from utils.local_index import workspace_indexes
+from utils.dedup import content_store, content_key_for_url, content_key_for_bytes, arxiv_id_from_url
+
+logger = logging.getLogger(__name__)
+
+# "stream": extract, chunk, embed and store run at once, joined by bounded
+# queues (utils.pipeline); "batch": each stage covers the whole paper first
+INGEST_MODE = os.environ.get("INGEST_MODE", "stream")
+INGEST_EMBED_BATCH = int(os.environ.get("INGEST_EMBED_BATCH", "64"))
+# What a streamed ingest keeps for the content store / paper cache: page
+# text up to this many chars, chunks and vectors up to this many chunks.
+# Longer papers are not cached, so peak memory stays bounded by these.
+INGEST_STREAM_KEEP_CHARS = int(os.environ.get("INGEST_STREAM_KEEP_CHARS", str(2_000_000)))
+INGEST_STREAM_KEEP_CHUNKS = int(os.environ.get("INGEST_STREAM_KEEP_CHUNKS", "2000"))
+# Partial documents whose lease expired this long ago are deleted, checked
+# at most every INGEST_SWEEP_INTERVAL seconds when an ingest starts
+INGEST_PARTIAL_TTL = float(os.environ.get("INGEST_PARTIAL_TTL", "86400"))
+INGEST_SWEEP_INTERVAL = float(os.environ.get("INGEST_SWEEP_INTERVAL", "3600"))
+
+vector_store = SupabaseVectorStore()
+
+
+class _CappedCopy:
+    """
+    Items kept for the caches during a streamed ingest, up to `limit`
+    (summed item sizes). The first item over the limit drops the copy.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.items = []
+        self.size = 0
+        self.dropped = False
+
+    def add(self, item, size: int = 1):
+        if self.dropped:
+            return
+        self.size += size
+        if self.size > self.limit:
+            self.items, self.dropped = [], True
+            return
+        self.items.append(item)
+
+
+def _copy_existing(job: Job, content_key: str | None, doc_fields: dict) -> str | None:
+    """
+    If the same paper is already stored, copy its chunks instead of reprocessing.
+    """
+    if content_key is None:
+        return None
+    existing = vector_store.find_document(content_key)
+    if not existing:
+        return None
+
+    expected = (existing.get("metadata") or {}).get("chunk_count", 0)
+    job.start_stage("store", total=expected)
+    doc_id = vector_store.copy_document(existing["id"], expected, **doc_fields)
+    if doc_id:
+        for stage in ["download", "extract", "chunk", "embed"]:
+            job.skip_stage(stage)
+        job.finish_stage("store")
+    return doc_id
+
+
+_sweep_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+def _maybe_sweep():
+    """
+    Delete abandoned partial documents, at most once per INGEST_SWEEP_INTERVAL.
+    """
+    global _last_sweep
+    with _sweep_lock:
+        if time.time() - _last_sweep < INGEST_SWEEP_INTERVAL:
+            return
+        _last_sweep = time.time()
+    try:
+        vector_store.sweep_partial_documents(INGEST_PARTIAL_TTL)
+    except Exception as e:
+        logger.warning(f"Sweeping partial documents failed: {e}")
+
+
+def ingest_paper(
+    job: Job,
+    user_id: str,
+    workspace_id: str,
+    filename: str,
+    file_url: str,
+    pdf_url: str | None = None,
+    content: bytes | None = None,
+    **paper_meta
+) -> dict:
+    """
+    Ingest one PDF, either downloaded from `pdf_url` or given as `content`.
+    Extra keyword args (title, authors, abstract, ...) go to add_document.
+
+    Papers are keyed by arXiv ID (arxiv.org URLs only) or content hash; a
+    PDF from any other URL is downloaded first and keyed by its hash. A
+    paper already in the workspace is not added twice, one stored
+    elsewhere is copied, one whose earlier add failed transiently is
+    resumed, one another ingest is still adding is left to it, and one
+    still in the content store skips the stages whose output is cached.
+    """
+    _maybe_sweep()
+    try:
+        return _ingest_paper(job, user_id, workspace_id, filename, file_url, pdf_url, content, **paper_meta)
+    except DocumentInProgress as e:
+        for stage in INGEST_STAGES:
+            job.skip_stage(stage)
+        content_store.record("in_progress")
+        logger.info(f"{filename} is already being added to workspace {workspace_id} as {e.file_id}")
+        return {"document_id": e.file_id, "deduplicated": True, "in_progress": True}
+
+
+def _ingest_paper(job: Job, user_id: str, workspace_id: str, filename: str, file_url: str,
+                  pdf_url: str | None, content: bytes | None, **paper_meta) -> dict:
+    content_key = content_key_for_url(pdf_url) if content is None else None
+    if content_key is None:
+        if content is None:
+            # Not an arXiv URL: whatever it serves is keyed by its bytes, never by a claimed ID
+            job.start_stage("download")
+            content = fetch_pdf(pdf_url)
+            job.finish_stage("download")
+        content_key = content_key_for_bytes(content)
+    doc_fields = dict(
+        user_id=user_id,
+        workspace_id=workspace_id,
+        filename=filename,
+        file_url=file_url,
+        content_key=content_key,
+        **paper_meta
+    )
+
+    # 0. Already complete in this workspace: adding it again is a no-op
+    present = vector_store.find_document(content_key, user_id, workspace_id) if content_key else None
+    if present:
+        for stage in INGEST_STAGES:
+            job.skip_stage(stage)
+        content_store.record("present")
+        logger.info(f"{filename} is already stored in workspace {workspace_id} as {present['id']}")
+        return {"document_id": present["id"], "deduplicated": True}
+    # Another ingest is adding it right now: don't download and embed it twice
+    partial = vector_store.find_partial(user_id, workspace_id, content_key) if content_key else None
+    if partial and is_leased(partial):
+        raise DocumentInProgress(partial["id"])
+
+    # Dedup against stored documents
+    doc_id = _copy_existing(job, content_key, doc_fields)
+    if doc_id:
+        answer_cache.invalidate(workspace_id)
+        workspace_indexes.add_file(user_id, workspace_id, doc_id)
+        content_store.record("db_copy")
+        logger.info(f"Ingested {filename} as {doc_id} (copied from existing document)")
+        return {"document_id": doc_id, "deduplicated": True}
+
+    cached = content_store.get(content_key) or {}
+    if "embeddings" not in cached and INGEST_MODE == "stream":
+        doc_id, chunk_count = _ingest_streaming(job, content_key, cached, pdf_url, content, doc_fields)
+        answer_cache.invalidate(workspace_id)
+        workspace_indexes.add_file(user_id, workspace_id, doc_id)
+        logger.info(f"Ingested {filename} as {doc_id} (streamed)")
+        return {"document_id": doc_id, "chunk_count": chunk_count, "deduplicated": False}
+
+    embeddings = None
+    if "embeddings" in cached:
+        content_store.record("embedded")
+        chunks, embeddings = cached["chunks"], cached["embeddings"]
+        for stage in ["download", "extract", "chunk", "embed"]:
+            job.skip_stage(stage)
+    else:
+        if "full_text" in cached:
+            content_store.record("text")
+            full_text, abstract = cached["full_text"], cached["abstract"]
+            job.skip_stage("download")
+            job.skip_stage("extract")
+        else:
+            content_store.record("miss")
+            full_text, abstract = _download_and_extract(job, pdf_url, content)
+            content_store.put(content_key, full_text=full_text, abstract=abstract)
+
+        # 3. Chunk
+        job.start_stage("chunk")
+        chunks = prepare_chunks(full_text, abstract)
+        job.finish_stage("chunk")
+        logger.debug(f"Created {len(chunks)} chunks")
+
+    # 4. Embed (called by add_document once it knows which chunks a resumed
+    # partial document still lacks) and 5. Store
+    def embed(pending: list) -> np.ndarray:
+        job.start_stage("embed", total=len(pending))
+        vectors = np.asarray(embedder.encode([c["text"] for c in pending]), dtype=np.float32)
+        job.finish_stage("embed")
+        if len(pending) == len(chunks):
+            content_store.put(content_key, chunks=chunks, embeddings=vectors)
+        else:
+            content_store.record("resumed")
+        return vectors
+
+    job.start_stage("store", total=len(chunks))
+    doc_id = vector_store.add_document(
+        chunks=chunks,
+        embeddings=embeddings,
+        embed=embed if embeddings is None else None,
+        on_progress=lambda done: job.progress("store", done),
+        chunking=CHUNKING_MODE,
+        **doc_fields
+    )
+    job.finish_stage("store")
+    answer_cache.invalidate(workspace_id)
+    workspace_indexes.add_file(user_id, workspace_id, doc_id)
+    logger.info(f"Ingested {filename} as {doc_id}")
+
+    return {"document_id": doc_id, "chunk_count": len(chunks), "deduplicated": False}
+
+
+def _download_and_extract(job: Job, pdf_url: str | None, content: bytes | None) -> tuple[str, str | None]:
+    arxiv_id = arxiv_id_from_url(pdf_url) if content is None else None
+    cached = paper_cache.get_text(arxiv_id)
+    if cached is not None:
+        job.skip_stage("download")
+        job.skip_stage("extract")
+        return cached
+
+    # 1. Download
+    if content is None:
+        job.start_stage("download")
+        content = fetch_pdf(pdf_url)
+        job.finish_stage("download")
+    else:
+        job.skip_stage("download")
+
+    # 2. Extract
+    job.start_stage("extract")
+    full_text, abstract = load_paper_from_bytes(content)
+    logger.debug(f"Extracted {len(full_text)} chars, abstract: {len(abstract) if abstract else 0} chars")
+    if not full_text:
+        raise ValueError("Failed to extract text from PDF")
+    paper_cache.put_text(arxiv_id, full_text, abstract)
+    job.finish_stage("extract")
+
+    return full_text, abstract
+
+
+def _ingest_streaming(job: Job, content_key: str | None, cached: dict, pdf_url: str | None, content: bytes | None, doc_fields: dict) -> tuple[str, int]:
+    """
+    Pages are chunked as they are extracted, chunks are embedded
+    INGEST_EMBED_BATCH at a time and each batch is inserted as soon as it
+    is embedded, so extraction, embedding and inserts overlap and only a
+    few pages / batches are in flight.
+
+    The document stays partial, leased to this ingest, until finalized.
+    After a transient failure it is kept and its lease released, and the
+    next ingest of the same paper in the workspace resumes it: chunks
+    already stored are neither embedded nor sent again. Any other failure
+    deletes it.
+
+    The text, chunks and vectors are copied for the caches only up to
+    INGEST_STREAM_KEEP_CHARS / INGEST_STREAM_KEEP_CHUNKS, so memory does
+    not grow with paper length past those caps.
+
+    Returns (document_id, chunk_count)
+    """
+    source = {"text": _CappedCopy(INGEST_STREAM_KEEP_CHARS), "pages": 0, "has_text": False,
+              "complete": False, "extracted": False, "arxiv_id": None}
+    if "full_text" in cached:
+        content_store.record("text")
+        pages, abstract = [cached["full_text"]], cached["abstract"]
+        job.skip_stage("download")
+        job.skip_stage("extract")
+    else:
+        content_store.record("miss")
+        pages, abstract = _open_pages(job, pdf_url, content, source)
+
+    fields = {k: v for k, v in doc_fields.items() if k != "content_key"}
+    lease, stored = vector_store.begin_document(content_key, CHUNKING_MODE, **fields)
+    file_id = lease.file_id
+    if stored:
+        content_store.record("resumed")
+    # Reused by later adds of this paper, unless resuming (vectors of stored chunks are not at hand)
+    kept_chunks = _CappedCopy(0 if stored else INGEST_STREAM_KEEP_CHUNKS)
+    kept_vectors = []
+    chunk_count = 0
+    writer = vector_store.chunk_writer(file_id, on_progress=lambda done: job.progress("store", len(stored) + done))
+
+    def chunk(pages: Iterator[str]) -> Iterator[tuple]:
+        nonlocal chunk_count
+        job.start_stage("chunk")
+        for position, piece in enumerate(iter_chunks(pages, abstract)):
+            kept_chunks.add(piece)
+            chunk_count = position + 1
+            job.progress("chunk", chunk_count)
+            yield position, piece
+        job.finish_stage("chunk")
+
+    def embed(chunks: Iterator[tuple]) -> Iterator[tuple]:
+        job.start_stage("embed")
+        done = 0
+        # Chunks an earlier attempt already stored are skipped, not re-embedded
+        for batch in batched(((p, c) for p, c in chunks if p not in stored), INGEST_EMBED_BATCH):
+            vectors = np.asarray(embedder.encode([c["text"] for _, c in batch]), dtype=np.float32)
+            done += len(batch)
+            job.progress("embed", done)
+            yield batch, vectors
+        job.finish_stage("embed")
+
+    def store(batches: Iterator[tuple]) -> Iterator[int]:
+        job.start_stage("store")
+        for batch, vectors in batches:
+            lease.check()
+            # Sent in the background; add() only blocks while the writer is saturated
+            writer.add(vector_store.chunk_rows(file_id, [c for _, c in batch], vectors, indexes=[p for p, _ in batch]))
+            if kept_chunks.dropped:
+                kept_vectors.clear()
+            else:
+                kept_vectors.append(vectors)
+            yield len(batch)
+        writer.flush()
+        job.finish_stage("store")
+
+    try:
+        run_pipeline(("extract", pages), [("chunk", chunk), ("embed", embed), ("store", store)])
+        if source["extracted"] and not source["has_text"]:
+            raise ValueError("Failed to extract text from PDF")
+        if stored and max(stored) >= chunk_count:
+            raise ValueError(f"Partial document {file_id} does not match this paper's chunks")
+        vector_store.finalize_document(lease, chunk_count, content_key)
+    except Exception as e:
+        writer.close()
+        vector_store.abort_document(lease, e)
+        raise
+    logger.debug(f"Streamed {chunk_count - len(stored)} chunks into {file_id} ({len(stored)} already stored)")
+
+    # Cache for later adds of the same paper; the text only if every page was
+    # read (chunking stops pulling pages at the references header)
+    if source["complete"] and not source["text"].dropped:
+        full_text = "\n\n".join(text for text in source["text"].items if text)
+        if source["extracted"]:
+            paper_cache.put_text(source["arxiv_id"], full_text, abstract)
+        content_store.put(content_key, full_text=full_text, abstract=abstract)
+    if kept_vectors and not kept_chunks.dropped:
+        content_store.put(content_key, chunks=kept_chunks.items, embeddings=np.concatenate(kept_vectors))
+    if source["text"].dropped or (kept_chunks.dropped and not stored):
+        logger.info(f"{file_id} is over the stream keep caps, not cached")
+    return file_id, chunk_count
+
+
+def _open_pages(job: Job, pdf_url: str | None, content: bytes | None, source: dict) -> tuple[Iterable[str], str | None]:
+    """
+    Page texts and abstract of a paper not in the content store: from the
+    paper cache, or extracted lazily as the pipeline pulls pages, copying
+    them into source["text"].
+    """
+    arxiv_id = arxiv_id_from_url(pdf_url) if content is None else None
+    cached = paper_cache.get_text(arxiv_id)
+    if cached is not None:
+        job.skip_stage("download")
+        job.skip_stage("extract")
+        source["text"].add(cached[0], len(cached[0]))
+        source.update(pages=1, has_text=bool(cached[0]), complete=True)
+        return [cached[0]], cached[1]
+
+    # 1. Download
+    if content is None:
+        job.start_stage("download")
+        content = fetch_pdf(pdf_url)
+        job.finish_stage("download")
+    else:
+        job.skip_stage("download")
+
+    # 2. Extract
+    job.start_stage("extract")
+    source.update(extracted=True, arxiv_id=arxiv_id)
+    abstract, pages = split_abstract(_tracked_pages(job, iter_pages(content), source))
+    return pages, abstract
+
+
+def _tracked_pages(job: Job, pages: Iterator[str], source: dict) -> Iterator[str]:
+    try:
+        for page in pages:
+            source["text"].add(page, len(page))
+            source["pages"] += 1
+            source["has_text"] = source["has_text"] or bool(page)
+            job.progress("extract", source["pages"])
+            yield page
+    except GeneratorExit:
+        # Chunking stopped at the references header, later pages are not needed
+        job.finish_stage("extract")
+        raise
+    finally:
+        pages.close()
+    source["complete"] = True
+    job.finish_stage("extract")
+    logger.debug(f"Extracted {source['pages']} pages")
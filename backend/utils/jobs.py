@@ -0,0 +1,147 @@
+"""
+Background Job Utility
+Bounded worker pool + in-memory job store with per-stage progress
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+INGEST_STAGES = ["download", "extract", "chunk", "embed", "store"]
+
+
+class Job:
+    """
+    A unit of background work. Stage state is one of
+    pending / running / done / skipped; overall status is
+    queued / running / completed / failed.
+    """
+
+    def __init__(self, kind: str, user_id: str, stages: List[str]):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.user_id = user_id
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.stages = {
+            name: {"state": "pending", "done": 0, "total": None, "seconds": None}
+            for name in stages
+        }
+        self._stage_started = {}
+        self._lock = threading.Lock()
+
+    def start_stage(self, name: str, total: int | None = None):
+        with self._lock:
+            self.stages[name].update(state="running", total=total)
+            self._stage_started[name] = time.perf_counter()
+
+    def progress(self, name: str, done: int, total: int | None = None):
+        with self._lock:
+            self.stages[name]["done"] = done
+            if total is not None:
+                self.stages[name]["total"] = total
+
+    def finish_stage(self, name: str):
+        with self._lock:
+            stage = self.stages[name]
+            stage["state"] = "done"
+            if stage["total"] is not None:
+                stage["done"] = stage["total"]
+            started = self._stage_started.pop(name, None)
+            if started is not None:
+                stage["seconds"] = round(time.perf_counter() - started, 3)
+
+    def skip_stage(self, name: str):
+        # A stage that already ran stays done
+        with self._lock:
+            if self.stages[name]["state"] != "done":
+                self.stages[name]["state"] = "skipped"
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "stages": {k: dict(v) for k, v in self.stages.items()},
+                "result": self.result,
+                "error": self.error,
+            }
+
+
+class JobManager:
+    """
+    Runs jobs on a bounded thread pool so request handlers can return
+    immediately. Finished jobs are kept for `retention` seconds for polling.
+    """
+
+    def __init__(self, max_workers: int = 4, retention: float = 3600.0):
+        self.max_workers = max_workers
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, user_id: str, fn: Callable, *args, stages: List[str] = INGEST_STAGES, **kwargs) -> Job:
+        """
+        Queue fn(job, *args, **kwargs). The return value becomes job.result.
+        """
+        job = Job(kind, user_id, stages)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job: Job, fn: Callable, args, kwargs):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = "completed"
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {e}")
+            logger.debug(traceback.format_exc())
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {"max_workers": self.max_workers, "jobs": counts}
+
+
+job_manager = JobManager(
+    max_workers=int(os.environ.get("INGEST_WORKERS", "4")),
+    retention=float(os.environ.get("JOB_RETENTION_SECONDS", "3600")),
+)
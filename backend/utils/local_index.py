@@ -0,0 +1,240 @@
+"""
+Local Retrieval Engine
+Per-workspace local vector indexes (in RAM or memory-mapped) as an alternative to match_rag_chunks
+"""
+import os
+import re
+import glob
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any
+from utils.rag import InMemoryRAG
+from utils.embedding_store import MmapWorkspaceIndex
+from utils.vector_store import SupabaseVectorStore
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_ENGINE = os.environ.get("RETRIEVAL_ENGINE", "rpc")  # "rpc" | "local"
+SAFE_NAME_RE = re.compile(r"[^\w-]")
+
+
+class WorkspaceIndexCache:
+    """
+    LRU of (user_id, workspace_id) -> index, loaded lazily from rag_chunks
+    and evicted once the summed index size exceeds `max_bytes`. Concurrent
+    first queries for a workspace share a single load; papers added or
+    deleted later are applied incrementally (add_file/remove_file).
+
+    With `root` set, indexes are MmapWorkspaceIndex stores under
+    root/<user_id>/<workspace_id> that survive restarts and are shared by
+    all workers; otherwise they are InMemoryRAG.
+    """
+
+    def __init__(self, store: SupabaseVectorStore, max_bytes: int, root: str = "", dtype: str = "float32",
+                 quantization: str = "none", rerank_factor: int = 4):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.root = root
+        self.dtype = dtype
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self._indexes = OrderedDict()  # key -> index
+        self._charged = {}  # key -> nbytes counted in _bytes
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._generations = {}  # workspace_id -> int, bumped on every change
+        self.hits = 0
+        self.loads = 0
+        self.disk_opens = 0
+
+    def _new_index(self, user_id: str, workspace_id: str):
+        if not self.root:
+            return InMemoryRAG()
+        return MmapWorkspaceIndex(self._path(user_id, workspace_id), dtype=self.dtype,
+                                  quantization=self.quantization, rerank_factor=self.rerank_factor)
+
+    def _path(self, user_id: str, workspace_id: str) -> str:
+        return os.path.join(self.root, SAFE_NAME_RE.sub("_", str(user_id)), SAFE_NAME_RE.sub("_", str(workspace_id)))
+
+    def get(self, user_id: str, workspace_id: str):
+        key = (user_id, workspace_id)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                self._charge(key, index)
+                self._evict()
+                self.hits += 1
+                return index
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                index = self._indexes.get(key)
+                if index is not None:
+                    self._indexes.move_to_end(key)
+                    self.hits += 1
+                    return index
+                generation = self._generations.get(workspace_id, 0)
+
+            index = self._new_index(user_id, workspace_id)
+            from_disk = self.root and index.exists
+            if not from_disk:
+                index.index_chunks(self.store.fetch_workspace_chunks(user_id, workspace_id))
+            logger.info(f"{'Opened' if from_disk else 'Loaded'} {index.size} chunks for workspace {workspace_id}")
+
+            with self._lock:
+                if from_disk:
+                    self.disk_opens += 1
+                else:
+                    self.loads += 1
+                self._load_locks.pop(key, None)
+                fresh = generation == self._generations.get(workspace_id, 0)
+                if fresh:
+                    self._indexes[key] = index
+                    self._charge(key, index)
+                    self._evict()
+            if not fresh and not from_disk and self.root:
+                index.delete()  # built from a snapshot that missed a concurrent change
+            return index
+
+    def _charge(self, key, index):
+        # Caller holds the lock. An mmap index's size changes whenever it
+        # reopens a newer generation, so the amount counted is remembered.
+        self._bytes += index.nbytes - self._charged.get(key, 0)
+        self._charged[key] = index.nbytes
+
+    def _evict(self):
+        # Caller holds the lock; always keep the most recent index
+        while self._bytes > self.max_bytes and len(self._indexes) > 1:
+            key, _ = self._indexes.popitem(last=False)
+            self._bytes -= self._charged.pop(key, 0)
+
+    def _targets(self, user_id: str, workspace_id: str) -> list:
+        # Caller holds the lock. The cached index, or else the on-disk one if any.
+        index = self._indexes.get((user_id, workspace_id))
+        if index is None and self.root:
+            disk = self._new_index(user_id, workspace_id)
+            if disk.exists:
+                index = disk
+        return [index] if index is not None else []
+
+    def _apply(self, user_id: str, workspace_id: str, fn):
+        key = (user_id, workspace_id)
+        with self._lock:
+            self._generations[workspace_id] = self._generations.get(workspace_id, 0) + 1
+            targets = self._targets(user_id, workspace_id)
+        for index in targets:
+            fn(index)  # outside the cache lock: may rewrite files on disk
+            with self._lock:
+                if self._indexes.get(key) is index:
+                    self._charge(key, index)
+                    self._evict()
+
+    def add_file(self, user_id: str, workspace_id: str, file_id: str):
+        """
+        Append a newly stored document to the workspace's index
+        (O(document), no reload). A load already in flight is discarded.
+        """
+        with self._lock:
+            self._generations[workspace_id] = self._generations.get(workspace_id, 0) + 1
+            if not self._targets(user_id, workspace_id):
+                return
+        try:
+            chunks = self.store.fetch_file_chunks(file_id)
+        except Exception as e:
+            logger.warning(f"Could not fetch chunks of {file_id}, reloading workspace index: {e}")
+            self.invalidate(workspace_id)
+            return
+
+        def add(index):
+            index.remove_file(file_id)
+            index.add_chunks(chunks)
+
+        self._apply(user_id, workspace_id, add)
+        logger.debug(f"Added {len(chunks)} chunks of {file_id} to workspace {workspace_id}")
+
+    def remove_file(self, user_id: str, workspace_id: str, file_id: str):
+        """
+        Drop a deleted document from the workspace's index.
+        """
+        self._apply(user_id, workspace_id, lambda index: index.remove_file(file_id))
+
+    def invalidate(self, workspace_id: str):
+        """
+        Drop a workspace's indexes (and on-disk stores), forcing a reload on next use.
+        """
+        with self._lock:
+            self._generations[workspace_id] = self._generations.get(workspace_id, 0) + 1
+            for key in [k for k in self._indexes if k[1] == workspace_id]:
+                self._indexes.pop(key)
+                self._bytes -= self._charged.pop(key, 0)
+        if self.root:
+            for path in glob.glob(os.path.join(self.root, "*", SAFE_NAME_RE.sub("_", str(workspace_id)))):
+                MmapWorkspaceIndex(path).delete()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "engine": RETRIEVAL_ENGINE,
+                "storage": "mmap" if self.root else "memory",
+                "quantization": self.quantization if self.root else "none",
+                "workspaces": len(self._indexes),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "loads": self.loads,
+                "disk_opens": self.disk_opens,
+            }
+
+
+class LocalIndexVectorStore(SupabaseVectorStore):
+    """
+    SupabaseVectorStore whose similarity_search is answered from a warm
+    in-process index instead of the match_rag_chunks RPC. Writes still
+    go to Supabase.
+    """
+
+    def __init__(self, indexes: "WorkspaceIndexCache" = None):
+        super().__init__()
+        self.indexes = indexes or workspace_indexes
+
+    def similarity_search(self, user_id: str, query_embedding: List[float], top_k: int = 5, match_threshold: float = 0.5, workspace_id: str = None) -> List[Dict[str, Any]]:
+        try:
+            index = self.indexes.get(user_id, workspace_id)
+            results = index.search(query_embedding, top_k=top_k, min_similarity=match_threshold)
+            logger.debug(f"Local index returned {len(results)} chunks")
+            return [
+                {
+                    "id": r["id"],
+                    "file_id": r.get("file_id"),
+                    "chunk_text": r.get("chunk_text"),
+                    "similarity": r["similarity"],
+                    "metadata": r.get("metadata") or {},
+                }
+                for r in results
+            ]
+        except Exception as e:
+            logger.error(f"Local search error: {str(e)}")
+            return []
+
+
+workspace_indexes = WorkspaceIndexCache(
+    SupabaseVectorStore(),
+    max_bytes=int(float(os.environ.get("LOCAL_INDEX_MAX_MB", "512")) * 1024 * 1024),
+    root=os.environ.get("LOCAL_INDEX_DIR", ""),  # e.g. .cache/indexes; empty keeps indexes in RAM
+    dtype=os.environ.get("LOCAL_INDEX_DTYPE", "float32"),  # or float16 to halve disk and page cache
+    quantization=os.environ.get("LOCAL_INDEX_QUANTIZATION", "none"),  # or int8 (see dev/bench_quantization.py)
+    rerank_factor=int(os.environ.get("LOCAL_INDEX_RERANK_FACTOR", "4")),
+)
+
+
+def make_vector_store() -> SupabaseVectorStore:
+    """
+    Vector store for the configured RETRIEVAL_ENGINE.
+    """
+    if RETRIEVAL_ENGINE == "local":
+        return LocalIndexVectorStore()
+    return SupabaseVectorStore()
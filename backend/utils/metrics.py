@@ -0,0 +1,48 @@
+"""
+Metrics Utility
+Small thread-safe histogram for in-process performance counters
+"""
+import threading
+from typing import List
+
+
+class Histogram:
+    """
+    Non-cumulative bucket histogram. `buckets` are upper bounds;
+    observations above the last bound land in the "+Inf" bucket.
+    """
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+            else:
+                self._counts[-1] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            labels = [str(b) for b in self.buckets] + ["+Inf"]
+            return {
+                "count": self._count,
+                "sum": self._sum,
+                "mean": self._sum / self._count if self._count else 0.0,
+                "buckets": dict(zip(labels, self._counts)),
+            }
+
+
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+# Streaming chat latency, observed per /rag/chat/stream request
+chat_ttfb_ms = Histogram(LATENCY_BUCKETS_MS)
+chat_ttft_ms = Histogram(LATENCY_BUCKETS_MS)
@@ -0,0 +1,170 @@
+"""
+Paper Cache Utility
+Size-bounded on-disk cache of arXiv PDFs and their extracted text
+"""
+import os
+import re
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from utils.dedup import is_arxiv_id
+
+logger = logging.getLogger(__name__)
+
+PDF_FILE = "paper.pdf"
+TEXT_FILE = "text.json"
+VERSIONED_ID_RE = re.compile(r"v\d+$")
+
+
+class PaperCache:
+    """
+    Files live under root/<arxiv id>/{paper.pdf,text.json}. Writes are atomic
+    (temp file + os.replace) and files are evicted least-recently-used
+    until the total size fits in `max_bytes`. Versionless IDs always
+    resolve to the latest arXiv version, so they expire `unversioned_ttl`
+    after they were written. Read recency is tracked in memory only, so
+    reads never touch file mtimes, which stay the write time.
+
+    Only well-formed arXiv IDs (from arxiv.org URLs, see
+    utils.dedup.arxiv_id_from_url) are cached; anything else is a miss.
+    """
+
+    def __init__(self, root: str, max_bytes: int, unversioned_ttl: float = 86400.0):
+        self.root = os.path.realpath(root)
+        self.max_bytes = max_bytes
+        self.unversioned_ttl = unversioned_ttl
+        self._files = OrderedDict()  # path -> size, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = {"pdf": 0, "text": 0}
+        self.misses = {"pdf": 0, "text": 0}
+        if self.enabled:
+            self._scan()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _scan(self):
+        os.makedirs(self.root, exist_ok=True)
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if name.endswith(".tmp"):
+                    os.unlink(path)  # left over from an interrupted write
+                    continue
+                st = os.stat(path)
+                found.append((st.st_mtime, path, st.st_size))
+        for _, path, size in sorted(found):
+            self._files[path] = size
+            self._bytes += size
+        self._evict()
+
+    def _path(self, arxiv_id: str | None, name: str) -> str | None:
+        if not self.enabled or not is_arxiv_id(arxiv_id):
+            return None
+        path = os.path.realpath(os.path.join(self.root, arxiv_id.replace("/", "_"), name))
+        if os.path.dirname(os.path.dirname(path)) != self.root:
+            logger.warning(f"Paper cache path for {arxiv_id!r} escapes {self.root}")
+            return None
+        return path
+
+    def _read(self, arxiv_id: str | None, name: str, kind: str) -> bytes | None:
+        path = self._path(arxiv_id, name)
+        if path is None:
+            return None
+        with self._lock:
+            known = path in self._files
+        if known:
+            try:
+                if not VERSIONED_ID_RE.search(arxiv_id) and time.time() - os.path.getmtime(path) > self.unversioned_ttl:
+                    os.unlink(path)  # stale: a newer version may exist
+                    raise FileNotFoundError(path)
+                with open(path, "rb") as f:
+                    data = f.read()
+                with self._lock:
+                    if path in self._files:
+                        self._files.move_to_end(path)
+                    self.hits[kind] += 1
+                return data
+            except FileNotFoundError:
+                self._forget(path)
+        with self._lock:
+            self.misses[kind] += 1
+        return None
+
+    def _write(self, arxiv_id: str | None, name: str, data: bytes):
+        path = self._path(arxiv_id, name)
+        if path is None or len(data) > self.max_bytes:
+            return
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Paper cache write failed for {arxiv_id}: {e}")
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return
+        with self._lock:
+            self._bytes -= self._files.pop(path, 0)
+            self._files[path] = len(data)
+            self._bytes += len(data)
+            self._evict()
+
+    def _forget(self, path: str):
+        with self._lock:
+            self._bytes -= self._files.pop(path, 0)
+
+    def _evict(self):
+        # Caller holds the lock (or is __init__)
+        while self._bytes > self.max_bytes and self._files:
+            path, size = self._files.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.unlink(path)
+                os.rmdir(os.path.dirname(path))  # only succeeds once the directory is empty
+            except OSError:
+                pass
+
+    def get_pdf(self, arxiv_id: str | None) -> bytes | None:
+        return self._read(arxiv_id, PDF_FILE, "pdf")
+
+    def put_pdf(self, arxiv_id: str | None, content: bytes):
+        self._write(arxiv_id, PDF_FILE, content)
+
+    def get_text(self, arxiv_id: str | None) -> tuple[str, str | None] | None:
+        data = self._read(arxiv_id, TEXT_FILE, "text")
+        if data is None:
+            return None
+        doc = json.loads(data)
+        return doc["full_text"], doc["abstract"]
+
+    def put_text(self, arxiv_id: str | None, full_text: str, abstract: str | None):
+        data = json.dumps({"full_text": full_text, "abstract": abstract}).encode("utf-8")
+        self._write(arxiv_id, TEXT_FILE, data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = sum(self.hits.values()) + sum(self.misses.values())
+            return {
+                "enabled": self.enabled,
+                "files": len(self._files),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+                "hit_ratio": sum(self.hits.values()) / lookups if lookups else 0.0,
+            }
+
+
+paper_cache = PaperCache(
+    root=os.environ.get("PAPER_CACHE_DIR", os.path.join(".cache", "papers")),
+    max_bytes=int(float(os.environ.get("PAPER_CACHE_MAX_MB", "2048")) * 1024 * 1024),
+    unversioned_ttl=float(os.environ.get("PAPER_CACHE_UNVERSIONED_TTL", "86400")),
+)
@@ -2,33 +2,89 @@
 PDF Loader Utility
 Downloads and extracts clean text from arXiv PDFs
 """
+import os
 import re
+import time
+import signal
+import logging
 import requests
-import tempfile
+import threading
 from pathlib import Path
+from typing import Iterable, Iterator
 from pypdf import PdfReader
 from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, CancelledError, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from utils.dedup import content_store, content_key_for_url, arxiv_id_from_url
+from utils.paper_cache import paper_cache
+from utils.chunker import abstract_span, ABSTRACT_SCAN_CHARS, ABSTRACT_MAX_CHARS
+from utils.metrics import Histogram
 
+logger = logging.getLogger(__name__)
 
-def download_pdf(arxiv_url: str) -> Path:
+# Parallel extraction settings: 0/1 workers disables the process pool
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "12"))
+PDF_PAGE_TIMEOUT = float(os.environ.get("PDF_PAGE_TIMEOUT", "20"))
+PDF_MAX_BYTES = int(os.environ.get("PDF_MAX_BYTES", str(50 * 1024 * 1024)))
+
+
+def _make_session() -> requests.Session:
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Shared keep-alive session for arxiv.org downloads
+_session = _make_session()
+
+
+def download_pdf(arxiv_url: str, max_bytes: int | None = None) -> bytes:
     """
-    Download PDF from arXiv URL
+    Download PDF from arXiv URL into memory
+    
+    Streams the body over a pooled keep-alive session and aborts as soon as
+    the declared or received size exceeds `max_bytes` (PDF_MAX_BYTES).
     
     Args:
         arxiv_url: URL like https://arxiv.org/pdf/2103.14030.pdf
+        max_bytes: Size limit, defaults to PDF_MAX_BYTES
     
     Returns:
-        Path to downloaded PDF
+        PDF bytes, ready for extract_pages / load_paper_from_bytes
     """
-    response = requests.get(arxiv_url, timeout=30)
-    response.raise_for_status()
-    
-    # Save to temp file
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-    temp_file.write(response.content)
-    temp_file.close()
-    
-    return Path(temp_file.name)
+    max_bytes = PDF_MAX_BYTES if max_bytes is None else max_bytes
+
+    with _session.get(arxiv_url, timeout=30, stream=True) as response:
+        response.raise_for_status()
+
+        declared = int(response.headers.get("Content-Length") or 0)
+        if declared > max_bytes:
+            raise ValueError(f"PDF is {declared} bytes, limit is {max_bytes}")
+
+        parts = []
+        received = 0
+        for part in response.iter_content(chunk_size=256 * 1024):
+            received += len(part)
+            if received > max_bytes:
+                raise ValueError(f"PDF exceeds size limit of {max_bytes} bytes")
+            parts.append(part)
+
+    return b"".join(parts)
+
+
+def fetch_pdf(arxiv_url: str) -> bytes:
+    """
+    download_pdf, served from the on-disk paper cache when possible.
+    """
+    arxiv_id = arxiv_id_from_url(arxiv_url)
+    content = paper_cache.get_pdf(arxiv_id)
+    if content is None:
+        content = download_pdf(arxiv_url)
+        paper_cache.put_pdf(arxiv_id, content)
+    return content
 
 
 def extract_text_from_pdf(pdf_path: Path) -> str:
@@ -41,15 +97,272 @@ def extract_text_from_pdf(pdf_path: Path) -> str:
     Returns:
         Extracted text
     """
-    reader = PdfReader(pdf_path)
-    
-    text_parts = []
-    for page in reader.pages:
-        text = page.extract_text()
-        if text:
-            text_parts.append(text)
-    
-    return "\n\n".join(text_parts)
+    pages, _ = extract_pages(Path(pdf_path).read_bytes())
+    return "\n\n".join(text for text in pages if text)
+
+
+class PageTimeout(Exception):
+    pass
+
+
+def _raise_page_timeout(signum, frame):
+    raise PageTimeout()
+
+
+def _extract_page_range(content: bytes, start: int, end: int, page_timeout: float) -> list[tuple]:
+    """
+    Process-pool task: extract pages [start, end) of one PDF.
+    Each page gets its own timeout (SIGALRM, where the platform has it)
+    so a pathological page yields "" instead of stalling the range.
+
+    Returns [(page_number, text, seconds, timed_out), ...]
+    """
+    reader = PdfReader(BytesIO(content))
+    use_alarm = page_timeout > 0 and hasattr(signal, "setitimer")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_page_timeout)
+
+    results = []
+    for page_number in range(start, end):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, page_timeout)
+            text = reader.pages[page_number].extract_text() or ""
+        except PageTimeout:
+            text = ""
+            timed_out = True
+        finally:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        results.append((page_number, text, time.perf_counter() - started, timed_out))
+    return results
+
+
+class _ExtractionStats:
+    def __init__(self):
+        self.page_ms = Histogram([5, 10, 25, 50, 100, 250, 500, 1000, 5000])
+        self.counts = {"documents": 0, "parallel_documents": 0, "pages": 0, "page_timeouts": 0,
+                       "retried_ranges": 0, "failed_ranges": 0, "pool_restarts": 0}
+        self.last_document = None
+        self._lock = threading.Lock()
+
+    def record(self, timings: list[dict], parallel: bool):
+        for t in timings:
+            self.page_ms.observe(t["seconds"] * 1000.0)
+        slowest = sorted(timings, key=lambda t: t["seconds"], reverse=True)[:5]
+        with self._lock:
+            self.counts["documents"] += 1
+            self.counts["parallel_documents"] += int(parallel)
+            self.counts["pages"] += len(timings)
+            self.counts["page_timeouts"] += sum(t["timed_out"] for t in timings)
+            self.last_document = {
+                "pages": len(timings),
+                "parallel": parallel,
+                "seconds": round(sum(t["seconds"] for t in timings), 3),
+                "slowest_pages": slowest,
+            }
+
+    def count(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                **self.counts,
+                "workers": PDF_EXTRACT_WORKERS,
+                "page_ms": self.page_ms.snapshot(),
+                "last_document": self.last_document,
+            }
+
+
+extraction_stats = _ExtractionStats()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers)
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor, terminate: bool = False):
+    """
+    Stop sharing a broken pool, or (terminate=True) one with a worker stuck
+    on a page; a fresh one is made on next use. Terminating kills its
+    worker processes, so other jobs' ranges still on it fail with
+    BrokenProcessPool and are retried on the fresh pool by those jobs.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not pool:
+            return  # already replaced by another job
+        _pool = None
+    extraction_stats.count("pool_restarts")
+    if terminate:
+        # shutdown() never stops a running task; the worker handles are private but the only way
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            try:
+                process.terminate()
+            except Exception as e:
+                logger.warning(f"Could not terminate PDF worker {process.pid}: {e}")
+    pool.shutdown(wait=False)
+
+
+def extract_pages(content: bytes, workers: int | None = None, page_timeout: float | None = None) -> tuple[list[str], list[dict]]:
+    """
+    Extract text of every page, in order.
+
+    Documents with at least PDF_PARALLEL_MIN_PAGES pages are split into
+    contiguous page ranges across a process pool; shorter ones (or
+    workers <= 1) are extracted in-process.
+
+    Returns:
+        (page_texts, timings) where timings has one
+        {"page", "seconds", "timed_out"} dict per page
+    """
+    parallel, results = _page_results(content, workers, page_timeout)
+    results = list(results)
+    timings = _record_timings(results, parallel)
+    return [text for _, text, _, _ in results], timings
+
+
+def iter_pages(content: bytes, workers: int | None = None, page_timeout: float | None = None) -> Iterator[str]:
+    """
+    extract_pages as a generator: yields each page's text, in order, as
+    soon as its page range is extracted. Closing it early cancels the
+    ranges not yet started. Timings are recorded for the pages yielded.
+    """
+    parallel, results = _page_results(content, workers, page_timeout)
+    done = []
+    try:
+        for result in results:
+            done.append(result)
+            yield result[1]
+    finally:
+        results.close()
+        _record_timings(done, parallel)
+
+
+def _page_results(content: bytes, workers: int | None, page_timeout: float | None) -> tuple[bool, Iterator[tuple]]:
+    workers = PDF_EXTRACT_WORKERS if workers is None else workers
+    page_timeout = PDF_PAGE_TIMEOUT if page_timeout is None else page_timeout
+
+    page_count = len(PdfReader(BytesIO(content)).pages)
+    parallel = workers > 1 and page_count >= PDF_PARALLEL_MIN_PAGES
+
+    if not parallel:
+        return False, _serial_extract(content, page_count)
+    return True, _parallel_extract(content, page_count, workers, page_timeout)
+
+
+def _record_timings(results: list[tuple], parallel: bool) -> list[dict]:
+    timings = [
+        {"page": page_number, "seconds": round(seconds, 4), "timed_out": timed_out}
+        for page_number, _, seconds, timed_out in results
+    ]
+    extraction_stats.record(timings, parallel)
+    if any(t["timed_out"] for t in timings):
+        logger.warning(f"PDF extraction timed out on pages {[t['page'] for t in timings if t['timed_out']]}")
+    return timings
+
+
+def _serial_extract(content: bytes, page_count: int) -> Iterator[tuple]:
+    return _serial_range(PdfReader(BytesIO(content)), 0, page_count)
+
+
+def _serial_range(reader: PdfReader, start: int, end: int) -> Iterator[tuple]:
+    # Runs in request/job threads where SIGALRM is unavailable, so no per-page timeout
+    for page_number in range(start, end):
+        started = time.perf_counter()
+        text = reader.pages[page_number].extract_text() or ""
+        yield page_number, text, time.perf_counter() - started, False
+
+
+def _submit_ranges(content: bytes, ranges: list[tuple], workers: int, page_timeout: float) -> tuple:
+    """
+    Submit every range to the shared pool, replacing it once if it turns
+    out to be broken. Returns (pool, [(start, end, future)]), or
+    (None, []) if no working pool could be had.
+    """
+    for _ in range(2):
+        pool = _get_pool(workers)
+        try:
+            return pool, [
+                (start, end, pool.submit(_extract_page_range, content, start, end, page_timeout))
+                for start, end in ranges
+            ]
+        except (BrokenProcessPool, RuntimeError) as e:
+            # Broken by a crash in another job, or shut down by one since we got it
+            logger.warning(f"PDF extraction pool unusable, replacing it: {e}")
+            _discard_pool(pool)
+    return None, []
+
+
+def _retry_range(content: bytes, start: int, end: int, workers: int, page_timeout: float, deadline: float) -> list[tuple]:
+    """
+    Re-run a range whose worker was lost on a fresh pool, within the same
+    deadline. If that fails too its pages count as failed: a page that
+    crashed or hung a worker is never extracted in the server process.
+    """
+    extraction_stats.count("retried_ranges")
+    pool, futures = _submit_ranges(content, [(start, end)], workers, page_timeout)
+    if pool is not None:
+        future = futures[0][2]
+        try:
+            return future.result(timeout=max(0.0, deadline - time.perf_counter()))
+        except FutureTimeoutError:
+            future.cancel()
+            _discard_pool(pool, terminate=True)
+        except (BrokenProcessPool, CancelledError):
+            _discard_pool(pool)
+    extraction_stats.count("failed_ranges")
+    logger.warning(f"PDF pages {start}-{end - 1} failed again on a fresh pool, skipping them")
+    return [(n, "", 0.0, True) for n in range(start, end)]
+
+
+def _parallel_extract(content: bytes, page_count: int, workers: int, page_timeout: float) -> Iterator[tuple]:
+    # Two ranges per worker evens out pages of very different cost
+    range_count = min(page_count, workers * 2)
+    bounds = [round(i * page_count / range_count) for i in range(range_count + 1)]
+    ranges = [(bounds[i], bounds[i + 1]) for i in range(range_count)]
+
+    pool, futures = _submit_ranges(content, ranges, workers, page_timeout)
+    if pool is None:
+        yield from _serial_extract(content, page_count)
+        return
+
+    # Backstop for platforms without SIGALRM: bound each range by its page budget.
+    # Ranges are yielded in page order, each as soon as it and those before it are done
+    stuck = broken = False
+    deadline = time.perf_counter() + page_timeout * (page_count / workers + 1) + 5.0
+    try:
+        for start, end, future in futures:
+            try:
+                results = future.result(timeout=max(0.0, deadline - time.perf_counter()))
+            except FutureTimeoutError:
+                stuck = True
+                results = [(n, "", 0.0, True) for n in range(start, end)]
+            except (BrokenProcessPool, CancelledError) as e:
+                # A worker crashed, or another job's stuck range took the pool down
+                if isinstance(e, BrokenProcessPool):
+                    broken = True
+                    _discard_pool(pool)
+                logger.warning(f"PDF pages {start}-{end - 1} lost their worker ({type(e).__name__}), retrying on a fresh pool")
+                results = _retry_range(content, start, end, workers, page_timeout, deadline)
+            yield from results
+    finally:
+        for _, _, future in futures:
+            future.cancel()
+        if stuck:
+            _discard_pool(pool, terminate=True)
+        elif broken:
+            _discard_pool(pool)
 
 
 def extract_abstract(full_text: str) -> str | None:
@@ -62,28 +375,50 @@ def extract_abstract(full_text: str) -> str | None:
     Returns:
         Abstract text or None if not found
     """
-    # Common abstract patterns
-    patterns = [
-        r"Abstract\s*[:\-]?\s*\n(.+?)(?:\n\n|\nIntroduction|\n1\s+Introduction)",
-        r"ABSTRACT\s*[:\-]?\s*\n(.+?)(?:\n\n|\nINTRODUCTION|\n1\s+INTRODUCTION)",
-        r"\\begin{abstract}(.+?)\\end{abstract}",
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, full_text, re.DOTALL | re.IGNORECASE)
-        if match:
-            abstract = match.group(1).strip()
-            # Clean up LaTeX artifacts
-            abstract = re.sub(r'\\[a-zA-Z]+{([^}]*)}', r'\1', abstract)
-            abstract = re.sub(r'\\[a-zA-Z]+\s*', '', abstract)
-            return abstract
+    # Bounded header/terminator search, linear in its windows (see chunker.abstract_span)
+    span = abstract_span(full_text)
+    if span:
+        abstract = full_text[span[0]:span[1]].strip()
+        # Clean up LaTeX artifacts
+        abstract = re.sub(r'\\[a-zA-Z]+{([^}]*)}', r'\1', abstract)
+        abstract = re.sub(r'\\[a-zA-Z]+\s*', '', abstract)
+        return abstract
     
     return None
 
 
+def split_abstract(pages: Iterable[str]) -> tuple[str | None, Iterator[str]]:
+    """
+    Read just enough leading pages to find the abstract (abstract_span only
+    looks at the first ABSTRACT_SCAN_CHARS plus its body windows), and
+    return it with an iterator over all pages, the buffered ones first.
+    """
+    pages = iter(pages)
+    head, size = [], 0
+    for page in pages:
+        head.append(page)
+        size += len(page) + 2
+        if size >= ABSTRACT_SCAN_CHARS + 3 * ABSTRACT_MAX_CHARS:
+            break
+
+    def replay() -> Iterator[str]:
+        # A generator (unlike itertools.chain) so closing it closes `pages`
+        try:
+            yield from head
+            yield from pages
+        finally:
+            close = getattr(pages, "close", None)
+            if close is not None:
+                close()
+
+    return extract_abstract("\n\n".join(text for text in head if text)), replay()
+
+
 def load_paper(arxiv_url: str) -> tuple[str, str | None]:
     """
-    Download PDF and extract text + abstract
+    Download PDF and extract text + abstract.
+    Served from the content store if the same arXiv paper was extracted recently,
+    then from the on-disk paper cache.
     
     Args:
         arxiv_url: arXiv PDF URL
@@ -91,30 +426,29 @@ def load_paper(arxiv_url: str) -> tuple[str, str | None]:
     Returns:
         Tuple of (full_text, abstract)
     """
-    pdf_path = download_pdf(arxiv_url)
-    
-    try:
-        full_text = extract_text_from_pdf(pdf_path)
-        abstract = extract_abstract(full_text)
-        return full_text, abstract
-    finally:
-        # Clean up temp file
-        pdf_path.unlink(missing_ok=True)
+    content_key = content_key_for_url(arxiv_url)
+    cached = content_store.get(content_key)
+    if cached and "full_text" in cached:
+        content_store.record("text")
+        return cached["full_text"], cached["abstract"]
+
+    arxiv_id = arxiv_id_from_url(arxiv_url)
+    cached = paper_cache.get_text(arxiv_id)
+    if cached is not None:
+        full_text, abstract = cached
+    else:
+        full_text, abstract = load_paper_from_bytes(fetch_pdf(arxiv_url))
+        paper_cache.put_text(arxiv_id, full_text, abstract)
+    content_store.put(content_key, full_text=full_text, abstract=abstract)
+    return full_text, abstract
 
 
 def load_paper_from_bytes(content: bytes) -> tuple[str, str | None]:
     """
     Load paper from bytes (e.g. uploaded file)
     """
-    reader = PdfReader(BytesIO(content))
-    
-    text_parts = []
-    for page in reader.pages:
-        text = page.extract_text()
-        if text:
-            text_parts.append(text)
-    
-    full_text = "\n\n".join(text_parts)
+    pages, _ = extract_pages(content)
+    full_text = "\n\n".join(text for text in pages if text)
     abstract = extract_abstract(full_text)
     
     return full_text, abstract
@@ -0,0 +1,213 @@
+"""
+Streaming Pipeline Utility
+Generator stages running in threads, joined by bounded queues, with per-stage throughput counters
+"""
+import os
+import time
+import queue
+import logging
+import threading
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Items (pages, chunks, batches) allowed in flight between two stages
+STREAM_QUEUE_SIZE = int(os.environ.get("STREAM_QUEUE_SIZE", "4"))
+
+_END = object()
+_POLL_SECONDS = 0.1
+
+
+class PipelineAborted(Exception):
+    """
+    Raised inside a stage when another stage failed.
+    """
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """
+    Group items into lists of `size` (the last one may be shorter).
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _Channel:
+    """
+    Bounded queue between two stages. The consumer closes it when it stops
+    reading, so a producer blocked on a full queue gives up instead of hanging.
+    """
+
+    def __init__(self, maxsize: int, abort: threading.Event):
+        self._queue = queue.Queue(maxsize)
+        self._closed = threading.Event()
+        self._abort = abort
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+
+    def put(self, item) -> bool:
+        started = time.perf_counter()
+        try:
+            while not self._closed.is_set():
+                if self._abort.is_set():
+                    raise PipelineAborted()
+                try:
+                    self._queue.put(item, timeout=_POLL_SECONDS)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            self.put_wait += time.perf_counter() - started
+
+    def close(self):
+        self._closed.set()
+
+    def __iter__(self) -> Iterator:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = self._queue.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                if self._abort.is_set():
+                    raise PipelineAborted()
+                continue
+            finally:
+                self.get_wait += time.perf_counter() - started
+            if item is _END:
+                return
+            yield item
+
+
+class _PipelineStats:
+    """
+    Cumulative per-stage counters. A stage's busy time excludes time spent
+    waiting on its input queue (upstream is slower) and on its output
+    queue (downstream is slower), so items_per_second is its own throughput.
+    """
+
+    def __init__(self):
+        self.counts = {"runs": 0, "failures": 0}
+        self.stages = {}
+        self.last_run = None
+        self._lock = threading.Lock()
+
+    def record(self, stages: List[dict], failed: bool):
+        with self._lock:
+            self.counts["runs"] += 1
+            self.counts["failures"] += int(failed)
+            for stage in stages:
+                total = self.stages.setdefault(stage["name"], {"items": 0, "busy_seconds": 0.0, "input_wait_seconds": 0.0, "output_wait_seconds": 0.0})
+                for key in total:
+                    total[key] += stage[key]
+            self.last_run = {"failed": failed, "stages": [_with_rate(s) for s in stages]}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                **self.counts,
+                "queue_size": STREAM_QUEUE_SIZE,
+                "stages": {name: _with_rate(s) for name, s in self.stages.items()},
+                "last_run": self.last_run,
+            }
+
+
+def _with_rate(stage: dict) -> dict:
+    rounded = {k: round(v, 4) if isinstance(v, float) else v for k, v in stage.items()}
+    rounded["items_per_second"] = round(stage["items"] / stage["busy_seconds"], 2) if stage["busy_seconds"] else None
+    return rounded
+
+
+pipeline_stats = _PipelineStats()
+
+
+def _drive(name: str, items: Iterator, inbox: _Channel | None, outbox: _Channel | None, abort: threading.Event, errors: list) -> dict:
+    """
+    Pull every item out of one stage's generator and pass it downstream.
+    """
+    stage = {"name": name, "items": 0, "busy_seconds": 0.0, "input_wait_seconds": 0.0, "output_wait_seconds": 0.0}
+    started = time.perf_counter()
+    try:
+        for item in items:
+            stage["items"] += 1
+            if outbox is not None and not outbox.put(item):
+                break
+        if outbox is not None:
+            outbox.put(_END)
+    except PipelineAborted:
+        pass
+    except BaseException as e:
+        errors.append(e)
+        abort.set()
+    finally:
+        # Stop the producer feeding this stage, then release this stage's own source
+        if inbox is not None:
+            inbox.close()
+        close = getattr(items, "close", None)
+        if close is not None:
+            try:
+                close()
+            except BaseException as e:
+                logger.warning(f"Pipeline stage {name} did not close cleanly: {e}")
+        if inbox is not None:
+            stage["input_wait_seconds"] = inbox.get_wait
+        if outbox is not None:
+            stage["output_wait_seconds"] = outbox.put_wait
+        elapsed = time.perf_counter() - started
+        stage["busy_seconds"] = max(0.0, elapsed - stage["input_wait_seconds"] - stage["output_wait_seconds"])
+    return stage
+
+
+def run_pipeline(
+    source: Tuple[str, Iterable],
+    stages: List[Tuple[str, Callable[[Iterator], Iterator]]],
+    maxsize: int | None = None
+) -> List[dict]:
+    """
+    Run a linear streaming pipeline.
+
+    `source` is (name, iterable); iterating it is the first stage's work.
+    Each of `stages` is (name, fn) where fn takes the previous stage's
+    items as an iterator and yields its own. Every stage but the last runs
+    in its own thread, joined by queues of `maxsize` items, so all stages
+    make progress at once while only a few items are in flight. The last
+    stage runs in the calling thread and its items are discarded.
+
+    The first exception raised by any stage aborts the others and is
+    re-raised here. Returns the per-stage counters of this run.
+    """
+    maxsize = STREAM_QUEUE_SIZE if maxsize is None else maxsize
+    abort = threading.Event()
+    errors = []
+    channels = [_Channel(maxsize, abort) for _ in stages]
+
+    names = [source[0]] + [name for name, _ in stages]
+    results = [None] * len(names)
+
+    def run(position: int, items: Iterator, inbox: _Channel | None, outbox: _Channel | None):
+        results[position] = _drive(names[position], items, inbox, outbox, abort, errors)
+
+    threads = [threading.Thread(target=run, args=(0, iter(source[1]), None, channels[0]), name=f"pipeline-{names[0]}", daemon=True)]
+    for i, (name, fn) in enumerate(stages[:-1], start=1):
+        threads.append(threading.Thread(target=run, args=(i, fn(iter(channels[i - 1])), channels[i - 1], channels[i]), name=f"pipeline-{name}", daemon=True))
+    for thread in threads:
+        thread.start()
+
+    try:
+        run(len(stages), stages[-1][1](iter(channels[-1])), channels[-1], None)
+    finally:
+        if errors:
+            abort.set()
+        for thread in threads:
+            thread.join()
+
+    pipeline_stats.record(results, bool(errors))
+    if errors:
+        raise errors[0]
+    return results
@@ -0,0 +1,26 @@
+"""
+Quantization Utility
+int8 scalar quantization of unit-normalized embeddings
+"""
+import numpy as np
+
+INT8_MAX = 127
+
+
+def quantize_int8(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetric per-row int8 codes: vector ~= codes * scale. Needs no training,
+    so rows can be appended at any time. Returns (codes (N, D) int8, scales (N,) float32).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / INT8_MAX
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -INT8_MAX, INT8_MAX).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def int8_scores(queries: np.ndarray, codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """
+    Approximate (Q, N) dot products of float32 queries with int8-coded rows.
+    """
+    return (queries @ codes.astype(np.float32).T) * scales
@@ -3,108 +3,264 @@ RAG Utility
 In-memory embeddings + retrieval + Gemini 2.5 Flash
 """
 import os
+import json
 import logging
+import threading
 import numpy as np
 from typing import List
-from utils.embeddings import embedder
+from utils.embeddings import query_cache
 from utils.gemini_client import generate_response
 
 logger = logging.getLogger(__name__)
 
+# Compact once removed rows exceed this share of the buffer (and COMPACT_MIN_ROWS)
+COMPACT_RATIO = 0.25
+COMPACT_MIN_ROWS = 256
+
+
+def as_vector(embedding) -> np.ndarray:
+    # pgvector columns come back from PostgREST as "[0.1,0.2,...]" strings
+    if isinstance(embedding, str):
+        embedding = json.loads(embedding)
+    return np.asarray(embedding, dtype=np.float32)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+
+def top_k_rows(similarities: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Column indices and scores of the k largest values of each row of a
+    (Q, N) matrix, best first. O(N) argpartition, then only k are sorted.
+    """
+    k = min(k, similarities.shape[1])
+    if k <= 0:
+        # argpartition(...)[:, -0:] would select every column
+        empty = np.zeros((similarities.shape[0], 0), dtype=np.intp)
+        return empty, np.zeros((similarities.shape[0], 0), dtype=similarities.dtype)
+    if k < similarities.shape[1]:
+        top = np.argpartition(similarities, -k, axis=1)[:, -k:]
+    else:
+        top = np.broadcast_to(np.arange(k), (similarities.shape[0], k))
+    top_scores = np.take_along_axis(similarities, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
 class InMemoryRAG:
     """
     RAG with Gemini Embeddings (768 dim) + Gemini 2.5 Flash
+    Embeddings are kept as one contiguous float32 matrix of unit rows.
     """
     
     def __init__(self):
         self.chunk_map = {} # id -> chunk
-        self.embeddings = None
-        self.ids = []
+        self.ids = [] # row -> chunk id, including removed rows
+        self._buffer = None # (capacity, D) float32, rows [0, _count) in use
+        self._alive = np.zeros(0, dtype=bool)
+        self._count = 0
+        self._dead = 0
+        self._rows_by_file = {} # file_id -> rows
+        self._lock = threading.Lock()
+
+    @property
+    def embeddings(self):
+        """
+        Unit-normalized vectors of all used rows (removed rows included until compaction)
+        """
+        return self._buffer[:self._count] if self._buffer is not None else None
+
+    @property
+    def size(self) -> int:
+        """
+        Number of searchable chunks
+        """
+        return self._count - self._dead
     
     def index_chunks(self, chunks: List[dict]):
         """
-        Embed and store chunks in memory
+        Replace the index with these chunks
         Args:
             chunks: List of chunk dicts. Must have 'id', 'text', 'metadata', 'embedding' (optional)
         """
-        if not chunks:
+        with self._lock:
+            self.chunk_map = {}
+            self.ids = []
+            self._buffer = None
+            self._alive = np.zeros(0, dtype=bool)
+            self._count = 0
+            self._dead = 0
+            self._rows_by_file = {}
+        self.add_chunks(chunks)
+
+    def add_chunks(self, chunks: List[dict]):
+        """
+        Append chunks in O(len(chunks)) amortized. Chunks carrying a 'file_id'
+        can later be dropped together with remove_file().
+        """
+        # Only chunks with an embedding (from DB: list of floats or its JSON string) are searchable
+        valid_chunks = [c for c in chunks if c.get('embedding') is not None and len(c['embedding'])]
+        if not valid_chunks:
             return
+        vectors = np.empty((len(valid_chunks), len(as_vector(valid_chunks[0]['embedding']))), dtype=np.float32)
+        for row, c in enumerate(valid_chunks):
+            vectors[row] = as_vector(c['embedding'])
+        vectors = normalize_rows(vectors)
 
-        self.chunk_map = {c['id']: c for c in chunks}
-        self.ids = list(self.chunk_map.keys())
-        
-        # Check if embeddings are already provided (from DB) or need to be generated
-        # For now, assume we receive them populated or we'd need to generate them.
-        # But this in-memory RAG seems to be designed to take DB chunks which already have embeddings.
-        # If 'embedding' key is missing or None, we might skip or re-embed.
-        
-        # Filter chunks that have embeddings
-        valid_chunks = [c for c in chunks if c.get('embedding')]
-        
-        if valid_chunks:
-            # Parse embeddings if they are strings (from DB JSON/vector)
-            # Assuming DB returns list of floats or numpy array
-            arrays = []
+        with self._lock:
+            # Vectors live in the buffer; don't keep a second copy per chunk
             for c in valid_chunks:
-                emb = c['embedding']
-                if isinstance(emb, str):
-                    # handle string representation if necessary, though DB driver usually converts
-                    import json
-                    try:
-                         emb = json.loads(emb)
-                    except:
-                        pass # might be raw string format "[...]"
-                arrays.append(emb)
-            self.embeddings = np.array(arrays)
-            # Re-align ids to valid chunks
-            self.ids = [c['id'] for c in valid_chunks]
-        else:
-             self.embeddings = None
-             self.ids = []
+                self.chunk_map[c['id']] = {k: v for k, v in c.items() if k != 'embedding'}
+
+            self._reserve(self._count + len(vectors), vectors.shape[1])
+            start = self._count
+            self._buffer[start:start + len(vectors)] = vectors
+            self._alive[start:start + len(vectors)] = True
+            for offset, c in enumerate(valid_chunks):
+                self.ids.append(c['id'])
+                if c.get('file_id') is not None:
+                    self._rows_by_file.setdefault(c['file_id'], []).append(start + offset)
+            # Publish the rows only once they are written; searches read _count
+            self._count += len(vectors)
+
+    def _reserve(self, rows: int, dim: int):
+        # Caller holds the lock. Grows geometrically into a new buffer so
+        # searches still reading the old one are unaffected.
+        capacity = len(self._buffer) if self._buffer is not None else 0
+        if rows <= capacity:
+            return
+        capacity = max(rows, capacity * 2, 1024)
+        buffer = np.empty((capacity, dim), dtype=np.float32)
+        alive = np.zeros(capacity, dtype=bool)
+        if self._count:
+            buffer[:self._count] = self._buffer[:self._count]
+            alive[:self._count] = self._alive[:self._count]
+        self._buffer, self._alive = buffer, alive
+
+    def remove_file(self, file_id) -> int:
+        """
+        Tombstone every chunk of a file; returns how many were removed.
+        The buffer is compacted once tombstones exceed COMPACT_RATIO of it.
+        """
+        with self._lock:
+            rows = self._rows_by_file.pop(file_id, [])
+            for row in rows:
+                self._alive[row] = False
+                self.chunk_map.pop(self.ids[row], None)
+            self._dead += len(rows)
+            if self._dead > COMPACT_MIN_ROWS and self._dead > self._count * COMPACT_RATIO:
+                self._compact()
+            return len(rows)
+
+    def _compact(self):
+        # Caller holds the lock. Copies live rows into a fresh buffer (old one
+        # stays valid for in-flight searches).
+        keep = np.flatnonzero(self._alive[:self._count])
+        capacity = max(len(keep) * 2, 1024)
+        buffer = np.empty((capacity, self._buffer.shape[1]), dtype=np.float32)
+        buffer[:len(keep)] = self._buffer[keep]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(keep)] = True
+
+        ids = [self.ids[row] for row in keep]
+        new_row = np.full(self._count, -1)
+        new_row[keep] = np.arange(len(keep))
+        self._rows_by_file = {f: [int(new_row[r]) for r in rows] for f, rows in self._rows_by_file.items()}
+        print(f"DEBUG [InMemoryRAG]: Compacted {self._count} rows to {len(keep)}")
+        self._buffer, self._alive, self.ids = buffer, alive, ids
+        self._count, self._dead = len(keep), 0
+
+    def search(self, query_embedding, top_k: int = 5, min_similarity: float | None = None) -> List[dict]:
+        """
+        Top-k chunks by cosine similarity to an already computed query embedding.
+        Chunks at or below min_similarity are dropped (like match_threshold in match_rag_chunks).
+        """
+        return self.search_batch(np.asarray(query_embedding, dtype=np.float32)[None, :], top_k, min_similarity)[0]
+
+    def search_batch(self, query_embeddings, top_k: int = 5, min_similarity: float | None = None) -> List[List[dict]]:
+        """
+        search() for a (Q, D) matrix of queries, scored with one matrix multiply.
+        """
+        queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32))
+        with self._lock:
+            # Consistent snapshot; the arrays are only ever replaced, never shrunk in place
+            count, dead = self._count, self._dead
+            matrix = self._buffer[:count] if self._buffer is not None else None
+            alive = self._alive[:count].copy() if dead else None
+            ids = self.ids
+        if not count or count == dead:
+            return [[] for _ in range(len(queries))]
+
+        # Rows are unit vectors, so the dot product is the cosine similarity
+        similarities = queries @ matrix.T  # (Q, N)
+        if alive is not None:
+            similarities[:, ~alive] = -np.inf
+
+        top, top_scores = top_k_rows(similarities, top_k)
+
+        batch = []
+        for indices, scores in zip(top, top_scores):
+            results = []
+            for idx, score in zip(indices, scores):
+                if score == -np.inf or (min_similarity is not None and score <= min_similarity):
+                    break
+                chunk = self.chunk_map.get(ids[idx])
+                if chunk is None:
+                    continue  # removed after the snapshot
+                results.append({
+                    **chunk,
+                    "similarity": float(score)
+                })
+            batch.append(results)
+        return batch
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Approximate memory held by the index (vector buffer + chunk text).
+        """
+        vectors = self._buffer.nbytes if self._buffer is not None else 0
+        text = sum(len(c.get('chunk_text') or c.get('text') or '') for c in self.chunk_map.values())
+        return vectors + text
 
     def retrieve(self, query: str, top_k: int = 5) -> List[dict]:
         """
         Retrieve top-k most similar chunks
         """
-        if not self.ids or self.embeddings is None:
+        if not self.size:
             return []
         
-        if embedder is None:
+        if query_cache is None:
             logger.error("Embedder not initialized")
             return []
 
         try:
             # Embed query
-            # SentenceTransformer encode([text]) returns (1, D) array
-            query_embedding = embedder.encode([query], convert_to_numpy=True)[0]
-            
-            # Compute cosine similarity
-            # norm(a) * norm(b)
-            # embeddings are likely already normalized by the model but let's be safe
-            norm_query = np.linalg.norm(query_embedding)
-            norm_embeddings = np.linalg.norm(self.embeddings, axis=1)
-            
-            similarities = np.dot(self.embeddings, query_embedding) / (norm_embeddings * norm_query)
-            
-            # Get top-k
-            # argsort returns indices of *sorted* elements. [::-1] reverses to descending.
-            top_indices = np.argsort(similarities)[::-1][:top_k]
-            
-            results = []
-            for idx in top_indices:
-                chunk_id = self.ids[idx]
-                chunk = self.chunk_map[chunk_id]
-                results.append({
-                    **chunk,
-                    "similarity": float(similarities[idx])
-                })
-            
-            return results
+            # Cached, and batched with concurrent queries; returns a (D,) array
+            query_embedding = query_cache.encode(query)
+            return self.search(query_embedding, top_k=top_k)
             
         except Exception as e:
             logger.error(f"Retrieval error: {e}")
             return []
     
+    def retrieve_batch(self, queries: List[str], top_k: int = 5) -> List[List[dict]]:
+        """
+        retrieve() for several questions, scored together in one matrix multiply
+        """
+        if not queries or not self.size:
+            return [[] for _ in queries]
+
+        try:
+            query_embeddings = np.stack([query_cache.encode(q) for q in queries])
+            return self.search_batch(query_embeddings, top_k=top_k)
+        except Exception as e:
+            logger.error(f"Retrieval error: {e}")
+            return [[] for _ in queries]
+    
     def answer_question(self, question: str) -> dict:
         """
         Answer question using RAG
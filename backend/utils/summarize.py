@@ -1,14 +1,49 @@
-from utils.gemini_client import generate_response
+import asyncio
+from utils.gemini_client import generate_response, agenerate_response, LLMOverloaded, ERROR_MESSAGE
+from utils.summary_cache import summary_cache
 
-def summarize_paper(title: str, abstract: str):
-    system_prompt = "You are a research assistant. Summarize the research paper in 5 concise bullet points. Focus on: problem, method, key results, significance, limitations."
-    
-    user_prompt = f"""
+# Bump whenever SYSTEM_PROMPT or _user_prompt changes so cached summaries are not reused
+PROMPT_VERSION = "1"
+SYSTEM_PROMPT = "You are a research assistant. Summarize the research paper in 5 concise bullet points. Focus on: problem, method, key results, significance, limitations."
+FAILED_MESSAGE = "Failed to generate summary. Please check your API key and try again."
+
+def _user_prompt(title: str, abstract: str) -> str:
+    return f"""
 Title: {title}
 Abstract: {abstract}
 """
+
+def _store(key: str, summary: str):
+    if summary and summary != ERROR_MESSAGE:
+        summary_cache.put(key, summary)
+
+def summarize_paper(title: str, abstract: str):
+    key = summary_cache.key(PROMPT_VERSION, title, abstract)
+    cached = summary_cache.get(key)
+    if cached is not None:
+        return cached
+    try:
+        summary = generate_response(SYSTEM_PROMPT, _user_prompt(title, abstract))
+    except LLMOverloaded:
+        raise
+    except Exception as e:
+        print(f"Error generating summary: {e}")
+        return FAILED_MESSAGE
+    _store(key, summary)
+    return summary
+
+async def asummarize_paper(title: str, abstract: str):
+    key = summary_cache.key(PROMPT_VERSION, title, abstract)
+    # SQLite reads and commits block; keep them off the event loop
+    cached = await asyncio.to_thread(summary_cache.get, key)
+    if cached is not None:
+        return cached
     try:
-        return generate_response(system_prompt, user_prompt)
+        summary = await agenerate_response(SYSTEM_PROMPT, _user_prompt(title, abstract))
+    except LLMOverloaded:
+        raise
     except Exception as e:
         print(f"Error generating summary: {e}")
-        return "Failed to generate summary. Please check your API key and try again."
+        return FAILED_MESSAGE
+    await asyncio.to_thread(_store, key, summary)
+    return summary
@@ -0,0 +1,125 @@
+"""
+Summary Cache
+Persistent SQLite store of paper summaries keyed by content hash
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class SummaryCache:
+    """
+    Summaries keyed by sha256(prompt version, title, abstract), so a prompt
+    change never serves old output. Entries expire after `ttl` seconds and
+    the least recently read are evicted beyond `max_entries`. A hit only
+    writes its read time back when the stored one is older than
+    `touch_interval`, so most hits are a single indexed read.
+    """
+
+    def __init__(self, path: str, ttl: float = 30 * 86400.0, max_entries: int = 50000, touch_interval: float = 3600.0):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self._lock = threading.Lock()
+        self._conn = None
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(prompt_version: str, title: str, abstract: str) -> str:
+        return hashlib.sha256(f"{prompt_version}\0{title.strip()}\0{abstract.strip()}".encode("utf-8")).hexdigest()
+
+    def _db(self) -> sqlite3.Connection:
+        # Caller holds the lock
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("pragma journal_mode=wal")
+            self._conn.execute(
+                "create table if not exists summaries ("
+                " key text primary key,"
+                " summary text not null,"
+                " created_at real not null,"
+                " accessed_at real not null)"
+            )
+            self._conn.execute("create index if not exists summaries_accessed_idx on summaries (accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        try:
+            with self._lock:
+                db = self._db()
+                row = db.execute(
+                    "select summary, accessed_at from summaries where key = ? and created_at > ?",
+                    (key, now - self.ttl),
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                # Eviction order only needs coarse recency; skip the write (and fsync) otherwise
+                if now - row[1] > self.touch_interval:
+                    db.execute("update summaries set accessed_at = ? where key = ?", (now, key))
+                    db.commit()
+                self.hits += 1
+                return row[0]
+        except sqlite3.Error as e:
+            logger.warning(f"Summary cache read failed: {e}")
+            return None
+
+    def put(self, key: str, summary: str):
+        now = time.time()
+        try:
+            with self._lock:
+                db = self._db()
+                db.execute(
+                    "insert or replace into summaries (key, summary, created_at, accessed_at) values (?, ?, ?, ?)",
+                    (key, summary, now, now),
+                )
+                self._puts += 1
+                if self._puts % 100 == 0:
+                    self._evict(db, now)
+                db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Summary cache write failed: {e}")
+
+    def _evict(self, db: sqlite3.Connection, now: float):
+        db.execute("delete from summaries where created_at <= ?", (now - self.ttl,))
+        db.execute(
+            "delete from summaries where key in ("
+            " select key from summaries order by accessed_at desc limit -1 offset ?)",
+            (self.max_entries,),
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            try:
+                entries = self._db().execute("select count(*) from summaries").fetchone()[0]
+            except sqlite3.Error:
+                entries = None
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+summary_cache = SummaryCache(
+    path=os.environ.get("SUMMARY_CACHE_PATH", os.path.join(".cache", "summaries.sqlite3")),
+    ttl=float(os.environ.get("SUMMARY_CACHE_TTL", str(30 * 86400))),
+    max_entries=int(os.environ.get("SUMMARY_CACHE_MAX_ENTRIES", "50000")),
+    touch_interval=float(os.environ.get("SUMMARY_CACHE_TOUCH_INTERVAL", "3600")),
+)
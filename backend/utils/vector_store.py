@@ -1,74 +1,489 @@
+import os
+import time
+import uuid
 import logging
-from typing import List, Dict, Any
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Callable
 from utils.supabase_client import supabase
+from utils.bulk_insert import BulkInserter, vector_literal, vector_literals, is_transient
+import numpy as np
 import math
 
 logger = logging.getLogger(__name__)
 
+# metadata.ingest_state of a document whose chunks are still being stored
+PARTIAL = "partial"
+# A partial document belongs to the ingest holding its lease, renewed every
+# third of this; an expired lease means the ingest died and may be resumed
+INGEST_LEASE_SECONDS = float(os.environ.get("INGEST_LEASE_SECONDS", "120"))
+
+
+def is_partial(row: Dict[str, Any]) -> bool:
+    """
+    Whether a rag_files row is a document still (or no longer) being stored.
+    """
+    return (row.get("metadata") or {}).get("ingest_state") == PARTIAL
+
+
+def is_leased(row: Dict[str, Any]) -> bool:
+    """
+    Whether a partial document's ingest still holds a live lease on it.
+    """
+    return ((row.get("metadata") or {}).get("lease_expires") or 0) > time.time()
+
+
+def _is_unique_violation(error: Exception) -> bool:
+    return str(getattr(error, "code", "") or "") == "23505" or "duplicate key" in str(error)
+
+
+class DocumentInProgress(Exception):
+    """
+    Another live ingest holds the lease on this content's partial document.
+    """
+
+    def __init__(self, file_id: str | None):
+        super().__init__(f"Document {file_id} is being added by another ingest")
+        self.file_id = file_id
+
+
+class LeaseLost(Exception):
+    """
+    This ingest's lease on a partial document expired and another took it over.
+    """
+
+
+class DocumentLease:
+    """
+    Ownership of a partial document: its metadata carries lease_owner (a
+    random token) and lease_expires (epoch seconds), pushed forward by a
+    heartbeat thread. Renewing, finalizing and deleting only apply while
+    lease_owner still matches, so an ingest whose lease was taken over
+    cannot complete or remove the document under the new owner.
+    """
+
+    def __init__(self, store: "SupabaseVectorStore", file_id: str, metadata: Dict[str, Any]):
+        self.store = store
+        self.file_id = file_id
+        self.metadata = metadata
+        self.owner = metadata["lease_owner"]
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "DocumentLease":
+        self._thread = threading.Thread(target=self._heartbeat, name=f"lease-{self.file_id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def _heartbeat(self):
+        while not self._stop.wait(INGEST_LEASE_SECONDS / 3):
+            try:
+                if not self.store.update_owned(self.file_id, self.owner, dict(self.metadata, lease_expires=time.time() + INGEST_LEASE_SECONDS)):
+                    logger.error(f"Lease on partial document {self.file_id} was taken over")
+                    self.lost = True
+                    return
+            except Exception as e:
+                # The lease has two more beats before it expires
+                logger.warning(f"Lease renewal for {self.file_id} failed: {e}")
+
+    def check(self):
+        if self.lost:
+            raise LeaseLost(f"Lease on partial document {self.file_id} was taken over")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+
 class SupabaseVectorStore:
-    def __init__(self):
-        self.client = supabase
+    def __init__(self, client=None):
+        # Any PostgREST-style client; dev.local_vector_store has an in-process stand-in
+        self.client = client or supabase
 
-    def add_document(self, user_id: str, workspace_id: str, filename: str, file_url: str, chunks: List[Dict[str, Any]], embeddings: List[List[float]],
-                     title: str = None, authors: List[str] = None, abstract: str = None, date: str = None, source: str = None, link: str = None):
+    def add_document(self, user_id: str, workspace_id: str, filename: str, file_url: str, chunks: List[Dict[str, Any]], embeddings=None,
+                     title: str = None, authors: List[str] = None, abstract: str = None, date: str = None, source: str = None, link: str = None,
+                     on_progress: Callable[[int], None] = None, content_key: str = None, chunking: str = None,
+                     embed: Callable[[List[Dict[str, Any]]], Any] = None):
         """
         Store document metadata and chunks with embeddings in Supabase.
-        Uses a transaction-like approach (though Supabase HTTP API isn't strictly transactional).
+        The Supabase HTTP API isn't transactional, so the document stays
+        "partial" (hidden from search and dedup) until every chunk is stored.
+        embeddings is a float array or a list of vectors / pgvector strings (see chunk_rows).
+        Instead of embeddings, `embed` may be given: it is called with only
+        the chunks not yet stored, so resuming a document embeds just those.
+        on_progress, if given, is called with the number of chunks inserted so far.
+        content_key (arXiv ID or content hash) is recorded so later adds can be
+        deduplicated, and lets a failed add be resumed (see begin_document).
         """
+        lease, writer = None, None
         try:
             print(f"DEBUG [add_document]: Starting for user {user_id}, workspace {workspace_id}, {len(chunks)} chunks")
-            # 1. Insert Document Metadata
-            doc_data = {
-                "user_id": user_id,
-                "workspace_id": workspace_id,
-                "filename": filename,
-                "file_url": file_url,
-                "title": title or filename,
-                "authors": authors,
-                "abstract": abstract,
-                "date": date,
-                "source": source,
-                "link": link,
-                "metadata": {"chunk_count": len(chunks)}
-            }
-            
-            # Use 'rag_files' table
-            doc_res = self.client.table("rag_files").insert(doc_data).execute()
-            
-            if not doc_res.data:
-                raise Exception("Failed to insert document")
-                
-            file_id = doc_res.data[0]["id"]
-            print(f"DEBUG [add_document]: File created with ID: {file_id}")
-            logger.info(f"File created: {file_id}")
-
-            # 2. Prepare Chunks for Insertion
-            chunk_rows = []
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                chunk_rows.append({
-                    "file_id": file_id,
-                    "chunk_index": i,
-                    "chunk_text": chunk["text"],
-                    "embedding": embedding,
-                    "metadata": {"type": chunk.get("type", "body")}
-                })
-
-            # 3. Insert Chunks (Batching if necessary)
+            # 1. Insert Document Metadata, or resume an earlier failed add of the same content
+            lease, stored = self.begin_document(
+                content_key, chunking, user_id=user_id, workspace_id=workspace_id, filename=filename, file_url=file_url,
+                title=title, authors=authors, abstract=abstract, date=date, source=source, link=link
+            )
+            file_id = lease.file_id
+
+            # 2. Prepare Chunks for Insertion, skipping those already stored
+            if embeddings is None:
+                missing = [index for index in range(len(chunks)) if index not in stored]
+                pending = [chunks[index] for index in missing]
+                chunk_rows = self.chunk_rows(file_id, pending, embed(pending), indexes=missing)
+            else:
+                chunk_rows = [row for row in self.chunk_rows(file_id, chunks, embeddings) if row["chunk_index"] not in stored]
+
+            # 3. Insert Chunks: payload-sized batches, several in flight
             # Use 'rag_chunks' table
-            batch_size = 50
-            for i in range(0, len(chunk_rows), batch_size):
-                batch = chunk_rows[i:i + batch_size]
-                result = self.client.table("rag_chunks").insert(batch).execute()
-                print(f"DEBUG [add_document]: Inserted batch {i//batch_size + 1}, {len(batch)} chunks")
-                
+            writer = self.chunk_writer(file_id, on_progress=(lambda done: on_progress(len(stored) + done)) if on_progress else None)
+            writer.add(chunk_rows)
+            writer.flush()
+            self.finalize_document(lease, len(chunks), content_key)
             print(f"DEBUG [add_document]: SUCCESS! Inserted total {len(chunk_rows)} chunks for file {file_id}")
             logger.info(f"Inserted {len(chunk_rows)} chunks for file {file_id}")
             return file_id
 
         except Exception as e:
             logger.error(f"Vector store error: {str(e)}")
+            if writer is not None:
+                writer.close()
+            if lease is not None:
+                self.abort_document(lease, e)
             raise e
 
+    def begin_document(self, ingest_key: str | None, chunking: str | None, **doc_fields) -> tuple[DocumentLease, set]:
+        """
+        Start storing a document under a lease: take over the partial
+        document an earlier, dead attempt left for the same ingest_key
+        (content key) in the same workspace, or create a new partial one.
+        `chunking` names how chunks were numbered; an abandoned partial
+        document chunked differently cannot be resumed and is deleted.
+
+        Raises DocumentInProgress while another ingest's lease on it is live.
+        Returns (started lease, chunk_index values already stored)
+        """
+        if ingest_key:
+            partial = self.find_partial(doc_fields["user_id"], doc_fields["workspace_id"], ingest_key)
+            if partial:
+                metadata = partial.get("metadata") or {}
+                if is_leased(partial):
+                    raise DocumentInProgress(partial["id"])
+                if metadata.get("chunking") == chunking:
+                    lease = self.take_over(partial)
+                    stored = self.stored_chunk_indexes(lease.file_id)
+                    print(f"DEBUG [begin_document]: Resuming {lease.file_id} with {len(stored)} chunks already stored")
+                    return lease.start(), stored
+                if not self.delete_owned(partial["id"], metadata.get("lease_owner")):
+                    raise DocumentInProgress(partial["id"])
+        metadata = self._lease_metadata(ingest_key, chunking)
+        try:
+            file_id = self.create_document(metadata=metadata, **doc_fields)
+        except Exception as e:
+            if ingest_key and _is_unique_violation(e):
+                # Another ingest created its partial document first (rag_files_partial_ingest_key_idx)
+                partial = self.find_partial(doc_fields["user_id"], doc_fields["workspace_id"], ingest_key)
+                raise DocumentInProgress(partial["id"] if partial else None)
+            raise
+        return DocumentLease(self, file_id, metadata).start(), set()
+
+    @staticmethod
+    def _lease_metadata(ingest_key: str | None, chunking: str | None) -> Dict[str, Any]:
+        return {"ingest_state": PARTIAL, "ingest_key": ingest_key, "chunking": chunking,
+                "lease_owner": str(uuid.uuid4()), "lease_expires": time.time() + INGEST_LEASE_SECONDS}
+
+    def take_over(self, partial: Dict[str, Any]) -> DocumentLease:
+        """
+        Claim an expired lease. Only one of several racing ingests succeeds;
+        the others get DocumentInProgress.
+        """
+        old = partial.get("metadata") or {}
+        metadata = self._lease_metadata(old.get("ingest_key"), old.get("chunking"))
+        if not self.update_owned(partial["id"], old.get("lease_owner"), metadata):
+            raise DocumentInProgress(partial["id"])
+        return DocumentLease(self, partial["id"], metadata)
+
+    def _owned(self, query, file_id: str, owner: str | None):
+        query = query.eq("id", file_id).eq("metadata->>ingest_state", PARTIAL)
+        # Rows from before leases have no owner; the state check is all there is
+        return query.eq("metadata->>lease_owner", owner) if owner else query
+
+    def update_owned(self, file_id: str, owner: str | None, metadata: Dict[str, Any]) -> bool:
+        """
+        Replace a partial document's metadata if `owner` still holds its lease.
+        """
+        res = self._owned(self.client.table("rag_files").update({"metadata": metadata}), file_id, owner).execute()
+        return bool(res.data)
+
+    def delete_owned(self, file_id: str, owner: str | None) -> bool:
+        """
+        Delete a partial document if `owner` still holds its lease.
+        """
+        res = self._owned(self.client.table("rag_files").delete(), file_id, owner).execute()
+        return bool(res.data)
+
+    def create_document(self, user_id: str, workspace_id: str, filename: str, file_url: str,
+                        title: str = None, authors: List[str] = None, abstract: str = None, date: str = None, source: str = None, link: str = None,
+                        metadata: Dict[str, Any] = None) -> str:
+        """
+        Insert the rag_files row of a document whose chunks are written
+        afterwards. It stays "partial" (no chunk_count or content_key) until
+        finalize_document, so dedup never copies a partly stored document.
+        """
+        doc_res = self.client.table("rag_files").insert({
+            "user_id": user_id,
+            "workspace_id": workspace_id,
+            "filename": filename,
+            "file_url": file_url,
+            "title": title or filename,
+            "authors": authors,
+            "abstract": abstract,
+            "date": date,
+            "source": source,
+            "link": link,
+            "metadata": metadata or self._lease_metadata(None, None)
+        }).execute()
+        if not doc_res.data:
+            raise Exception("Failed to insert document")
+        file_id = doc_res.data[0]["id"]
+        print(f"DEBUG [create_document]: File created with ID: {file_id}")
+        logger.info(f"File created: {file_id}")
+        return file_id
+
+    def find_partial(self, user_id: str, workspace_id: str, ingest_key: str) -> Dict[str, Any] | None:
+        """
+        The newest partial document of this content in the workspace, if any
+        (completed documents no longer carry an ingest_key).
+        """
+        res = (
+            self.client.table("rag_files")
+            .select("id, metadata")
+            .eq("user_id", user_id)
+            .eq("workspace_id", workspace_id)
+            .eq("metadata->>ingest_key", ingest_key)
+            .order("created_at", desc=True)
+            .limit(1)
+            .execute()
+        )
+        return res.data[0] if res.data else None
+
+    def stored_chunk_indexes(self, file_id: str, page_size: int = 1000) -> set:
+        """
+        chunk_index values of one document already in rag_chunks. Each batch
+        is a single INSERT statement, so these are whole batches.
+        """
+        indexes = set()
+        while True:
+            res = (
+                self.client.table("rag_chunks")
+                .select("chunk_index")
+                .eq("file_id", file_id)
+                .order("chunk_index")
+                .range(len(indexes), len(indexes) + page_size - 1)
+                .execute()
+            )
+            indexes.update(row["chunk_index"] for row in res.data)
+            if len(res.data) < page_size:
+                return indexes
+
+    def chunk_rows(self, file_id: str, chunks: List[Dict[str, Any]], embeddings, start: int = 0, indexes: List[int] = None) -> List[Dict[str, Any]]:
+        """
+        rag_chunks rows for chunks numbered start, start + 1, ... (or `indexes`).
+        embeddings is a float array (one row per chunk) or a list of vectors
+        or pgvector strings; they are sent as compact pgvector literals.
+        """
+        if isinstance(embeddings, np.ndarray):
+            vectors = vector_literals(embeddings)
+        else:
+            vectors = [vector_literal(embedding) for embedding in embeddings]
+        if indexes is None:
+            indexes = range(start, start + len(chunks))
+        return [
+            {
+                "file_id": file_id,
+                "chunk_index": index,
+                "chunk_text": chunk["text"],
+                "embedding": vector,
+                "metadata": {"type": chunk.get("type", "body"), **({"section": chunk["section"]} if chunk.get("section") else {})}
+            }
+            for index, chunk, vector in zip(indexes, chunks, vectors)
+        ]
+
+    def chunk_writer(self, file_id: str, on_progress: Callable[[int], None] = None) -> BulkInserter:
+        """
+        Concurrent batch writer for rag_chunks rows of one document (see
+        utils.bulk_insert). A batch that failed transiently is resent
+        without the rows that did reach the table, and rows whose
+        (file_id, chunk_index) is already stored are skipped
+        (rag_chunks_file_chunk_idx is unique).
+        """
+        def missing(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            res = (
+                self.client.table("rag_chunks")
+                .select("chunk_index")
+                .eq("file_id", file_id)
+                .in_("chunk_index", [row["chunk_index"] for row in rows])
+                .execute()
+            )
+            present = {row["chunk_index"] for row in res.data}
+            return [row for row in rows if row["chunk_index"] not in present]
+
+        return BulkInserter(self.client, "rag_chunks", on_progress=on_progress, missing=missing, on_conflict="file_id,chunk_index")
+
+    def finalize_document(self, lease: DocumentLease, chunk_count: int, content_key: str = None):
+        """
+        Mark a document complete: searchable, and a dedup source. Raises
+        LeaseLost if another ingest took the document over.
+        """
+        lease.stop()
+        metadata = {"chunk_count": chunk_count}
+        if content_key:
+            metadata["content_key"] = content_key
+        if lease.lost or not self.update_owned(lease.file_id, lease.owner, metadata):
+            raise LeaseLost(f"Lease on partial document {lease.file_id} was taken over before it was finalized")
+        print(f"DEBUG [finalize_document]: {chunk_count} chunks stored for file {lease.file_id}")
+
+    def delete_document(self, file_id: str):
+        """
+        Remove a document; its rag_chunks rows cascade.
+        """
+        self.client.table("rag_files").delete().eq("id", file_id).execute()
+
+    def abort_document(self, lease: DocumentLease, error: Exception) -> bool:
+        """
+        After a failed add: if the error was transient, keep the partial
+        document and release its lease so a retry can resume it right away;
+        else delete it. Either only while this ingest still owns it.
+        Returns True if kept.
+        """
+        lease.stop()
+        try:
+            if is_transient(error):
+                logger.warning(f"Keeping partial document {lease.file_id} to resume after: {error}")
+                self.update_owned(lease.file_id, lease.owner, dict(lease.metadata, lease_expires=time.time()))
+                return True
+            self.delete_owned(lease.file_id, lease.owner)
+        except Exception as e:
+            logger.error(f"Could not clean up partial document {lease.file_id}: {e}")
+        return False
+
+    def sweep_partial_documents(self, older_than: float, page_size: int = 1000) -> int:
+        """
+        Delete partial documents whose lease expired more than `older_than`
+        seconds ago (failed adds nobody retried), with their chunks.
+        Returns the number deleted.
+        """
+        cutoff = time.time() - older_than
+        stale = []
+        while True:
+            res = (
+                self.client.table("rag_files")
+                .select("id, metadata, created_at")
+                .eq("metadata->>ingest_state", PARTIAL)
+                .order("id")
+                .range(len(stale), len(stale) + page_size - 1)
+                .execute()
+            )
+            stale.extend(res.data)
+            if len(res.data) < page_size:
+                break
+        deleted = 0
+        for row in stale:
+            metadata = row.get("metadata") or {}
+            expired_at = metadata.get("lease_expires")
+            if expired_at is None:
+                # Left before leases existed: age by creation time
+                expired_at = datetime.fromisoformat(row["created_at"]).timestamp() if row.get("created_at") else 0
+            if expired_at < cutoff and self.delete_owned(row["id"], metadata.get("lease_owner")):
+                deleted += 1
+        if deleted:
+            print(f"DEBUG [sweep_partial_documents]: Deleted {deleted} abandoned partial documents")
+        return deleted
+
+    def find_document(self, content_key: str, user_id: str = None, workspace_id: str = None) -> Dict[str, Any] | None:
+        """
+        Return the newest rag_files row ingested from the same content, if
+        any; only from one user's workspace when those are given.
+        """
+        try:
+            query = self.client.table("rag_files").select("id, metadata").eq("metadata->>content_key", content_key)
+            if user_id and workspace_id:
+                query = query.eq("user_id", user_id).eq("workspace_id", workspace_id)
+            res = query.order("created_at", desc=True).limit(1).execute()
+            return res.data[0] if res.data else None
+        except Exception as e:
+            logger.error(f"Dedup lookup error: {str(e)}")
+            return None
+
+    def fetch_file_chunks(self, file_id: str, page_size: int = 1000) -> List[Dict[str, Any]]:
+        """
+        All chunks (with embeddings) of one document, in chunk order.
+        """
+        rows = []
+        while True:
+            res = (
+                self.client.table("rag_chunks")
+                .select("id, file_id, chunk_index, chunk_text, embedding, metadata")
+                .eq("file_id", file_id)
+                .order("chunk_index")
+                .range(len(rows), len(rows) + page_size - 1)
+                .execute()
+            )
+            rows.extend(res.data)
+            if len(res.data) < page_size:
+                return rows
+
+    def fetch_workspace_chunks(self, user_id: str, workspace_id: str, page_size: int = 1000) -> List[Dict[str, Any]]:
+        """
+        All chunks (with embeddings) of a user's workspace, for building a local index.
+        """
+        files_res = (
+            self.client.table("rag_files")
+            .select("id, metadata")
+            .eq("user_id", user_id)
+            .eq("workspace_id", workspace_id)
+            .execute()
+        )
+        file_ids = [f["id"] for f in files_res.data if not is_partial(f)]
+        if not file_ids:
+            return []
+
+        rows = []
+        while True:
+            res = (
+                self.client.table("rag_chunks")
+                .select("id, file_id, chunk_index, chunk_text, embedding, metadata")
+                .in_("file_id", file_ids)
+                .order("id")
+                .range(len(rows), len(rows) + page_size - 1)
+                .execute()
+            )
+            rows.extend(res.data)
+            if len(res.data) < page_size:
+                return rows
+
+    def copy_document(self, source_file_id: str, expected_chunks: int, **doc_fields) -> str | None:
+        """
+        Create a new document (for another user/workspace) by copying the stored
+        chunks and embeddings of an existing one, so nothing is re-downloaded or
+        re-embedded. Returns None if the source is missing or incomplete.
+        doc_fields are passed through to add_document.
+        """
+        rows = self.fetch_file_chunks(source_file_id)
+        if not rows or len(rows) != expected_chunks:
+            print(f"DEBUG [copy_document]: Source {source_file_id} has {len(rows)}/{expected_chunks} chunks, not copying")
+            return None
+
+        chunks = [
+            {"text": r["chunk_text"], "type": (r.get("metadata") or {}).get("type", "body"), "section": (r.get("metadata") or {}).get("section")}
+            for r in rows
+        ]
+        # Embeddings come back in pgvector text form and are inserted as-is
+        embeddings = [r["embedding"] for r in rows]
+        print(f"DEBUG [copy_document]: Copying {len(rows)} chunks from {source_file_id}")
+        return self.add_document(chunks=chunks, embeddings=embeddings, chunking=f"copy:{source_file_id}", **doc_fields)
+
     def similarity_search(self, user_id: str, query_embedding: List[float], top_k: int = 5, match_threshold: float = 0.5, workspace_id: str = None) -> List[Dict[str, Any]]:
         """
         Search for similar chunks using pgvector match_rag_chunks function.
@@ -93,3 +508,4 @@ class SupabaseVectorStore:
         except Exception as e:
             logger.error(f"Search error: {str(e)}")
             return []
+
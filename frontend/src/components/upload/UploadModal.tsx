@@ -130,7 +130,7 @@ const UploadModal = ({ open, onOpenChange, defaultWorkspaceId }: UploadModalProp
                     f.id === uploadedFile.id ? { ...f, status: 'complete', progress: 100 } : f
                 )
             );
-            toast.success(`"${file.name}" uploaded and indexed successfully`);
+            toast.success(`"${file.name}" uploaded, indexing in the background`);
 
         } catch (error: any) {
             console.error(error);
@@ -137,7 +137,7 @@ const WorkspaceDetail = () => {
             } else {
                 const data = await res.json();
                 console.log("✅ [handleAddPaper] Success:", data);
-                toast({ title: "Success", description: "Paper added to workspace" });
+                toast({ title: "Success", description: "Paper added, indexing in the background" });
             }
 
         } catch (error) {